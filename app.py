@@ -1,78 +1,69 @@
 import os
-import logging
 from flask import Flask
-from services import api_bp, admin_api_bp, admin_ui_bp, ui_bp
+from services.settings import Settings, SettingsConfig, load_settings
 
 
-DEFAULT_GROUPS_FILE = "/home/tux/sh1re/transferdepot-001/groups.json"
-DEFAULT_UPLOAD_FOLDER = "/home/tux/sh1re/transferdepot-001/files"
-DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
-DEFAULT_STATUS_FOLDER = os.path.join(os.path.dirname(__file__), "run", "status")
-DEFAULT_HEARTBEAT_INTERVAL = 30  # seconds
-DEFAULT_HEARTBEAT_RETENTION = 180  # seconds
-DEFAULT_RETENTION_DEFAULT_DAYS = 28
-DEFAULT_ONCALL_DIR = "/home/tux/transferdepot-001/artifacts/ONCALL"
-DEFAULT_ONCALL_FILE = "oncall_board.pdf"
+def create_app(config=None):
+    """Build the TransferDepot app.
 
+    ``config`` is either a ``Settings`` or a mapping of app.config keys that
+    override what the TD_* environment says; keys that are not settings are
+    copied into app.config as-is (handy for TESTING and the like). Settings
+    keys are read-only afterwards. Background services and caches belong to
+    the process and are set up by the first app only.
+    """
+    if isinstance(config, Settings):
+        settings, extra = config, {}
+    else:
+        extra = dict(config or {})
+        settings = load_settings(overrides=extra)
+        extra = {key: value for key, value in extra.items() if key.lower() not in Settings._fields}
 
-def _parse_retention_overrides(raw: str):
-    overrides = {}
-    if not raw:
-        return overrides
-    for part in raw.split(","):
-        piece = part.strip()
-        if not piece:
-            continue
-        if ":" not in piece:
-            continue
-        key, value = piece.split(":", 1)
-        key = key.strip()
-        try:
-            overrides[key] = int(value.strip())
-        except ValueError:
-            continue
-    return overrides
+    from services.files import UploadRequest
 
-app = Flask(__name__)
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    app.config = SettingsConfig(settings, app.root_path, app.config)
+    app.config.update(extra)
 
-app.config.from_mapping(
-    GROUPS_FILE=os.getenv("TD_GROUPS_FILE", DEFAULT_GROUPS_FILE),
-    UPLOAD_FOLDER=os.getenv("TD_UPLOAD_FOLDER", DEFAULT_UPLOAD_FOLDER),
-    UPLOAD_CHUNK_SIZE=int(os.getenv("TD_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)),
-    STATUS_FOLDER=os.getenv("TD_STATUS_FOLDER", DEFAULT_STATUS_FOLDER),
-    HEARTBEAT_INTERVAL=int(os.getenv("TD_HEARTBEAT_INTERVAL", DEFAULT_HEARTBEAT_INTERVAL)),
-    HEARTBEAT_RETENTION=int(os.getenv("TD_HEARTBEAT_RETENTION", DEFAULT_HEARTBEAT_RETENTION)),
-    RETENTION_DEFAULT_DAYS=int(os.getenv("TD_RETENTION_DEFAULT_DAYS", DEFAULT_RETENTION_DEFAULT_DAYS)),
-    ONCALL_DIR=os.getenv("TD_ONCALL_DIR", DEFAULT_ONCALL_DIR),
-    ONCALL_FILE=os.getenv("TD_ONCALL_FILE", DEFAULT_ONCALL_FILE),
-)
+    for folder in settings.folders():
+        os.makedirs(folder, exist_ok=True)
 
-app.config["RETENTION_OVERRIDES"] = _parse_retention_overrides(
-    os.getenv("TD_RETENTION_OVERRIDES", "")
-)
+    from services.logs import init_request_logging, setup_logging
 
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-os.makedirs(app.config["STATUS_FOLDER"], exist_ok=True)
+    setup_logging(settings)
+    app.logger.setLevel(settings.log_level)
+    app.logger.debug("Config loaded", extra={"settings": settings._asdict()})
+    init_request_logging(app)
 
-logging.basicConfig(level=logging.DEBUG)
-app.logger.debug(
-    "Config loaded", extra={
-        "upload_folder": app.config["UPLOAD_FOLDER"],
-        "groups_file": app.config["GROUPS_FILE"],
-        "chunk_size": app.config["UPLOAD_CHUNK_SIZE"],
-        "status_folder": app.config["STATUS_FOLDER"],
-        "heartbeat_interval": app.config["HEARTBEAT_INTERVAL"],
-        "retention_default_days": app.config["RETENTION_DEFAULT_DAYS"],
-        "retention_overrides": app.config["RETENTION_OVERRIDES"],
-        "oncall_dir": app.config["ONCALL_DIR"],
-        "oncall_file": app.config["ONCALL_FILE"],
-    }
-)
+    from services import admin_api_bp, admin_ui_bp, api_bp, ui_bp
+    from services.cache import configure_caches
+    from services.files import start_retention
+    from services.pipeline import start_pipeline
+    from services.replication import start_replicator
+    from services.runtime import run_warmups
+    from services.storage import start_rebalancer
+    from services.sysstats import start_collector
+    from services.telemetry import start_sampler
 
-app.register_blueprint(admin_ui_bp)
-app.register_blueprint(admin_api_bp)
-app.register_blueprint(ui_bp)
-app.register_blueprint(api_bp, url_prefix="/api/v1")
+    app.register_blueprint(admin_ui_bp)
+    app.register_blueprint(admin_api_bp)
+    app.register_blueprint(ui_bp)
+    app.register_blueprint(api_bp, url_prefix="/api/v1")
+
+    configure_caches(app.config)
+    start_sampler(app.config)
+    start_collector(app.config)
+    start_replicator(app.config)
+    start_pipeline(app.config)
+    start_rebalancer(app.config)
+    start_retention(app)
+    if settings.warmup:
+        run_warmups(app)
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
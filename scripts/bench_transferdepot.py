@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""Small benchmark harness for TransferDepot hot paths.
+
+Runs against a throwaway upload/status folder so it is safe on DEV boxes:
+
+    python3 scripts/bench_transferdepot.py write-policy --size-mb 512
+    python3 scripts/bench_transferdepot.py startup --rounds 5
+    python3 scripts/bench_transferdepot.py listing --files 100000
+    python3 scripts/bench_transferdepot.py chunks --size-mb 64 --link-mbps 8 --link-mbps 0
+
+Each benchmark prints one line per variant so results can be pasted into
+tickets or diffed between hosts.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _prepare_env(workdir):
+    os.environ["TD_UPLOAD_FOLDER"] = os.path.join(workdir, "files")
+    os.environ["TD_STATUS_FOLDER"] = os.path.join(workdir, "status")
+    os.environ["TD_GROUPS_FILE"] = os.path.join(workdir, "groups.json")
+    for name in ("CHANGES", "TELEMETRY", "PIPELINE", "REPLICATE", "STORAGE", "SIGNATURES"):
+        os.environ[f"TD_{name}_FOLDER"] = os.path.join(workdir, name.lower())
+    os.environ["TD_TELEMETRY_INTERVAL"] = "0"
+    os.environ["TD_SYSSTATS_INTERVAL"] = "0"
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def _make_source(workdir, size_mb):
+    path = os.path.join(workdir, "source.bin")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as out:
+        for _ in range(size_mb):
+            out.write(block)
+    return path
+
+
+def _upload_once(app, group, source, name):
+    from werkzeug.datastructures import FileStorage
+    from services.files import save_file
+
+    size = os.path.getsize(source)
+    with open(source, "rb") as stream, app.app_context():
+        storage = FileStorage(stream=stream, filename=name, content_length=size)
+        started = time.monotonic()
+        save_file(group, storage)
+        return size, time.monotonic() - started
+
+
+def bench_write_policy(args, workdir):
+    from app import create_app
+
+    source = _make_source(workdir, args.size_mb)
+    policies = args.policies or [
+        "none",
+        "none+dontneed",
+        "fsync-on-complete",
+        "fsync-on-complete+dontneed",
+        "fsync-every-64-MB",
+        "fsync-every-64-MB+dontneed",
+    ]
+    for index, policy in enumerate(policies):
+        app = create_app({"WRITE_POLICY": policy})
+        if not index:
+            print(f"write-policy: {args.size_mb} MB x {args.rounds} rounds, chunk {app.config['UPLOAD_CHUNK_SIZE']} bytes")
+        best = None
+        for round_no in range(args.rounds):
+            size, elapsed = _upload_once(app, "BENCH", source, f"bench-{round_no}.bin")
+            best = elapsed if best is None else min(best, elapsed)
+        rate = (size / (1024 * 1024)) / best if best else 0.0
+        print(f"  {policy:<28} best {best:7.3f}s  {rate:8.1f} MB/s")
+
+
+_STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import flask, services
+imported = time.perf_counter()
+from app import app  # module-level create_app(), as uWSGI loads it
+created = time.perf_counter()
+client = app.test_client()
+timings = {"import": imported - started, "create_app": created - imported}
+for url in sys.argv[1:]:
+    t0 = time.perf_counter()
+    client.get(url)
+    timings[url] = time.perf_counter() - t0
+timings["warmups"] = app.config.get("WARMUP_TIMINGS", {})
+print(json.dumps(timings))
+"""
+
+
+def bench_startup(args, workdir):
+    """Cold import / create_app / first-request latency, one fresh interpreter per round."""
+    os.makedirs(os.path.join(workdir, "files", "BENCH"), exist_ok=True)
+    with open(os.environ["TD_GROUPS_FILE"], "w") as f:
+        json.dump(["BENCH"], f)
+    env = dict(os.environ)
+    urls = ["/", "/api/v1/files/BENCH", "/admin/health"]
+    print(f"startup: {args.rounds} rounds, python {sys.version.split()[0]}")
+    for warm in ("1", "0"):
+        env["TD_WARMUP"] = warm
+        rounds = []
+        for _ in range(args.rounds):
+            out = subprocess.run(
+                [sys.executable, "-c", _STARTUP_PROBE] + urls,
+                cwd=ROOT, env=env, stdout=subprocess.PIPE, check=True,
+            ).stdout
+            rounds.append(json.loads(out.decode().strip().splitlines()[-1]))
+        label = "warm-up" if warm == "1" else "no warm-up"
+        for key in ["import", "create_app"] + urls:
+            best = min(r[key] for r in rounds) * 1000
+            print(f"  {label:<11} {key:<22} best {best:8.2f} ms")
+        if warm == "1":
+            for name, seconds in sorted(rounds[-1]["warmups"].items()):
+                print(f"  {label:<11} hook {name:<17} {seconds * 1000:8.2f} ms")
+
+
+def bench_listing(args, workdir):
+    """Merged listing and single-file lookup in one big group, flat vs fanned out."""
+    import random
+
+    from app import app
+    from services import storage
+
+    group_dir = os.path.join(workdir, "files", "BENCH")
+    os.makedirs(group_dir, exist_ok=True)
+    names = [f"file-{index:07d}.bin" for index in range(args.files)]
+    for name in names:
+        open(os.path.join(group_dir, name), "wb").close()
+    probes = random.sample(names, min(len(names), 1000))
+    print(f"listing: {args.files} files x {args.rounds} rounds")
+    with app.app_context():
+        vols = storage.volumes()
+        for layout in ("flat", "fan-out"):
+            if layout == "fan-out":
+                moved, seconds = storage.migrate_group("BENCH", vols)
+                print(f"  migrate {moved} files {seconds * 1000:10.1f} ms")
+            for label, run in (
+                ("scan_group", lambda: storage.scan_group("BENCH", vols)),
+                ("find_file x1000", lambda: [storage.find_file("BENCH", name, vols) for name in probes]),
+            ):
+                best = None
+                for _ in range(args.rounds):
+                    started = time.monotonic()
+                    run()
+                    elapsed = time.monotonic() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                print(f"  {layout:<8} {label:<16} best {best * 1000:10.1f} ms")
+
+
+class _Link:
+    """``wsgi.input`` that delivers at most ``bps`` bytes per second, like a client on a slow link.
+
+    ``parts`` are byte strings and open files, sent one after the other.
+    """
+
+    def __init__(self, parts, bps):
+        self.parts = list(parts)
+        self.bps = bps
+        self.started = None
+        self.sent = 0
+
+    def read(self, size=-1):
+        if self.started is None:
+            self.started = time.monotonic()
+        data = b""
+        while self.parts and not data:
+            part = self.parts[0]
+            if isinstance(part, bytes):
+                data, rest = (part, b"") if size is None or size < 0 else (part[:size], part[size:])
+                if rest:
+                    self.parts[0] = rest
+                else:
+                    self.parts.pop(0)
+            else:
+                data = part.read(size)
+                if not data:
+                    self.parts.pop(0)
+        self.sent += len(data)
+        if self.bps:
+            delay = self.started + self.sent / self.bps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _form_post(app, url, source, name, bps):
+    """POST ``source`` as an upload form through the WSGI app, body read from a throttled ``wsgi.input``."""
+    from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+    boundary = "bench-boundary"
+    head = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    with open(source, "rb") as f:
+        environ = EnvironBuilder(path=url, method="POST").get_environ()
+        environ["CONTENT_TYPE"] = f"multipart/form-data; boundary={boundary}"
+        environ["CONTENT_LENGTH"] = str(len(head) + os.path.getsize(source) + len(tail))
+        environ["wsgi.input"] = _Link([head, f, tail], bps)
+        started = time.monotonic()
+        body, status, _ = run_wsgi_app(app, environ, buffered=True)
+        elapsed = time.monotonic() - started
+    if not status.startswith("200"):
+        raise SystemExit(f"upload failed: {status} {b''.join(body)[:200]!r}")
+    return elapsed
+
+
+def bench_chunks(args, workdir):
+    """Upload read sizes: static TD_CHUNK_SIZE values against adaptive sizing, per link speed.
+
+    Each upload is a form POST through the WSGI app, so sizes and timings are
+    those of reads from the request body, as a client on that link would see.
+    """
+    from app import create_app
+
+    source = _make_source(workdir, args.size_mb)
+    size = os.path.getsize(source)
+    variants = [
+        ("static 1M", create_app({"UPLOAD_CHUNK_ADAPTIVE": False, "UPLOAD_CHUNK_SIZE": 1024 * 1024})),
+        ("static 8M", create_app({"UPLOAD_CHUNK_ADAPTIVE": False, "UPLOAD_CHUNK_SIZE": 8 * 1024 * 1024})),
+        ("adaptive", create_app({"UPLOAD_CHUNK_ADAPTIVE": True})),
+    ]
+    config = variants[-1][1].config
+    print(f"chunks: {args.size_mb} MB, adaptive {config['UPLOAD_CHUNK_MIN']}-{config['UPLOAD_CHUNK_MAX']} bytes")
+    for mbps in args.link_mbps or [8.0, 0.0]:
+        link = f"{mbps:g} MB/s" if mbps else "unthrottled"
+        for label, app in variants:
+            name = f"chunks-{label.replace(' ', '-')}.bin"
+            elapsed = _form_post(app, "/api/v1/upload/BENCH", source, name, mbps * 1024 * 1024)
+            with open(os.path.join(workdir, "status", "BENCH", f"{name}.json")) as f:
+                chunks = json.load(f)["chunks"]
+            print(
+                f"  {link:<12} {label:<10} {elapsed:7.3f}s  {size / (1024 * 1024) / elapsed:8.1f} MB/s  "
+                f"{chunks['reads']:>6} reads  avg {chunks['avg_read_bytes']:>9} B / {chunks['avg_read_ms']:8.3f} ms"
+                f"  largest {chunks['largest']:>8} B"
+            )
+
+
+BENCHMARKS = {
+    "chunks": bench_chunks,
+    "listing": bench_listing,
+    "startup": bench_startup,
+    "write-policy": bench_write_policy,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--files", type=int, default=100000, help="files in the group for the listing benchmark")
+    parser.add_argument("--link-mbps", type=float, action="append",
+                        help="client link speed for the chunks benchmark in MB/s, 0 unthrottled (repeatable)")
+    parser.add_argument("--policy", dest="policies", action="append",
+                        help="write policy to measure (repeatable)")
+    parser.add_argument("--workdir", help="directory on the filesystem under test")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        _prepare_env(workdir)
+        BENCHMARKS[args.benchmark](args, workdir)
+
+
+if __name__ == "__main__":
+    main()
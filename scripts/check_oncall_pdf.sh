@@ -1,8 +1,12 @@
 #!/usr/bin/env bash
 # Check that the on-call PDF is well-formed and the HTTP endpoint serves it.
+# The structural check uses TransferDepot's own validator (services/pdfcheck.py),
+# the same one the app runs on upload, so qpdf is no longer required.
 set -euo pipefail
 
 BASE_DIR="${TD_BASE_DIR:-/home/tux/transferdepot-001}"
+APP_DIR="${TD_APP_DIR:-/home/tux/transferdepot}"
+PYTHON="${TD_PYTHON:-python3}"
 PDF_PATH="${TD_ONCALL_PDF:-${BASE_DIR}/artifacts/ONCALL/oncall_board.pdf}"
 ONCALL_URL="${TD_ONCALL_URL:-http://localhost/oncall/oncall_board.pdf}"
 LOG_FILE="${TD_ONCALL_LOG:-${BASE_DIR}/logs/oncall-check.log}"
@@ -26,7 +30,7 @@ require_command() {
   fi
 }
 
-require_command qpdf
+require_command "$PYTHON"
 require_command curl
 
 status=0
@@ -36,10 +40,10 @@ if [[ ! -f "$PDF_PATH" ]]; then
   log "ERROR: PDF not found at $PDF_PATH"
   status=1
 else
-  if qpdf --check "$PDF_PATH" >/dev/null 2>&1; then
-    log "OK: qpdf validation passed"
+  if result="$("$PYTHON" "$APP_DIR/services/pdfcheck.py" "$PDF_PATH" 2>&1)"; then
+    log "OK: PDF validation passed ($result)"
   else
-    log "ERROR: qpdf validation FAILED"
+    log "ERROR: PDF validation FAILED ($result)"
     status=1
   fi
 fi
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Convert upload groups between the flat and the hashed fan-out layout.
+
+Works in place on every storage volume while the service keeps running:
+
+    python3 scripts/fanout_groups.py SHIRE_GATEWAY            # flat -> <group>/_3f/<file>
+    python3 scripts/fanout_groups.py --all
+    python3 scripts/fanout_groups.py SHIRE_GATEWAY --flat     # back to one directory
+
+Uses the same TD_* environment as the service. Add the groups to
+TD_STORAGE_FANOUT_GROUPS as well, otherwise a group converted back with
+--flat is fanned out again by its next upload. Files being uploaded during
+the run stay where they are; running the tool again moves them.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("groups", nargs="*", help="group names (case-sensitive directory names)")
+    parser.add_argument("--all", action="store_true", help="every group found on the volumes")
+    parser.add_argument("--flat", action="store_true", help="convert back to a single directory per group")
+    args = parser.parse_args(argv)
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from services.settings import load_settings
+    from services.storage import group_names, migrate_group, pool_volumes
+
+    vols = pool_volumes(load_settings().as_config())
+    groups = group_names(vols) if args.all else args.groups
+    if not groups:
+        parser.error("name at least one group or use --all")
+
+    layout = "flat" if args.flat else "fan-out"
+    for group in groups:
+        moved, seconds = migrate_group(group, vols, flat=args.flat)
+        print(f"{group:<24} {layout:<8} moved {moved:>8} files in {seconds:7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""Command-line transfer client for TransferDepot (stdlib only, Python 3.6+).
+
+    python3 scripts/td.py push SHIRE_GATEWAY build/*.tar
+    python3 scripts/td.py pull SHIRE_GATEWAY ./incoming --since 2024-05-01
+    python3 scripts/td.py sync SHIRE_GATEWAY ./mirror --jobs 8
+
+``--server`` (or ``TD_SERVER``) names the depot, e.g. ``https://virtca8-td``;
+options go after the command.
+
+Files move concurrently on ``--jobs`` threads that share a pool of
+keep-alive connections; bodies are streamed from/to disk in 1 MB blocks.
+Uploads use the resumable ``PUT /api/v1/upload/<group>/<file>`` and
+downloads resume a ``.td-part`` file with ``Range``/``If-Range``, so a retry
+continues where the last attempt stopped.
+
+Unchanged files are skipped from the listing's size and mtime: ``pull``
+stamps downloaded files with the server's mtime, and ``sync`` (push what is
+newer here, then pull what is newer there) also stamps pushed files with
+the server's mtime so the next run sees them as equal. Groups are flat;
+directories are not walked recursively.
+"""
+import argparse
+import calendar
+import http.client
+import json
+import os
+import queue
+import ssl
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlencode, urlsplit
+
+BLOCK = 1024 * 1024
+PART_SUFFIX = ".td-part"
+
+
+class TransferError(Exception):
+    pass
+
+
+def _parse_mtime(value):
+    """The listing's ISO-8601 UTC mtime as a timestamp (3.6 has no fromisoformat)."""
+    stamp, _, fraction = value[:19], value[19:20], value[20:26]
+    seconds = calendar.timegm(time.strptime(stamp, "%Y-%m-%dT%H:%M:%S"))
+    if _ == "." and fraction.isdigit():
+        seconds += int(fraction) / 10.0 ** len(fraction)
+    return seconds
+
+
+def _format_bytes(value):
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return "%.1f %s" % (value, unit)
+        value /= 1024.0
+    return "%.1f TB" % value
+
+
+class ConnectionPool:
+    """Idle keep-alive connections to one server, shared by the worker threads."""
+
+    def __init__(self, base_url, timeout, context=None):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("server must be an http:// or https:// URL")
+        self.https = parts.scheme == "https"
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.context = context
+        self._idle = queue.LifoQueue()
+
+    def get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        if self.https:
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout, context=self.context)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def put(self, conn):
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Client:
+    def __init__(self, pool, retries):
+        self.pool = pool
+        self.retries = retries
+
+    def _url(self, *parts, **query):
+        path = self.pool.prefix + "/api/v1/" + "/".join(quote(part, safe="") for part in parts)
+        query = {key: value for key, value in query.items() if value is not None}
+        return path + ("?" + urlencode(query) if query else "")
+
+    def _attempts(self, call):
+        """Run ``call(conn)`` with a pooled connection, retrying with backoff."""
+        for attempt in range(self.retries + 1):
+            conn = self.pool.get()
+            try:
+                result = call(conn, attempt)
+            except (OSError, http.client.HTTPException, TransferError) as exc:
+                conn.close()  # the server may have half-read a body; never reuse it
+                if attempt == self.retries:
+                    raise TransferError(str(exc) or exc.__class__.__name__) from None
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            self.pool.put(conn)
+            return result
+
+    def listing(self, group, since=None):
+        """name -> listing entry (size, mtime as timestamp, etag)."""
+        def call(conn, attempt):
+            conn.request("GET", self._url("files", group, since=since))
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise TransferError("listing %s returned %s: %s" % (group, response.status, body[:200]))
+            return json.loads(body.decode("utf-8"))
+
+        files = {}
+        for entry in self._attempts(call)["files"]:
+            entry["mtime_ts"] = _parse_mtime(entry["mtime"])
+            files[entry["name"]] = entry
+        return files
+
+    def upload(self, group, path, name):
+        """Stream ``path`` to ``group/name``; returns the bytes sent."""
+        size = os.path.getsize(path)
+        target = self._url("upload", group, name)
+        sent = [0]
+
+        def call(conn, attempt):
+            offset = 0
+            if attempt:
+                # continue from what the server kept of the previous attempt
+                conn.request("HEAD", target)
+                response = conn.getresponse()
+                response.read()
+                offset = int(response.getheader("Upload-Offset") or 0)
+                if offset > size:
+                    offset = 0
+            conn.putrequest("PUT", target, skip_accept_encoding=True)
+            conn.putheader("Content-Type", "application/octet-stream")
+            conn.putheader("Content-Length", str(size - offset))
+            conn.putheader("Upload-Offset", str(offset))
+            conn.putheader("Upload-Length", str(size))
+            conn.endheaders()
+            with open(path, "rb") as f:
+                f.seek(offset)
+                remaining = size - offset
+                while remaining:
+                    chunk = f.read(min(BLOCK, remaining))
+                    if not chunk:
+                        raise TransferError("%s shrank while sending" % path)
+                    conn.send(chunk)
+                    remaining -= len(chunk)
+                    sent[0] += len(chunk)
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise TransferError("upload returned %s: %s" % (response.status, body[:200]))
+            if not json.loads(body.decode("utf-8")).get("complete"):
+                raise TransferError("server holds only part of %s" % name)
+
+        self._attempts(call)
+        return sent[0]
+
+    def download(self, group, entry, dest):
+        """Stream ``entry`` into ``dest`` (via a resumable part file); returns the bytes received."""
+        part = dest + PART_SUFFIX
+        received = [0]
+
+        def call(conn, attempt):
+            have = os.path.getsize(part) if os.path.exists(part) else 0
+            if have >= entry["size"]:
+                os.unlink(part)  # cannot be a prefix of this version; start over
+                have = 0
+            headers = {}
+            if have and entry.get("etag"):
+                headers = {"Range": "bytes=%d-" % have, "If-Range": entry["etag"]}
+            conn.request("GET", self._url("files", group, entry["name"]), headers=headers)
+            response = conn.getresponse()
+            if response.status == 200:
+                mode = "wb"  # full body: the part file (if any) was a different version
+            elif response.status == 206:
+                mode = "ab"
+            else:
+                body = response.read()
+                raise TransferError("download returned %s: %s" % (response.status, body[:200]))
+            with open(part, mode) as out:
+                while True:
+                    chunk = response.read(BLOCK)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    received[0] += len(chunk)
+            if os.path.getsize(part) != entry["size"]:
+                raise TransferError("got %d of %d bytes" % (os.path.getsize(part), entry["size"]))
+
+        self._attempts(call)
+        os.utime(part, (entry["mtime_ts"], entry["mtime_ts"]))
+        os.replace(part, dest)
+        return received[0]
+
+
+class Report:
+    def __init__(self, verb, quiet):
+        self.verb = verb
+        self.quiet = quiet
+        self.files = self.bytes = self.skipped = self.failed = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def done(self, name, nbytes, seconds):
+        with self._lock:
+            self.files += 1
+            self.bytes += nbytes
+        if not self.quiet:
+            rate = nbytes / seconds if seconds > 0 else 0
+            print("%s %s  %s  %s/s" % (self.verb, name, _format_bytes(nbytes), _format_bytes(rate)), flush=True)
+
+    def error(self, name, exc):
+        with self._lock:
+            self.failed += 1
+        print("FAILED %s %s: %s" % (self.verb, name, exc), file=sys.stderr, flush=True)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.bytes / elapsed if elapsed > 0 else 0
+        return "%s %d files, %s in %.1fs = %s/s (skipped %d unchanged, %d failed)" % (
+            self.verb, self.files, _format_bytes(self.bytes), elapsed, _format_bytes(rate),
+            self.skipped, self.failed,
+        )
+
+
+def _run(tasks, jobs, report):
+    """Run ``(name, fn)`` tasks on ``jobs`` threads; ``fn`` returns bytes moved."""
+    def timed(fn):
+        started = time.monotonic()
+        return fn(), time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        futures = {pool.submit(timed, fn): name for name, fn in tasks}
+        for future in as_completed(futures):
+            try:
+                nbytes, seconds = future.result()
+            except Exception as exc:
+                report.error(futures[future], exc)
+            else:
+                report.done(futures[future], nbytes, seconds)
+
+
+def _local_files(paths):
+    found = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in os.scandir(path):
+                if entry.is_file() and not entry.name.endswith(PART_SUFFIX):
+                    found[entry.name] = entry.path
+        elif os.path.isfile(path):
+            found[os.path.basename(path)] = path
+        else:
+            raise SystemExit("no such file or directory: %s" % path)
+    return found
+
+
+# mtimes within this many seconds count as equal (filesystem and listing precision)
+_SLACK = 1.0
+
+
+def _push_tasks(client, group, local, remote, report, newer_only=False):
+    """Upload what the server lacks; ``newer_only`` (sync) also ignores differing sizes there."""
+    tasks = []
+    for name, path in sorted(local.items()):
+        entry = remote.get(name)
+        if entry is not None:
+            st = os.stat(path)
+            not_newer = st.st_mtime <= entry["mtime_ts"] + _SLACK
+            if not_newer and (newer_only or st.st_size == entry["size"]):
+                report.skipped += 1
+                continue
+        tasks.append((name, lambda path=path, name=name: client.upload(group, path, name)))
+    return tasks
+
+
+def _pull_tasks(client, group, dest, remote, report, newer_only=False):
+    """Download what differs here; ``newer_only`` (sync) keeps local files that are newer."""
+    tasks = []
+    for name, entry in sorted(remote.items()):
+        path = os.path.join(dest, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        if st is not None:
+            same = st.st_size == entry["size"] and abs(st.st_mtime - entry["mtime_ts"]) <= _SLACK
+            if same or (newer_only and st.st_mtime + _SLACK >= entry["mtime_ts"]):
+                report.skipped += 1
+                continue
+        tasks.append((name, lambda entry=entry, path=path: client.download(group, entry, path)))
+    return tasks
+
+
+def cmd_push(client, args):
+    report = Report("pushed", args.quiet)
+    local = _local_files(args.paths)
+    _run(_push_tasks(client, args.group, local, client.listing(args.group), report), args.jobs, report)
+    return report
+
+
+def cmd_pull(client, args):
+    report = Report("pulled", args.quiet)
+    os.makedirs(args.dest, exist_ok=True)
+    remote = client.listing(args.group, since=args.since)
+    _run(_pull_tasks(client, args.group, args.dest, remote, report), args.jobs, report)
+    return report
+
+
+def cmd_sync(client, args):
+    os.makedirs(args.dir, exist_ok=True)
+    local = _local_files([args.dir])
+    remote = client.listing(args.group)
+
+    push = Report("pushed", args.quiet)
+    tasks = _push_tasks(client, args.group, local, remote, push, newer_only=True)
+    _run(tasks, args.jobs, push)
+    pushed = {name for name, _ in tasks}
+    remote = client.listing(args.group)
+    for name in pushed & set(remote):
+        # adopt the server's mtime so both sides compare equal next time
+        if remote[name]["size"] == os.path.getsize(local[name]):
+            os.utime(local[name], (remote[name]["mtime_ts"], remote[name]["mtime_ts"]))
+    print(push.summary())
+
+    pull = Report("pulled", args.quiet)
+    pending = {name: entry for name, entry in remote.items() if name not in pushed}
+    _run(_pull_tasks(client, args.group, args.dir, pending, pull, newer_only=True), args.jobs, pull)
+    pull.skipped += len(pushed)
+    return pull
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--server", default=os.environ.get("TD_SERVER", "http://127.0.0.1:8080"))
+    common.add_argument("--jobs", "-j", type=int, default=4, help="concurrent transfers (default 4)")
+    common.add_argument("--retries", type=int, default=3)
+    common.add_argument("--timeout", type=float, default=300, help="socket timeout in seconds")
+    common.add_argument("--cacert", help="CA bundle for https servers")
+    common.add_argument("--insecure", action="store_true", help="do not verify the server certificate")
+    common.add_argument("--quiet", "-q", action="store_true", help="only print the summary")
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    push = commands.add_parser("push", parents=[common], help="upload files (or every file in a directory)")
+    push.add_argument("group")
+    push.add_argument("paths", nargs="+")
+    pull = commands.add_parser("pull", parents=[common], help="download a group into a directory")
+    pull.add_argument("group")
+    pull.add_argument("dest", nargs="?", default=".")
+    pull.add_argument("--since", help="only files newer than this time (ISO-8601 or epoch)")
+    sync = commands.add_parser("sync", parents=[common], help="push newer local files, then pull newer remote ones")
+    sync.add_argument("group")
+    sync.add_argument("dir")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("choose push, pull or sync")
+
+    context = None
+    if urlsplit(args.server).scheme == "https":
+        context = ssl.create_default_context(cafile=args.cacert)
+        if args.insecure:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+    pool = ConnectionPool(args.server, args.timeout, context)
+    client = Client(pool, args.retries)
+    try:
+        report = {"push": cmd_push, "pull": cmd_pull, "sync": cmd_sync}[args.command](client, args)
+    except TransferError as exc:
+        raise SystemExit("td: %s" % exc)
+    finally:
+        pool.close()
+    print(report.summary())
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
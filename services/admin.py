@@ -11,83 +11,53 @@ from flask import (
     request,
     render_template,
     current_app,
-    send_file,
     abort,
-    make_response,
     url_for,
     redirect,
 )
 
-from .files import list_active_uploads, list_files, list_groups, list_recent_transfers
-# Local, dependency-free helpers so we can run on RHEL8 without sh1retools
-try:  # Prefer psutil if present, but fall back to lightweight probes
-    import psutil  # type: ignore
-except Exception:  # pragma: no cover - optional dependency
-    psutil = None
+from .cache import cache_stats
+from .download import send_stored_file
+from .logs import dropped_records
+from .files import list_active_uploads, list_groups, list_recent_transfers
+from . import storage
+from .pdfcheck import check_pdf
+from .pipeline import status as pipeline_status
+from .replication import status as replication_status
+from .runtime import warmup
+from .sysstats import SystemStatsCollector, get_collector, sparkline_points
+from .telemetry import parse_duration, query as telemetry_query
+from .timeutil import parse_time_arg
+
+_adhoc_stats = None
 
 
 def get_system_stats():
-    """Return a small system stats dict without external deps.
+    """Return the latest system stats sample without blocking the request.
 
-    Matches the rough shape expected by the admin/miniops template. Works with
-    psutil when available; otherwise returns a minimal payload.
+    Served from the background collector; if it is disabled we sample on
+    demand (CPU is then measured between successive calls).
     """
 
-    stats = {
-        "cpu_percent": None,
-        "memory_percent": None,
-        "disk_percent": None,
-        "load_avg": None,
-        "boot_time": None,
-    }
+    collector = get_collector()
+    if collector is not None:
+        latest = collector.latest()
+        if latest is not None:
+            return latest
 
-    if psutil:
-        try:
-            stats.update(
-                cpu_percent=psutil.cpu_percent(interval=0.1),
-                memory_percent=psutil.virtual_memory().percent,
-            )
-            try:
-                stats["disk_percent"] = psutil.disk_usage("/").percent
-            except Exception:
-                pass
-            try:
-                stats["load_avg"] = os.getloadavg()[0]
-            except Exception:
-                pass
-            try:
-                stats["boot_time"] = psutil.boot_time()
-            except Exception:
-                pass
-            return stats
-        except Exception:
-            # fall back to basic stats below
-            pass
-
-    # Minimal fallback using stdlib only
-    try:
-        stats["load_avg"] = os.getloadavg()[0]
-    except Exception:
-        pass
-    return stats
+    global _adhoc_stats
+    if _adhoc_stats is None:
+        _adhoc_stats = SystemStatsCollector(current_app.config.get("UPLOAD_FOLDER") or "/")
+    return _adhoc_stats.sample_once()
 
 
 def is_valid_pdf(path: str) -> bool:
-    """Lightweight PDF validation.
+    """Structural PDF validation (xref/trailer/object offsets), cached per file version.
 
-    We only require basic structure checks so we can run offline without qpdf.
+    Pure Python so we can run offline without qpdf.
     """
 
-    try:
-        with open(path, "rb") as f:
-            header = f.read(5)
-            if header != b"%PDF-":
-                return False
-            f.seek(-6, os.SEEK_END)
-            trailer = f.read().strip()
-            return trailer.endswith(b"%%EOF")
-    except Exception:
-        return False
+    return check_pdf(path).ok
 
 
 DEFAULT_ONCALL_DIR = "/home/tux/sh1re/transferdepot-001/artifacts/ONCALL"
@@ -104,16 +74,26 @@ def admin_healthz():
 
 @admin_api_bp.route("/telemetry", methods=["GET"])
 def telemetry():
+    """Serve bandwidth history from the built-in sampler.
+
+    ``range`` (e.g. ``1h``) or ``since``/``until`` pick the window, ``step``
+    (e.g. ``10s``) the resolution and ``fields`` limits the returned columns.
+    """
     try:
-        with open("/run/transferdepot/bwatch.json") as f:
-            data = json.load(f)
+        folder = current_app.config["TELEMETRY_FOLDER"]
+        until_ts = parse_time_arg(request.args.get("until"))
+        since_ts = parse_time_arg(request.args.get("since"))
+        window = parse_duration(request.args.get("range"))
+        if since_ts is None and window:
+            since_ts = (until_ts or time.time()) - window
+        step = parse_duration(request.args.get("step"))
 
         fields = request.args.get("fields")
         if fields:
-            keys = [k.strip() for k in fields.split(",") if k.strip()]
-            data = {k: v for k, v in data.items() if k in keys}
+            fields = [k.strip() for k in fields.split(",") if k.strip()]
+        data = telemetry_query(folder, since=since_ts, until=until_ts, step=step, fields=fields or None)
 
-        return jsonify(ok=True, **data)
+        return jsonify(ok=True, time=time.strftime("%Y-%m-%d %H:%M:%S"), **data)
     except Exception as exc:
         return (
             jsonify(
@@ -125,28 +105,19 @@ def telemetry():
         )
 
 
-def _group_summaries(upload_root: Path):
+def _group_summaries(vols):
     summaries = []
-    if not upload_root.exists():
-        return summaries
-
-    for group_path in sorted(p for p in upload_root.iterdir() if p.is_dir()):
-        files = list_files(group_path.name)
-        latest_ts = None
-        latest_name = None
-        for name in files:
-            full = group_path / name
-            try:
-                mtime = full.stat().st_mtime
-            except OSError:
-                continue
-            if latest_ts is None or mtime > latest_ts:
-                latest_ts = mtime
-                latest_name = name
+
+    # one merged scan per group; expiry is the retention sweeper's job, not the page's
+    for group in storage.group_names(vols):
+        files = storage.scan_group(group, vols)
+        latest = max(files, key=lambda item: item.mtime, default=None)
+        latest_ts = latest.mtime if latest else None
+        latest_name = latest.name if latest else None
 
         summaries.append(
             {
-                "group": group_path.name,
+                "group": group,
                 "file_count": len(files),
                 "latest_file": latest_name,
                 "last_updated": datetime.fromtimestamp(latest_ts).strftime(
@@ -195,7 +166,9 @@ def admin_health_page():
     cfg = current_app.config
     upload_root = Path(cfg["UPLOAD_FOLDER"])
     status_root = Path(cfg["STATUS_FOLDER"])
-    summaries = _group_summaries(upload_root)
+    vols = storage.volumes()
+    summaries = _group_summaries(vols)
+    volumes = [stats for stats in map(storage.volume_stats, vols) if stats is not None] if len(vols) > 1 else []
 
     active_uploads = []
     cutoff = time.time() - (24 * 60 * 60)
@@ -214,8 +187,19 @@ def admin_health_page():
     oncall_file = cfg.get("ONCALL_FILE") or os.getenv("TD_ONCALL_FILE") or DEFAULT_ONCALL_FILE
     oncall_path = _resolve_oncall_path(oncall_dir, oncall_file)
     oncall_url = None
+    oncall_check = None
     if oncall_path is not None:
         oncall_url = url_for("admin_ui.admin_oncall_document", filename=oncall_file)
+        oncall_check = check_pdf(str(oncall_path))
+
+    replication = None
+    if cfg.get("REPLICATE_PEERS"):
+        replication = replication_status(cfg["REPLICATE_FOLDER"], cfg["REPLICATE_PEERS"])
+        for peer in replication["peers"]:
+            if peer["last_done_ts"]:
+                peer["last_done_iso"] = datetime.fromtimestamp(peer["last_done_ts"]).strftime("%Y-%m-%d %H:%M:%S")
+
+    pipeline = pipeline_status(cfg["PIPELINE_FOLDER"]) if cfg.get("PIPELINE_FOLDER") else None
 
     return render_template(
         "admin/health.html",
@@ -224,10 +208,19 @@ def admin_health_page():
         heartbeat_interval=cfg.get("HEARTBEAT_INTERVAL"),
         retention_default=cfg.get("RETENTION_DEFAULT_DAYS"),
         retention_overrides=cfg.get("RETENTION_OVERRIDES", {}),
+        write_policy=cfg.get("WRITE_POLICY", "none"),
+        write_policy_overrides=cfg.get("WRITE_POLICY_OVERRIDES", {}),
         summaries=summaries,
         active_uploads=active_uploads,
         transfers=transfers,
         oncall_url=oncall_url,
+        oncall_check=oncall_check,
+        replication=replication,
+        pipeline=pipeline,
+        caches=cache_stats(),
+        volumes=volumes,
+        storage_placement=cfg.get("STORAGE_PLACEMENT", "file"),
+        replication_groups=cfg.get("REPLICATE_GROUPS", ()),
         api_health_url="/api/v1/admin/healthz",
     )
 
@@ -294,13 +287,49 @@ def groups_admin():
 @admin_ui_bp.route("/miniops")
 def admin_miniops():
     stats = {}
+    sparklines = {}
     error = None
     try:
         stats = get_system_stats()
+        collector = get_collector()
+        if collector is not None:
+            for key in ("cpu_percent", "memory_percent", "disk_percent", "load_avg"):
+                sparklines[key] = sparkline_points(collector.series(key))
     except Exception as exc:
         error = str(exc)
 
-    return render_template("admin/miniops.html", stats=stats, error=error)
+    def _fmt(ts):
+        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else None
+
+    return render_template(
+        "admin/miniops.html",
+        stats=stats,
+        sampled_at=_fmt(stats.get("ts")) if stats else None,
+        booted_at=_fmt(stats.get("boot_time")) if stats else None,
+        sparklines=sparklines,
+        interval=current_app.config.get("SYSSTATS_INTERVAL"),
+        error=error,
+    )
+
+
+@admin_ui_bp.route("/requests")
+def admin_slow_requests():
+    slow = current_app.extensions.get("td_slow_requests")
+    rows = []
+    for entry in slow.snapshot() if slow is not None else []:
+        row = dict(entry)
+        row["time"] = datetime.fromtimestamp(entry["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+        rows.append(row)
+    settings = current_app.config["SETTINGS"]
+    return render_template(
+        "admin/requests.html",
+        rows=rows,
+        pid=os.getpid(),
+        threshold_ms=settings.slow_request_ms,
+        keep=settings.slow_request_keep,
+        sample=dict(settings.log_sample),
+        dropped=dropped_records(),
+    )
 
 
 @admin_ui_bp.route("/oncall")
@@ -315,6 +344,7 @@ def admin_oncall_status():
     error = None
     last_updated_iso = None
     is_stale = False
+    check = None
 
     if target:
         try:
@@ -322,7 +352,8 @@ def admin_oncall_status():
             last_updated_iso = datetime.fromtimestamp(stat.st_mtime).isoformat()
             is_stale = (time.time() - stat.st_mtime) > (14 * 24 * 60 * 60)
 
-            if is_valid_pdf(str(target)):
+            check = check_pdf(str(target))
+            if check.ok:
                 status = "valid"
                 pdf_url = url_for("admin_ui.admin_oncall_document", filename=oncall_file)
                 if is_stale:
@@ -342,6 +373,7 @@ def admin_oncall_status():
         configured_oncall_dir=oncall_dir,
         last_updated_iso=last_updated_iso,
         is_stale=is_stale,
+        check=check,
         error=error,
     )
 
@@ -359,20 +391,43 @@ def admin_oncall_document(filename):
     if target is None:
         abort(404)
 
-    response = make_response(
-        send_file(str(target), mimetype="application/pdf", as_attachment=False)
-    )
+    # body from the LRU cache; ETag/Last-Modified let viewers revalidate with a 304
+    response = send_stored_file(target)
     response.headers["Content-Disposition"] = f'inline; filename="{oncall_file}"'
-    response.headers["Cache-Control"] = "no-store, must-revalidate"
+    response.headers["Cache-Control"] = "no-cache, must-revalidate"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
     response.headers["X-Content-Type-Options"] = "nosniff"
     return response
 
 
+_WARM_TEMPLATES = (
+    "index.html",
+    "upload.html",
+    "status.html",
+    "admin/health.html",
+    "admin/miniops.html",
+    "admin/oncall.html",
+    "admin/requests.html",
+)
+
+
+@warmup
+def warm_health():
+    """Compile the page templates and validate the on-call PDF once up front."""
+    for name in _WARM_TEMPLATES:
+        current_app.jinja_env.get_template(name)
+    cfg = current_app.config
+    oncall_path = _resolve_oncall_path(
+        cfg.get("ONCALL_DIR") or DEFAULT_ONCALL_DIR, cfg.get("ONCALL_FILE") or DEFAULT_ONCALL_FILE
+    )
+    if oncall_path is not None:
+        check_pdf(str(oncall_path))
+
+
 # Public helper retained for other modules/tests
 def get_group_summaries(upload_path):
-    return _group_summaries(Path(upload_path))
+    return _group_summaries([Path(upload_path)])
 
 
 def _resolve_oncall_path(oncall_dir: Optional[str], oncall_file: str) -> Optional[Path]:
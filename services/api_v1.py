@@ -1,36 +1,38 @@
-from flask import Blueprint, request, current_app, jsonify, send_from_directory
+from flask import Blueprint, request, current_app, jsonify
 import os
+import math
+import random
+import time
 import datetime
-from services.files import save_file, list_recent_transfers
+from werkzeug.utils import secure_filename
 
+from services import storage
+from services.changes import read_changes
+from services.download import send_stored_file
+from services.delta import (
+    DEFAULT_BLOCK_SIZE,
+    DeltaError,
+    SignatureBuilder,
+    apply_delta,
+    clamp_block_size,
+    get_signatures,
+    store_signatures,
+    version_token,
+)
+from services.files import (
+    StreamFill,
+    UploadConflict,
+    form_upload,
+    list_recent_transfers,
+    resumable_offset,
+    save_file,
+    store_upload,
+)
+from services.runtime import request_threads
+from services.search import get_index
+from services.timeutil import parse_time_arg
+from services.watch import get_watcher, wait_cursor, wait_for_files, wait_reply
 
-def _parse_time_arg(value):
-    """Return a UNIX timestamp for the provided query arg or None if invalid."""
-    if not value:
-        return None
-
-    value = value.strip()
-    if not value:
-        return None
-
-    try:
-        return float(value)
-    except ValueError:
-        pass
-
-    cleaned = value
-    if cleaned.endswith("Z"):
-        cleaned = cleaned[:-1] + "+00:00"
-
-    try:
-        dt = datetime.datetime.fromisoformat(cleaned)
-    except ValueError:
-        return None
-
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=datetime.timezone.utc)
-
-    return dt.timestamp()
 
 api_bp = Blueprint("api_v1", __name__, url_prefix="/api/v1")
 
@@ -41,7 +43,7 @@ def healthz():
 
 # ---- Streamed upload handler ----
 def handle_stream_upload(group):
-    file_storage = request.files.get("file")
+    file_storage = form_upload(group)
     if not file_storage or not getattr(file_storage, "filename", None):
         return jsonify(error="missing file payload"), 400
 
@@ -54,39 +56,71 @@ def handle_stream_upload(group):
 def upload_v1(group):
     return handle_stream_upload(group)
 
+# Resumable upload: HEAD reports the bytes held so far, PUT appends from there
+@api_bp.route("/upload/<group>/<path:fname>", methods=["HEAD"])
+def upload_offset(group, fname):
+    response = current_app.response_class(status=200)
+    response.headers["Upload-Offset"] = str(resumable_offset(group, os.path.basename(fname)))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@api_bp.route("/upload/<group>/<path:fname>", methods=["PUT"])
+def upload_resumable(group, fname):
+    safe = secure_filename(os.path.basename(fname))
+    if not safe:
+        return jsonify(error="invalid file name"), 400
+    offset = request.headers.get("Upload-Offset", type=int)
+    total = request.headers.get("Upload-Length", type=int)
+    if offset is None or total is None or not 0 <= offset <= total:
+        return jsonify(error="Upload-Offset and Upload-Length headers are required"), 400
+    try:
+        saved_path = store_upload(
+            group, safe, StreamFill(request.stream),
+            total_bytes=total,
+            resume_offset=offset,
+            # never bounce replicated files back out (A -> B -> A loops)
+            replicate=not request.headers.get("X-Replicated-From"),
+        )
+    except UploadConflict as exc:
+        response = jsonify(error=str(exc), offset=exc.offset)
+        response.headers["Upload-Offset"] = str(exc.offset)
+        return response, 409
+
+    received = total if saved_path else resumable_offset(group, safe)
+    response = jsonify(ok=True, group=group, file=safe, offset=received, complete=saved_path is not None)
+    response.headers["Upload-Offset"] = str(received)
+    return response, 200
+
 # List files in a group
 @api_bp.route("/files/<group>", methods=["GET"])
 def list_files(group):
-    folder = os.path.join(current_app.config["UPLOAD_FOLDER"], group)
-    if not os.path.isdir(folder):
+    if not storage.group_exists(group):
         return jsonify(error=f"invalid group '{group}'"), 400
 
     since_raw = request.args.get("since")
     until_raw = request.args.get("until")
     limit = request.args.get("limit", type=int)
 
-    since_ts = _parse_time_arg(since_raw)
-    until_ts = _parse_time_arg(until_raw)
+    since_ts = parse_time_arg(since_raw)
+    until_ts = parse_time_arg(until_raw)
 
     files = []
-    for name in os.listdir(folder):
-        full = os.path.join(folder, name)
-        if os.path.isfile(full):
-            st = os.stat(full)
-            mtime = st.st_mtime
-
-            if since_ts is not None and mtime < since_ts:
-                continue
-            if until_ts is not None and mtime > until_ts:
-                continue
-
-            files.append({
-                "name": name,
-                "size": st.st_size,
-                "mtime": datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).isoformat(),
-                "url": f"/api/v1/files/{group}/{name}",
-                "_mtime": mtime,
-            })
+    for item in storage.scan_group(group):
+        mtime = item.mtime
+
+        if since_ts is not None and mtime < since_ts:
+            continue
+        if until_ts is not None and mtime > until_ts:
+            continue
+
+        files.append({
+            "name": item.name,
+            "size": item.size,
+            "mtime": datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).isoformat(),
+            "url": f"/api/v1/files/{group}/{item.name}",
+            "etag": f'"{item.version}"',
+            "_mtime": mtime,
+        })
 
     files.sort(key=lambda entry: entry.get("_mtime", 0), reverse=True)
 
@@ -100,6 +134,8 @@ def list_files(group):
         "group": group,
         "files": files,
         "count": len(files),
+        # downloads honour Range (also multipart) and If-None-Match with the etag above
+        "accept_ranges": "bytes",
     }
 
     applied_filters = {}
@@ -114,18 +150,201 @@ def list_files(group):
 
     return jsonify(response)
 
-# Download a file
-@api_bp.route("/files/<group>/<path:fname>", methods=["GET"])
-def download(group, fname):
-    folder = os.path.join(current_app.config["UPLOAD_FOLDER"], group)
-    safe = os.path.basename(fname)
-    full = os.path.join(folder, safe)
+_SEARCH_MODES = ("substring", "prefix", "glob")
+_SEARCH_MAX_LIMIT = 1000
+
+
+# Search file names across all groups
+@api_bp.route("/search", methods=["GET"])
+def search_files():
+    query = request.args.get("q", "").strip()
+    mode = request.args.get("mode") or ("glob" if any(ch in query for ch in "*?[") else "substring")
+    if mode not in _SEARCH_MODES:
+        return jsonify(error=f"mode must be one of {', '.join(_SEARCH_MODES)}"), 400
+    limit = request.args.get("limit", 100, type=int)
+    limit = min(max(limit, 0), _SEARCH_MAX_LIMIT)
+    groups = {name for name in request.args.get("group", "").split(",") if name}
+
+    filters = {}
+    for arg in ("since", "until"):
+        raw = request.args.get(arg)
+        if raw:
+            filters[arg] = parse_time_arg(raw)
+            if filters[arg] is None:
+                return jsonify(error=f"invalid {arg} '{raw}'"), 400
+    for arg in ("min_size", "max_size"):
+        if request.args.get(arg):
+            filters[arg] = request.args.get(arg, type=int)
+            if filters[arg] is None:
+                return jsonify(error=f"{arg} must be a byte count"), 400
+    if not query and not groups and not filters:
+        return jsonify(error="give q or at least one filter"), 400
+
+    started = time.monotonic()
+    index = get_index()
+    entries, truncated = index.search(query, mode, groups=groups, limit=limit, **filters)
+    took = time.monotonic() - started
+
+    results = [
+        {
+            "group": entry.group,
+            "name": entry.name,
+            "size": entry.size,
+            "mtime": datetime.datetime.fromtimestamp(entry.mtime, datetime.timezone.utc).isoformat(),
+            "url": f"/api/v1/files/{entry.group}/{entry.name}",
+        }
+        for entry in entries
+    ]
+    return jsonify(
+        query=query,
+        mode=mode,
+        results=results,
+        count=len(results),
+        truncated=truncated,
+        indexed_files=len(index),
+        took_ms=round(took * 1000, 3),
+    )
+
+
+# Long-poll until a new file is published in the group (the wait server answers
+# this URL without holding a request thread; see services/waitserver.py)
+def _max_waiters():
+    configured = int(current_app.config.get("WAIT_MAX_WAITERS", 0) or 0)
+    return configured if configured > 0 else max(request_threads() // 2, 1)
+
 
-    if not os.path.isfile(full):
+@api_bp.route("/files/<group>/wait", methods=["GET"])
+def wait_for_file(group):
+    folders = storage.group_dirs(group)
+    if not folders:
+        return jsonify(error=f"invalid group '{group}'"), 400
+    if not current_app.config.get("CHANGES_FOLDER"):
+        return jsonify(error="waiting needs the change feed (TD_CHANGES_FOLDER)"), 503
+
+    max_timeout = float(current_app.config.get("WAIT_MAX_TIMEOUT", 60))
+    timeout = request.args.get("timeout", default=30, type=float)
+    timeout = min(max(timeout or 0, 0), max_timeout)
+
+    watcher = get_watcher(current_app.config["CHANGES_FOLDER"], float(current_app.config.get("WAIT_POLL_INTERVAL", 1)))
+    state = watcher.state(group)
+    # after= may name a file (wait for anything published after it) or be a
+    # time; either way the cursor is a change-feed seq, not a file mtime
+    after_raw = request.args.get("after")
+    after_seq = wait_cursor(state, after_raw, request.args.get("after_seq"))
+    if after_seq is None:
+        return jsonify(error="after_seq must be an integer"), 400
+    found, waited, busy = wait_for_files(watcher, state, after_seq, timeout, _max_waiters())
+
+    reply = wait_reply(group, after_raw, after_seq, found)
+    retry_after = None
+    if busy and not found:
+        # every wait slot in this worker is taken: come back around when the
+        # first one frees up, spread out so the callers do not return together
+        retry_after = min(max(math.ceil(watcher.retry_after() * random.uniform(1, 1.5)), 1), max(int(max_timeout), 1))
+    response = jsonify(
+        **reply,
+        timed_out=not found and not busy,
+        busy=busy,
+        retry_after=retry_after,
+        waited=round(waited, 3),
+        watcher=watcher.mode,
+    )
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+# ---- Block-delta re-upload ----
+def _signatures_dir(group):
+    return os.path.join(current_app.config["SIGNATURES_FOLDER"], group)
+
+# Block signatures of the current version (cached per version)
+@api_bp.route("/delta/<group>/<path:fname>", methods=["GET"])
+def delta_signatures(group, fname):
+    safe = secure_filename(os.path.basename(fname))
+    full = storage.find_file(group, safe)
+    if full is None:
         return jsonify(error=f"file '{fname}' not found"), 404
 
+    block_size = clamp_block_size(request.args.get("block_size", DEFAULT_BLOCK_SIZE))
+    try:
+        payload = get_signatures(full, _signatures_dir(group), block_size)
+    except DeltaError as exc:
+        return jsonify(error=str(exc)), 409
+
+    response = jsonify(group=group, **payload)
+    response.headers["ETag"] = f'"{payload["version"]}"'
+    return response
+
+# Rebuild a new version from copy/literal ops against the current one
+@api_bp.route("/delta/<group>/<path:fname>", methods=["POST"])
+def delta_upload(group, fname):
+    safe = secure_filename(os.path.basename(fname))
+    full = storage.find_file(group, safe)
+    if full is None:
+        return jsonify(error=f"file '{fname}' not found; upload it in full first"), 404
+
+    base = request.headers.get("X-Delta-Base", "").strip('" ')
+    if base != version_token(os.stat(full)):
+        return jsonify(error="file changed since signatures were fetched", current=version_token(os.stat(full))), 409
+    block_size = request.headers.get("X-Delta-Block-Size", type=int)
+    if not block_size or clamp_block_size(block_size) != block_size:
+        return jsonify(error="missing or invalid X-Delta-Block-Size"), 400
+
+    builder = SignatureBuilder(block_size)
+
+    def fill(sink):
+        apply_delta(request.stream, full, block_size, sink, builder)
+
+    try:
+        saved_path = store_upload(group, safe, fill)
+    except DeltaError as exc:
+        return jsonify(error=str(exc)), 400
+
+    # the rebuild saw every byte, so cache the new version's signatures now
+    payload = store_signatures(
+        _signatures_dir(group), safe, os.stat(saved_path), block_size, builder.finish()
+    )
+    return jsonify(ok=True, group=group, file=safe, size=payload["size"], version=payload["version"]), 200
+
+# Incremental sync: events with seq > after
+@api_bp.route("/changes/<group>", methods=["GET"])
+def list_changes(group):
+    if not storage.group_exists(group):
+        return jsonify(error=f"invalid group '{group}'"), 400
+
+    after = request.args.get("after", default=0, type=int)
+    limit = request.args.get("limit", default=1000, type=int)
+    limit = min(max(limit, 1), 10000)
+
+    changes, last_seq = read_changes(current_app.config["CHANGES_FOLDER"], group, after, limit)
+    next_after = changes[-1]["seq"] if changes else min(after, last_seq)
+
+    return jsonify(
+        group=group,
+        after=after,
+        changes=changes,
+        count=len(changes),
+        last_seq=last_seq,
+        next_after=next_after,
+        more=next_after < last_seq,
+        # the log was recreated (or the client is ahead): resync from a full listing
+        reset=after > last_seq,
+    )
+
+# Download a file (HEAD, conditional and Range requests included)
+@api_bp.route("/files/<group>/<path:fname>", methods=["GET", "HEAD"])
+def download(group, fname):
+    safe = os.path.basename(fname)
     # Serve inline so text files open in-browser; clients can force download via browser controls
-    return send_from_directory(folder, safe, as_attachment=False)
+    for _ in range(2):  # look again once if a rebalance moved it between lookup and open
+        full = storage.find_file(group, safe)
+        if full is None:
+            break
+        try:
+            return send_stored_file(full)
+        except FileNotFoundError:
+            continue
+    return jsonify(error=f"file '{fname}' not found"), 404
 @api_bp.route("/admin/transfers", methods=["GET"])
 def admin_transfers():
     hours = request.args.get("hours", default=24, type=float)
@@ -0,0 +1,124 @@
+"""Bounded in-memory LRU caches for hot small files and rendered pages.
+
+``bodies`` holds the contents of small files (the on-call board, small API
+downloads) keyed by (path, inode, mtime, size), so a replaced file is simply
+a new key and the old body ages out. ``pages`` holds the rendered ``/`` and
+``/<group>/`` pages keyed by what they show (group directory mtimes plus the
+group's change-feed sequence); the same key is the page's ``ETag``.
+
+Each cache is limited by entry count and total bytes, is shared by the
+threads of one worker (every uWSGI worker has its own) and counts hits,
+misses and evictions for ``/admin/health``. Limits come from
+``TD_CACHE_ENTRIES``, ``TD_CACHE_BODY_BYTES`` (with ``TD_CACHE_BODY_FILE_MAX``
+as the largest file kept) and ``TD_CACHE_PAGE_BYTES``; 0 disables a cache.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+
+class LruCache:
+    def __init__(self, name: str, max_entries: int = 256, max_bytes: int = 0):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def resize(self, max_entries: int, max_bytes: int):
+        with self._lock:
+            self.max_entries = max(int(max_entries), 0)
+            self.max_bytes = max(int(max_bytes), 0)
+            self._evict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size: int):
+        """Store ``value`` (``size`` bytes); values larger than the whole cache are not kept."""
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size) = self._items.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._items),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+bodies = LruCache("file bodies")
+pages = LruCache("pages")
+_body_file_max = 0
+_configured = False
+
+
+def configure_caches(config):
+    """Size the per-process caches; the first app built in the process decides."""
+    global _body_file_max, _configured
+    if _configured:
+        return
+    _configured = True
+    entries = config.get("CACHE_ENTRIES", 256)
+    bodies.resize(entries, config.get("CACHE_BODY_BYTES", 0))
+    pages.resize(entries, config.get("CACHE_PAGE_BYTES", 0))
+    _body_file_max = int(config.get("CACHE_BODY_FILE_MAX", 0))
+
+
+def cached_body(f, path, st):
+    """Contents of the open file ``f`` from the body cache, or None if it is too big to keep."""
+    if not bodies.enabled or st.st_size > min(_body_file_max, bodies.max_bytes):
+        return None
+    key = (str(path), st.st_ino, st.st_mtime_ns, st.st_size)
+    data = bodies.get(key)
+    if data is None:
+        data = os.pread(f.fileno(), st.st_size, 0)
+        if len(data) != st.st_size:
+            return None  # being rewritten in place; do not cache a torn read
+        bodies.put(key, data, len(data))
+    return data
+
+
+def cache_stats():
+    return {"pid": os.getpid(), "caches": [bodies.stats(), pages.stats()]}
@@ -0,0 +1,209 @@
+"""Append-only per-group change feed.
+
+``save_file`` and retention cleanup append one JSON line per event to
+``CHANGES_FOLDER/<group>.log``::
+
+    {"seq": 42, "event": "added", "file": "a.bin", "size": 123, "digest": "sha256:..", "ts": ...}
+
+Sequence numbers are assigned under an exclusive ``flock`` so they stay
+monotonic across uWSGI workers. Lines are ordered by ``seq``, which lets
+``read_changes`` binary-search the byte offset of ``after`` and return the
+delta in O(log n + changes) instead of rescanning the log or the directory.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+EVENTS = ("added", "replaced", "expired")
+_TAIL_BYTES = 4096
+
+# group -> (inode, size, seq) after this process's last append
+_last_seq = {}
+_last_seq_lock = threading.Lock()
+
+
+def _log_path(folder, group: str) -> str:
+    return os.path.join(folder, f"{group}.log")
+
+
+def _read_tail_seq(fd, size: int) -> int:
+    if size == 0:
+        return 0
+    start = max(size - _TAIL_BYTES, 0)
+    tail = os.pread(fd, size - start, start)
+    lines = tail.rstrip(b"\n").split(b"\n")
+    for line in reversed(lines):
+        try:
+            return int(json.loads(line)["seq"])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return 0
+
+
+def append_change(folder, group: str, event: str, file_name: str, size=None, digest=None):
+    """Append an event and return its sequence number (None if disabled)."""
+    if not folder:
+        return None
+    os.makedirs(folder, exist_ok=True)
+    path = _log_path(folder, group)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        st = os.fstat(fd)
+        with _last_seq_lock:
+            cached = _last_seq.get(path)
+        if cached and cached[0] == st.st_ino and cached[1] == st.st_size:
+            last = cached[2]
+        else:
+            read_fd = os.open(path, os.O_RDONLY)
+            try:
+                last = _read_tail_seq(read_fd, st.st_size)
+            finally:
+                os.close(read_fd)
+        seq = last + 1
+        record = {
+            "seq": seq,
+            "event": event,
+            "file": file_name,
+            "size": size,
+            "digest": digest,
+            "ts": round(time.time(), 3),
+        }
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        os.write(fd, line)
+        with _last_seq_lock:
+            _last_seq[path] = (st.st_ino, st.st_size + len(line), seq)
+        return seq
+    finally:
+        os.close(fd)  # releases the flock
+
+
+def last_seq(folder, group: str) -> int:
+    """Sequence number of the newest event of ``group`` (0 if there is none)."""
+    if not folder:
+        return 0
+    try:
+        fd = os.open(_log_path(folder, group), os.O_RDONLY)
+    except FileNotFoundError:
+        return 0
+    try:
+        return _read_tail_seq(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+
+
+def _line_at(f, offset: int, size: int, field: str = "seq"):
+    """Return (line_start, value of ``field``) of the first full line starting at/after offset."""
+    f.seek(offset)
+    if offset > 0:
+        f.readline()  # finish the partial line we landed in
+    while True:
+        start = f.tell()
+        if start >= size:
+            return size, None
+        line = f.readline()
+        try:
+            return start, json.loads(line)[field]
+        except (ValueError, KeyError, TypeError):
+            continue  # torn/garbled line; try the next one
+
+
+def _scan_back(f, size: int):
+    """Yield the parsed lines of ``f`` newest first, reading ``_TAIL_BYTES`` blocks from the end."""
+    end, rest = size, b""
+    while end > 0:
+        start = max(end - _TAIL_BYTES, 0)
+        f.seek(start)
+        block = f.read(end - start) + rest
+        lines = block.split(b"\n")
+        rest = lines.pop(0) if start else b""  # may continue in the previous block
+        for line in reversed(lines):
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+        end = start
+
+
+def seq_of(folder, group: str, file_name: str, events=("added", "replaced")) -> int:
+    """Seq of the newest ``events`` entry for ``file_name`` (0 if it has none); reads back from the end."""
+    try:
+        f = open(_log_path(folder, group), "rb")
+    except FileNotFoundError:
+        return 0
+    with f:
+        for record in _scan_back(f, os.fstat(f.fileno()).st_size):
+            if record.get("file") == file_name and record.get("event") in events:
+                return int(record.get("seq", 0))
+    return 0
+
+
+def seq_at(folder, group: str, ts: float) -> int:
+    """Seq of the last event logged at or before ``ts`` (0 if none).
+
+    Events are stamped as they are appended, so ``ts`` grows with ``seq`` and
+    the same binary search as ``read_changes`` applies.
+    """
+    try:
+        f = open(_log_path(folder, group), "rb")
+    except FileNotFoundError:
+        return 0
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        # smallest line start whose ts is > ts; the event before it is the answer
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, stamp = _line_at(f, mid, size, "ts")
+            if stamp is None or stamp > ts:
+                hi = mid
+            else:
+                lo = start + 1
+        start, _ = _line_at(f, lo, size) if lo else (0, None)
+        if start >= size:
+            return _read_tail_seq(f.fileno(), size)
+        if not start:
+            return 0
+        f.seek(start)
+        return int(json.loads(f.readline())["seq"]) - 1
+
+
+def read_changes(folder, group: str, after: int = 0, limit: int = 1000):
+    """Return (changes, last_seq) for events with seq > after."""
+    path = _log_path(folder, group)
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return [], 0
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        last_seq = _read_tail_seq(f.fileno(), size)
+        if after >= last_seq:
+            return [], last_seq
+
+        # smallest line start whose seq is > after
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, seq = _line_at(f, mid, size)
+            if seq is None or seq > after:
+                hi = mid
+            else:
+                lo = start + 1
+        start, _ = _line_at(f, lo, size) if lo else (0, None)
+
+        f.seek(start)
+        changes = []
+        for line in f:
+            if len(changes) >= limit:
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("seq", 0) > after:
+                changes.append(record)
+        return changes, last_seq
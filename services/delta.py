@@ -0,0 +1,337 @@
+"""rsync-style block delta for re-uploading large files that changed a little.
+
+Server side: ``get_signatures`` returns, per ``block_size`` block of the
+current file, a weak checksum (``zlib.adler32``, which can be rolled one byte
+at a time) and a strong hash (truncated SHA-256; FIPS hosts reject MD5). The
+result is cached under ``SIGNATURES_FOLDER`` keyed by (inode, size, mtime) so
+it is computed once per file version. ``apply_delta`` rebuilds the new
+version from a delta stream, copying matched blocks from the old file.
+
+Client side: ``encode_delta`` walks the new file against the signatures and
+emits the delta stream. Stdlib only, no Flask imports, so clients can use
+this file on its own.
+
+Delta stream format (big-endian)::
+
+    b"TDDELTA1"
+    b"C" start_block:u64 count:u32     copy blocks from the old file
+    b"L" length:u32 data               literal bytes
+    b"E" total_size:u64 sha256:32B     end; verifies the rebuilt file
+"""
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+
+MAGIC = b"TDDELTA1"
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 16 * 1024 * 1024
+MAX_LITERAL = 4 * 1024 * 1024
+_ADLER_MOD = 65521
+_COPY = struct.Struct(">QI")
+_LITERAL = struct.Struct(">I")
+_END = struct.Struct(">Q32s")
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def strong_hash(block) -> str:
+    return hashlib.sha256(block).hexdigest()[:32]
+
+
+def clamp_block_size(value) -> int:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_BLOCK_SIZE
+    return min(max(value, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+def version_token(st) -> str:
+    """Identify one version of a file; a replaced file gets a new inode."""
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+# --- signatures ---
+class SignatureBuilder:
+    """Accumulate chunks of a file and emit per-block signatures."""
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self.blocks = []
+        self._pending = bytearray()
+
+    def update(self, chunk):
+        self._pending += chunk
+        while len(self._pending) >= self.block_size:
+            block = bytes(self._pending[:self.block_size])
+            del self._pending[:self.block_size]
+            self.blocks.append([zlib.adler32(block), strong_hash(block)])
+
+    def finish(self):
+        if self._pending:
+            block = bytes(self._pending)
+            self.blocks.append([zlib.adler32(block), strong_hash(block)])
+            self._pending = bytearray()
+        return self.blocks
+
+
+def compute_signatures(path, block_size: int):
+    builder = SignatureBuilder(block_size)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(max(block_size, 1024 * 1024))
+            if not chunk:
+                break
+            builder.update(chunk)
+    return builder.finish()
+
+
+def _cache_path(cache_dir, name: str, block_size: int) -> str:
+    return os.path.join(cache_dir, f"{name}.{block_size}.json")
+
+
+def store_signatures(cache_dir, name: str, st, block_size: int, blocks):
+    payload = {
+        "file": name,
+        "version": version_token(st),
+        "size": st.st_size,
+        "block_size": block_size,
+        "blocks": blocks,
+    }
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _cache_path(cache_dir, name, block_size)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp, path)
+    return payload
+
+
+def get_signatures(path, cache_dir, block_size: int):
+    """Return the signature payload for ``path``, computing it at most once per version."""
+    name = os.path.basename(str(path))
+    st = os.stat(path)
+    token = version_token(st)
+    if cache_dir:
+        try:
+            with open(_cache_path(cache_dir, name, block_size)) as f:
+                cached = json.load(f)
+            if cached.get("version") == token:
+                return cached
+        except (OSError, ValueError):
+            pass
+    blocks = compute_signatures(path, block_size)
+    # the file may have been replaced while we hashed it
+    if version_token(os.stat(path)) != token:
+        raise DeltaError(f"{name} changed while computing signatures")
+    return store_signatures(cache_dir, name, st, block_size, blocks)
+
+
+# --- server: rebuild from a delta stream ---
+def _read_exact(stream, size: int) -> bytes:
+    parts = []
+    remaining = size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            raise DeltaError("delta stream ended early")
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(parts)
+
+
+def apply_delta(stream, base_path, block_size: int, sink, signatures=None):
+    """Read a delta from ``stream`` and feed the rebuilt file to ``sink(chunk)``.
+
+    Copied blocks are read from ``base_path`` with ``os.pread``; literals are
+    passed through. When ``signatures`` (a SignatureBuilder) is given it sees
+    every byte, so the new version's signatures come for free. Returns the
+    rebuilt size; raises DeltaError on malformed input or a checksum mismatch.
+    """
+    if _read_exact(stream, len(MAGIC)) != MAGIC:
+        raise DeltaError("not a TransferDepot delta stream")
+    check = hashlib.sha256()
+    total = 0
+    fd = os.open(str(base_path), os.O_RDONLY)
+    try:
+        base_size = os.fstat(fd).st_size
+        base_blocks = (base_size + block_size - 1) // block_size
+
+        def emit(data):
+            nonlocal total
+            check.update(data)
+            if signatures is not None:
+                signatures.update(data)
+            sink(data)
+            total += len(data)
+
+        while True:
+            op = _read_exact(stream, 1)
+            if op == b"C":
+                start, count = _COPY.unpack(_read_exact(stream, _COPY.size))
+                if count == 0 or start + count > base_blocks:
+                    raise DeltaError(f"copy of blocks {start}+{count} is outside the old file")
+                offset = start * block_size
+                end = min((start + count) * block_size, base_size)
+                while offset < end:
+                    data = os.pread(fd, min(end - offset, max(block_size, 1024 * 1024)), offset)
+                    if not data:
+                        raise DeltaError("old file shrank while applying delta")
+                    emit(data)
+                    offset += len(data)
+            elif op == b"L":
+                (length,) = _LITERAL.unpack(_read_exact(stream, _LITERAL.size))
+                if length > MAX_LITERAL:
+                    raise DeltaError("literal run too large")
+                emit(_read_exact(stream, length))
+            elif op == b"E":
+                expected_size, expected_hash = _END.unpack(_read_exact(stream, _END.size))
+                if expected_size != total:
+                    raise DeltaError(f"rebuilt {total} bytes, client expected {expected_size}")
+                if expected_hash != check.digest():
+                    raise DeltaError("rebuilt file does not match the client's SHA-256")
+                return total
+            else:
+                raise DeltaError(f"unknown delta op {op!r}")
+    finally:
+        os.close(fd)
+
+
+# --- client: encode a new file against server signatures ---
+def encode_delta(signatures, source, write, read_size: int = 4 * 1024 * 1024):
+    """Write the delta turning the server's version into ``source`` to ``write``.
+
+    Returns (literal_bytes, copied_bytes). Blocks that still sit at their old
+    offset are matched with a single adler32 call; only after a mismatch that
+    is not followed by an aligned match (inserted/removed bytes) does the
+    encoder roll the checksum byte by byte like rsync.
+    """
+    block = int(signatures["block_size"])
+    table = {}
+    for index, (weak, strong) in enumerate(signatures["blocks"]):
+        table.setdefault(weak, []).append((index, strong))
+    full_blocks = signatures["size"] // block
+
+    check = hashlib.sha256()
+    stats = {"literal": 0, "copied": 0, "total": 0}
+    pending_copy = []  # [start, count]
+
+    def flush_copy():
+        if pending_copy:
+            write(b"C" + _COPY.pack(pending_copy[0], pending_copy[1]))
+            pending_copy.clear()
+
+    def emit_literal(data):
+        for start in range(0, len(data), MAX_LITERAL):
+            piece = bytes(data[start:start + MAX_LITERAL])
+            flush_copy()
+            write(b"L" + _LITERAL.pack(len(piece)) + piece)
+            stats["literal"] += len(piece)
+
+    def emit_copy(index, size):
+        if pending_copy and pending_copy[0] + pending_copy[1] == index:
+            pending_copy[1] += 1
+        else:
+            flush_copy()
+            pending_copy[:] = [index, 1]
+        stats["copied"] += size
+
+    def lookup(weak, data):
+        candidates = table.get(weak)
+        if not candidates:
+            return None
+        strong = strong_hash(data)
+        for index, candidate in candidates:
+            if candidate == strong and index < full_blocks:
+                return index
+        return None
+
+    write(MAGIC)
+    buf = bytearray()
+    eof = False
+    pos = 0            # window start within buf
+    literal_start = 0  # first byte not yet emitted
+    a = b = None       # rolling adler32 halves for buf[pos:pos + block]
+
+    def fill(needed):
+        nonlocal eof
+        while not eof and len(buf) - pos < needed:
+            chunk = source.read(read_size)
+            if not chunk:
+                eof = True
+                break
+            check.update(chunk)
+            stats["total"] += len(chunk)
+            buf.extend(chunk)
+
+    while True:
+        fill(2 * block)
+        if len(buf) - pos < block:
+            break
+        fresh = a is None
+        if fresh:
+            weak = zlib.adler32(bytes(buf[pos:pos + block]))
+            a, b = weak & 0xFFFF, weak >> 16
+        index = lookup((b << 16) | a, bytes(buf[pos:pos + block]))
+        if index is not None:
+            emit_literal(buf[literal_start:pos])
+            emit_copy(index, block)
+            pos += block
+            literal_start = pos
+            a = None
+        else:
+            # in-place edit? probe the next aligned window before rolling
+            nxt = bytes(buf[pos + block:pos + 2 * block]) if fresh else b""
+            if len(nxt) == block and lookup(zlib.adler32(nxt), nxt) is not None:
+                pos += block
+                a = None
+            elif len(buf) - pos > block:
+                out_byte, in_byte = buf[pos], buf[pos + block]
+                a = (a - out_byte + in_byte) % _ADLER_MOD
+                b = (b - block * out_byte + a - 1) % _ADLER_MOD
+                pos += 1
+            else:
+                break
+        if pos - literal_start >= MAX_LITERAL:
+            emit_literal(buf[literal_start:pos])
+            literal_start = pos
+        if literal_start > 4 * read_size:
+            # drop consumed bytes so memory stays bounded
+            del buf[:literal_start]
+            pos -= literal_start
+            literal_start = 0
+
+    emit_literal(buf[literal_start:])
+    flush_copy()
+    write(b"E" + _END.pack(stats["total"], check.digest()))
+    return stats["literal"], stats["copied"]
+
+
+def main(argv=None):
+    """``python3 services/delta.py encode SIGNATURES.json NEWFILE OUT.delta``"""
+    import sys
+
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 4 or argv[0] != "encode":
+        print(main.__doc__.strip("`"), file=sys.stderr)
+        return 2
+    _, sig_path, source_path, out_path = argv
+    with open(sig_path) as f:
+        signatures = json.load(f)
+    with open(source_path, "rb") as source, open(out_path, "wb") as out:
+        literal, copied = encode_delta(signatures, source, out.write)
+    print(f"literal {literal} bytes, copied {copied} bytes, delta {os.path.getsize(out_path)} bytes")
+    print(f"X-Delta-Base: {signatures['version']}")
+    print(f"X-Delta-Block-Size: {signatures['block_size']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
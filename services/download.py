@@ -0,0 +1,192 @@
+"""File responses with validators, conditional requests and byte ranges.
+
+``send_stored_file`` serves one stored file per RFC 9110:
+
+* strong ``ETag`` from (inode, size, mtime) - the same version token the
+  delta endpoints use - plus ``Last-Modified``; ``If-None-Match`` /
+  ``If-Modified-Since`` answer 304, ``If-Match`` / ``If-Unmodified-Since``
+  answer 412;
+* ``Range`` with one or more ranges (206, ``multipart/byteranges`` for
+  several), ``If-Range``, and 416 for unsatisfiable ranges;
+* ``HEAD`` with the same headers and no body.
+
+The whole file goes out as a file object so uWSGI's ``wsgi.file_wrapper``
+can ``sendfile`` it; ranges are read from an ``mmap`` in ``_SLICE`` pieces
+(the wrapper ignores the file position). A worker never holds a range in
+memory.
+All validators come from ``fstat`` on the opened descriptor, so they always
+describe the bytes that are sent even if the file is replaced meanwhile.
+"""
+import mimetypes
+import mmap
+import os
+import uuid
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date, quote_etag
+from werkzeug.wsgi import wrap_file
+
+from .cache import cached_body
+from .delta import version_token
+
+
+_SLICE = 1024 * 1024
+_MAX_RANGES = 64  # more than this and the Range header is ignored (RFC 9110 14.2)
+
+
+def etag_for(st) -> str:
+    return version_token(st)
+
+
+def _normalize_ranges(ranges, size: int):
+    """Absolute, sorted, coalesced ``(start, stop)`` pairs that fit in ``size``."""
+    spans = []
+    for start, stop in ranges:
+        if start < 0:  # suffix range: the last -start bytes
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append((start, stop))
+    spans.sort()
+    merged = []
+    for start, stop in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _if_range_matches(etag: str, mtime: int) -> bool:
+    raw = request.headers.get("If-Range", "").strip()
+    if not raw:
+        return True
+    if raw.startswith('"'):
+        return raw == quote_etag(etag)  # strong comparison only; W/ never matches
+    date = parse_date(raw)
+    return date is not None and int(date.timestamp()) == mtime
+
+
+def _precondition(etag: str, mtime: int):
+    """Status code a conditional request resolves to, or None to serve it."""
+    if "If-Match" in request.headers:
+        if not (request.if_match.star_tag or request.if_match.contains(etag)):
+            return 412
+    elif request.if_unmodified_since is not None and mtime > request.if_unmodified_since.timestamp():
+        return 412
+    if "If-None-Match" in request.headers:
+        if request.if_none_match.star_tag or request.if_none_match.contains_weak(etag):
+            return 304
+    elif request.if_modified_since is not None and mtime <= request.if_modified_since.timestamp():
+        return 304
+    return None
+
+
+def _memory_slices(data: bytes, spans, parts=None):
+    if parts is None:
+        return [data[start:stop] for start, stop in spans]
+    body = []
+    for part, (start, stop) in zip(parts, spans):
+        body += [part, data[start:stop]]
+    body.append(parts[-1])
+    return body
+
+
+def _mmap_slices(mm, spans, parts=None):
+    """Yield the bytes of ``spans`` (with multipart framing from ``parts``) piece by piece."""
+    try:
+        for index, (start, stop) in enumerate(spans):
+            if parts is not None:
+                yield parts[index]
+            for offset in range(start, stop, _SLICE):
+                yield mm[offset:min(offset + _SLICE, stop)]
+        if parts is not None:
+            yield parts[-1]
+    finally:
+        mm.close()
+
+
+def send_stored_file(path) -> Response:
+    f = open(path, "rb")
+    try:
+        return _build(f, path)
+    except BaseException:
+        f.close()
+        raise
+
+
+def _build(f, path) -> Response:
+    """Build the response; ``f`` is closed here unless the file wrapper takes it over."""
+    name = os.path.basename(str(path))
+    st = os.fstat(f.fileno())
+    size = st.st_size
+    mtime = int(st.st_mtime)
+    etag = etag_for(st)
+    mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    headers = {
+        "ETag": quote_etag(etag),
+        "Last-Modified": http_date(mtime),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "no-cache",  # always revalidate; 304s are cheap
+    }
+
+    status = _precondition(etag, mtime)
+    if status is not None:
+        f.close()
+        return Response(status=status, headers=headers)
+
+    spans = [(0, size)]
+    rng = request.range
+    if rng is not None and rng.units == "bytes" and len(rng.ranges) <= _MAX_RANGES and _if_range_matches(etag, mtime):
+        spans = _normalize_ranges(rng.ranges, size)
+        if not spans:
+            f.close()
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+
+    kwargs = {"mimetype": mimetype}
+    parts = None
+    if spans == [(0, size)]:
+        status, length = 200, size
+    elif len(spans) == 1:
+        status, length = 206, spans[0][1] - spans[0][0]
+        headers["Content-Range"] = f"bytes {spans[0][0]}-{spans[0][1] - 1}/{size}"
+    else:
+        status = 206
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+            ).encode("latin-1")
+            for start, stop in spans
+        ]
+        parts.append(f"\r\n--{boundary}--\r\n".encode("latin-1"))
+        length = sum(map(len, parts)) + sum(stop - start for start, stop in spans)
+        kwargs = {"content_type": f"multipart/byteranges; boundary={boundary}"}
+
+    passthrough = False
+    data = None
+    if request.method != "HEAD" and length:
+        data = cached_body(f, path, st)
+    if request.method == "HEAD" or length == 0:
+        f.close()
+        body = []
+    elif data is not None:
+        f.close()
+        body = _memory_slices(data, spans, parts)
+    elif spans == [(0, size)]:
+        # whole file: the server's file wrapper can sendfile it; uWSGI's
+        # sends from offset 0 whatever the file position, so ranges (even
+        # open-ended resume requests) take the mmap path below
+        body = wrap_file(request.environ, f, _SLICE)
+        passthrough = True
+    else:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()  # the mapping keeps its own reference to the file
+        body = _mmap_slices(mm, spans, parts)
+
+    response = Response(body, status=status, headers=headers, direct_passthrough=passthrough, **kwargs)
+    response.content_length = length
+    return response
@@ -1,20 +1,39 @@
+import io
 import os
+import copy
+import fcntl
 import json
 import time
+import hashlib
+import logging
+import threading
+from contextlib import ExitStack
 from datetime import datetime
 from pathlib import Path
-from flask import current_app
+from flask import Request, current_app, request
 from werkzeug.utils import secure_filename
 
+from .changes import append_change
+from .logs import note_request
+from .pdfcheck import check_pdf
+from .pipeline import enqueue as enqueue_pipeline, new_job, stage, stages_for, summary
+from .progress import ChunkSizer, RateTracker, active_uploads
+from .replication import enqueue as enqueue_replication
+from .runtime import LeaderLock, dir_lock, start_daemon, start_once, warmup
+from .search import note_file, note_removed
+from .settings import parse_write_policy
+from . import storage
+from .watch import notify_changed
+from .telemetry import note_upload_bytes, note_upload_finished, note_upload_started
+
+
+logger = logging.getLogger(__name__)
+
 
 # --- helpers ---
 def _groups_file_path() -> Path:
     return Path(current_app.config["GROUPS_FILE"])
 
-def _upload_root() -> Path:
-    return Path(current_app.config["UPLOAD_FOLDER"])
-
-
 def _status_root() -> Path:
     return Path(current_app.config["STATUS_FOLDER"])
 
@@ -32,6 +51,100 @@ def _retention_seconds(group: str) -> int:
     return max(days, 0) * 24 * 60 * 60
 
 
+ONCALL_GROUP_NAME = "ONCALL"
+
+# Without periodic fsync we cannot know which pages are clean, so DONTNEED
+# trails the write offset by this much and relies on kernel writeback.
+_FADVISE_LAG_BYTES = 16 * 1024 * 1024
+
+
+def _write_policy(group: str):
+    overrides = current_app.config.get("WRITE_POLICY_OVERRIDES", {})
+    raw = overrides.get(group, current_app.config.get("WRITE_POLICY", "none"))
+    return parse_write_policy(raw)
+
+
+def _fadvise_dontneed(fd: int, offset: int, length: int):
+    fadvise = getattr(os, "posix_fadvise", None)
+    if fadvise is None or length < 0:
+        return
+    try:
+        fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+
+def _fsync_dir(path: Path):
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class _PolicyWriter:
+    """Wrap the .part file so the write loop honours the group's write policy."""
+
+    def __init__(self, out, policy):
+        self.out = out
+        self.sync_mode, self.every_bytes, self.dontneed = policy
+        self.written = 0
+        self.synced = 0
+        self.advised = 0
+        self.sync_seconds = 0.0
+
+    def write(self, chunk):
+        self.out.write(chunk)
+        self.written += len(chunk)
+        if self.sync_mode == "every" and self.written - self.synced >= self.every_bytes:
+            self._sync()
+            if self.dontneed:
+                self._advise(self.synced)
+        elif self.dontneed and self.sync_mode != "every":
+            if self.written - self.advised >= 2 * _FADVISE_LAG_BYTES:
+                self._advise(self.written - _FADVISE_LAG_BYTES)
+
+    def finish(self):
+        self.out.flush()
+        if self.sync_mode != "none":
+            self._sync()
+        if self.dontneed:
+            self._advise(self.written)
+
+    def _sync(self):
+        started = time.monotonic()
+        self.out.flush()
+        os.fdatasync(self.out.fileno())
+        self.synced = self.written
+        self.sync_seconds += time.monotonic() - started
+
+    def _advise(self, upto: int):
+        if upto <= self.advised:
+            return
+        _fadvise_dontneed(self.out.fileno(), self.advised, upto - self.advised)
+        self.advised = upto
+
+
+def _changes_folder():
+    return current_app.config.get("CHANGES_FOLDER")
+
+
+def _new_digest():
+    name = (current_app.config.get("CHANGES_DIGEST") or "").lower()
+    if not name or name == "none":
+        return None
+    return hashlib.new(name)
+
+
+def _format_digest(digest):
+    return f"{digest.name}:{digest.hexdigest()}" if digest is not None else None
+
+
 def _heartbeat_retention_seconds(group: str) -> int:
     base = int(current_app.config.get("HEARTBEAT_RETENTION", 180))
     return max(base, _retention_seconds(group))
@@ -65,28 +178,54 @@ def cleanup_expired_files(group: str):
         return
 
     now = _now_ts()
-    target_dir = _upload_root() / group
     status_dir = _status_root() / group
 
-    if target_dir.exists():
-        for path in list(target_dir.iterdir()):
-            if not path.is_file():
-                continue
-            try:
-                age = now - path.stat().st_mtime
-            except OSError:
-                continue
-            if age > retention:
+    # every volume, not the merged view, so shadowed copies expire too
+    for vol in storage.volumes():
+        for item in storage.scan_group(group, [vol]):
+            if now - item.mtime > retention:
                 try:
-                    path.unlink()
+                    os.unlink(item.path)
                 except OSError:
                     continue
-                status_path = status_dir / f"{path.name}.json"
+                if storage.find_file(group, item.name) is not None:
+                    continue  # a shadowed copy; the name is still served from another volume
+                append_change(_changes_folder(), group, "expired", item.name, size=item.size)
+                note_removed(group, item.name)
+                status_path = status_dir / f"{item.name}.json"
                 if status_path.exists():
                     try:
                         status_path.unlink()
                     except OSError:
                         pass
+        # abandoned resumes and interrupted writes; never published, so no change event
+        for item in storage.scan_group(group, [vol], partial=True):
+            if now - item.mtime > retention:
+                try:
+                    os.unlink(item.path)
+                except OSError:
+                    continue
+
+
+def start_retention(app):
+    """Expire every group's files in the background; one process per host sweeps."""
+    interval = float(app.config.get("RETENTION_INTERVAL", 0) or 0)
+    if interval <= 0:
+        return
+
+    def sweep():
+        lock = LeaderLock(os.path.join(app.config["STORAGE_FOLDER"], "retention.lock"))
+        while True:
+            try:
+                if lock.try_acquire():
+                    with app.app_context():
+                        for group in storage.group_names():
+                            cleanup_expired_files(group)
+            except Exception:  # keep sweeping on the next pass
+                logger.exception("retention sweep failed")
+            time.sleep(interval)
+
+    start_once("td-retention", lambda: start_daemon("td-retention", sweep))
 
 
 class UploadHeartbeat:
@@ -95,10 +234,18 @@ class UploadHeartbeat:
         self.filename = filename
         cfg = current_app.config
         self.interval = int(cfg.get("HEARTBEAT_INTERVAL", 30))
+        self.flush_interval = float(cfg.get("HEARTBEAT_FLUSH", 2))
+        self.stall_seconds = float(cfg.get("HEARTBEAT_STALL", 10))
+        self.telemetry_folder = cfg.get("TELEMETRY_FOLDER")
+        self.logger = current_app.logger  # flush() runs outside the app context
         self.status_dir = _status_root() / group
         self.status_dir.mkdir(parents=True, exist_ok=True)
         self.path = self.status_dir / f"{filename}.json"
         self.last_write = 0.0
+        self.tracker = None
+        self.chunks = None  # ChunkSizer of the StreamFill or _SizedInput reading the body, if any
+        # the flusher thread writes too; guards ``data`` and the status file
+        self._lock = threading.Lock()
         self.data = {
             "group": group,
             "file": filename,
@@ -109,58 +256,109 @@ class UploadHeartbeat:
             "updated_ts": None,
         }
 
-    def start(self, total_bytes=None):
+    def start(self, total_bytes=None, offset: int = 0):
         ts = _now_ts()
-        self.data.update({
-            "status": "in_progress",
-            "bytes_written": 0,
-            "total_bytes": total_bytes,
-            "started_ts": ts,
-            "updated_ts": ts,
-        })
-        self._write(force=True)
+        self.tracker = RateTracker(total_bytes, offset, minmax_seconds=self.interval)
+        with self._lock:
+            self.data.update({
+                "status": "in_progress",
+                "bytes_written": offset,
+                "total_bytes": total_bytes,
+                "started_ts": ts,
+                "updated_ts": ts,
+                "stalled": False,
+            })
+            if offset:
+                self.data["resumed_from"] = offset
+            self._write(force=True)
+        active_uploads.add(self, self.flush_interval, self.telemetry_folder)
 
     def pulse(self, bytes_written_delta: int):
-        self.data["bytes_written"] += bytes_written_delta
+        self.tracker.add(bytes_written_delta)
+        with self._lock:
+            self.data["bytes_written"] += bytes_written_delta
+            self.data["updated_ts"] = _now_ts()
+            self.data["stalled"] = False
+            self._write(force=False)
+
+    def flush(self) -> bool:
+        """Called by the flusher thread; returns True while the upload is stalled."""
+        self.tracker.tick()
+        stalled = self.tracker.gap() >= self.stall_seconds
+        with self._lock:
+            if self.data["status"] != "in_progress":
+                return False
+            if stalled and not self.data.get("stalled"):
+                self.logger.warning(
+                    "upload %s/%s stalled: no data for %.0fs", self.group, self.filename, self.tracker.gap()
+                )
+            self.data["stalled"] = stalled
+            self._write(force=True)
+        return stalled
+
+    def update(self, **fields):
+        """Set record fields from the request thread; written out with the next flush."""
+        with self._lock:
+            self.data.update(fields)
+
+    def _finish(self, **fields):
+        active_uploads.discard(self)
         ts = _now_ts()
-        self.data["updated_ts"] = ts
-        self._write(force=False)
+        with self._lock:
+            self.data.update(fields, updated_ts=ts, stalled=False)
+            self._write(force=True)
 
     def complete(self):
         ts = _now_ts()
-        self.data.update({
-            "status": "completed",
-            "completed_ts": ts,
-            "updated_ts": ts,
-        })
-        self._write(force=True)
+        fields = {"status": "completed", "completed_ts": ts}
+        with self._lock:
+            elapsed = ts - (self.data.get("started_ts") or ts)
+            received = self.data["bytes_written"] - self.data.get("resumed_from", 0)
+        if elapsed > 0:
+            fields["rate_avg_bps"] = round(received / elapsed, 1)
+        self._finish(**fields)
+
+    def pause(self, reason: str):
+        """A resumable upload stopped early; its part file is kept."""
+        self._finish(status="paused", error=reason)
 
     def fail(self, error_message: str):
-        ts = _now_ts()
-        self.data.update({
-            "status": "failed",
-            "error": error_message,
-            "updated_ts": ts,
-        })
-        self._write(force=True)
+        self._finish(status="failed", error=error_message)
 
     def _write(self, force: bool):
-        now = self.data.get("updated_ts", _now_ts())
+        now = _now_ts()
         if not force and (now - self.last_write) < self.interval:
             return
+        if self.tracker is not None:
+            self.data.update(self.tracker.snapshot())
+        if self.chunks is not None:
+            self.data["chunks"] = self.chunks.snapshot()
         tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
-        payload = dict(self.data, updated_iso=_iso_utc(self.data["updated_ts"]))
-        tmp_path.write_text(json.dumps(payload))
-        tmp_path.replace(self.path)
+        payload = dict(self.data, updated_iso=_iso_utc(self.data["updated_ts"]), flushed_ts=now)
+        with dir_lock(self.status_dir):  # the pipeline merges stage results under the same lock
+            tmp_path.write_text(json.dumps(payload))
+            tmp_path.replace(self.path)
         self.last_write = now
 
 # --- groups ---
+# path -> ((mtime_ns, size), value); re-read only when the file/dir changes
+_groups_cache = {}
+_group_dirs_cache = {}
+
+
 def load_groups():
     p = _groups_file_path()
-    if not p.exists():
-        raise FileNotFoundError(f"Groups file not found: {p}")
-    with p.open("r") as f:
-        return json.load(f)
+    try:
+        st = p.stat()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Groups file not found: {p}") from None
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _groups_cache.get(str(p))
+    if cached is None or cached[0] != key:
+        with p.open("r") as f:
+            cached = (key, json.load(f))
+        _groups_cache[str(p)] = cached
+    return copy.deepcopy(cached[1])
 
 def save_groups(groups):
     p = _groups_file_path()
@@ -169,51 +367,456 @@ def save_groups(groups):
 def list_groups():
     return load_groups()
 
+
+def list_group_dirs():
+    """Names of the group folders across the storage pool, cached on the volumes' mtimes."""
+    vols = storage.volumes()
+    key = tuple(map(str, vols))
+    signature = storage.pool_signature(vols)
+    cached = _group_dirs_cache.get(key)
+    if cached is None or cached[0] != signature:
+        cached = (signature, storage.group_names(vols))
+        _group_dirs_cache[key] = cached
+    return list(cached[1])
+
+
+@warmup
+def warm_groups():
+    list_group_dirs()
+    if _groups_file_path().exists():
+        load_groups()
+
 # --- files ---
 def list_files(group: str):
     cleanup_expired_files(group)
-    g = _upload_root() / group
-    if not g.exists():
-        return []
-    return [f.name for f in g.iterdir() if f.is_file()]
+    return [item.name for item in storage.scan_group(group)]
+
+def _chunk_sizer(chunk_size=None):
+    cfg = current_app.config
+    if chunk_size is not None or not cfg.get("UPLOAD_CHUNK_ADAPTIVE", True):
+        size = chunk_size or int(cfg.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+        return ChunkSizer(size, size, adaptive=False)
+    return ChunkSizer(
+        int(cfg.get("UPLOAD_CHUNK_MIN", 64 * 1024)),
+        int(cfg.get("UPLOAD_CHUNK_MAX", 8 * 1024 * 1024)),
+    )
+
+
+class StreamFill:
+    """``fill`` for store_upload that reads a request stream in adaptively sized chunks."""
+
+    def __init__(self, stream, chunk_size=None):
+        self.sizer = _chunk_sizer(chunk_size)
+        self.stream = stream
+
+    # Python 3.6 safe streaming
+    def __call__(self, sink):
+        while True:
+            started = time.monotonic()
+            chunk = self.stream.read(self.sizer.size)
+            if not chunk:
+                break
+            self.sizer.observe(len(chunk), time.monotonic() - started)
+            sink(chunk)
+
+
+class _SizedInput:
+    """Request body for the multipart parser, read from the client like ``StreamFill`` does.
+
+    The parser asks for 64 KB at a time; the input stream underneath is read
+    in ``sizer.size`` chunks and each read is timed, so adaptive sizing and
+    the heartbeat's ``chunks`` follow the client's link for form uploads too.
+    """
+
+    def __init__(self, stream, sizer: ChunkSizer):
+        self.stream = stream
+        self.sizer = sizer
+        self._buffer = b""
+        self._pos = 0
+
+    def read(self, size=-1):
+        if self._pos >= len(self._buffer):
+            started = time.monotonic()
+            self._buffer = self.stream.read(self.sizer.size)
+            self._pos = 0
+            if not self._buffer:
+                return b""
+            self.sizer.observe(len(self._buffer), time.monotonic() - started)
+        end = len(self._buffer) if size is None or size < 0 else self._pos + size
+        data = self._buffer[self._pos:end]
+        self._pos += len(data)
+        return data
+
+
+class _FormPart:
+    """What Werkzeug's multipart parser writes a file part into for ``UploadRequest``."""
+
+    def __init__(self, upload: "_Upload"):
+        self.upload = upload
+
+    def write(self, data):
+        try:
+            self.upload.write(data)
+        except Exception as exc:
+            self.upload.abort(exc)
+            raise
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        return 0  # the parser rewinds each finished part; nothing to do
+
+    def read(self, size=-1):
+        raise io.UnsupportedOperation("this part was written to storage as it arrived; publish it with save_file()")
+
+    def close(self):
+        self.upload.abort("the request ended before the upload was saved")
+
+
+class UploadRequest(Request):
+    """``request_class`` that receives an upload form's file straight into the store.
+
+    Werkzeug parses the whole multipart body before a view gets
+    ``request.files``, by default into a temporary file, so a heartbeat fed
+    from that copy only sees disk speed once the client is done. After
+    ``form_upload(group)`` the first file part is written through
+    ``_Upload`` from inside the parser instead: the heartbeat's rate, ETA and
+    stall flag follow the client's link and ``save_file`` only publishes.
+    The body itself is read through ``_SizedInput``.
+    """
+
+    upload_group = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._form_parts = []
+        self._input = None
+
+    def _get_stream_for_parsing(self):
+        stream = super()._get_stream_for_parsing()
+        if self.upload_group is None:
+            return stream
+        self._input = _SizedInput(stream, _chunk_sizer())
+        return self._input
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_group is None or self._form_parts or not secure_filename(filename or ""):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        # browsers do not send a per-part length; the request size is close enough for progress
+        upload = _Upload(
+            self.upload_group, filename, total_bytes=content_length or total_content_length,
+            sizer=self._input.sizer if self._input is not None else None,
+        )
+        part = _FormPart(upload)
+        self._form_parts.append(part)
+        return part
+
+    def close(self):
+        # a body that broke off mid-part never reaches request.files
+        for part in self._form_parts:
+            part.close()
+        super().close()
+
+
+def form_upload(group: str, field: str = "file"):
+    """``request.files[field]`` of an upload form, received directly into ``group``."""
+    request.upload_group = group
+    return request.files.get(field)
+
 
 def save_file(group, file_storage, chunk_size=None, max_bytes=None):
     """Stream an uploaded file to UPLOAD_FOLDER/<group>/<filename> and return the path."""
-    if chunk_size is None:
-        chunk_size = int(current_app.config.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    if isinstance(file_storage.stream, _FormPart):
+        return file_storage.stream.upload.publish()
+    total_bytes = getattr(file_storage, "content_length", None)
+    fill = StreamFill(file_storage.stream, chunk_size)
+    return store_upload(group, file_storage.filename, fill, total_bytes=total_bytes)
 
-    target_dir = _upload_root() / group
-    target_dir.mkdir(parents=True, exist_ok=True)
 
-    safe = secure_filename(file_storage.filename)
-    dest = target_dir / safe
-    temp_dest = dest.with_suffix(dest.suffix + ".part")
+class UploadConflict(Exception):
+    """A resumable upload did not start where the stored part ends."""
 
-    heartbeat = UploadHeartbeat(group, safe)
-    total_bytes = getattr(file_storage, "content_length", None)
-    heartbeat.start(total_bytes=total_bytes)
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
 
-    # Python 3.6 safe streaming
-    bytes_written = 0
+
+def _resume_part(group: str, safe: str, size=None) -> Path:
+    name = storage.part_name(safe, "resume")
+    existing = storage.find_file(group, name)
+    if existing is not None:
+        return existing
+    volume = storage.place(group, safe, size)
+    return storage.file_dir(volume, group, name, storage.fanout_wanted(group)) / name
+
+
+def resumable_offset(group: str, filename: str) -> int:
+    """Bytes of a resumable upload of ``filename`` received so far (a lookup only, creates nothing)."""
+    part = storage.find_file(group, storage.part_name(secure_filename(filename), "resume"))
+    if part is None:
+        return 0
+    try:
+        return part.stat().st_size
+    except OSError:
+        return 0
+
+
+def _open_resume_part(path: Path, offset: int):
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    out = os.fdopen(fd, "ab")
     try:
-        with open(temp_dest, "wb") as out:
-            while True:
-                chunk = file_storage.stream.read(chunk_size)
-                if not chunk:
-                    break
-                bytes_written += len(chunk)
-                out.write(chunk)
-                heartbeat.pulse(len(chunk))
-
-        os.replace(temp_dest, dest)
-        heartbeat.complete()
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        size = os.fstat(fd).st_size
+        out.close()
+        raise UploadConflict("another upload of this file is in progress", size) from None
+    size = os.fstat(fd).st_size
+    if offset == 0:
+        out.truncate(0)
+    elif offset != size:
+        out.close()
+        raise UploadConflict(f"upload offset {offset} does not match the {size} bytes received", size)
+    return out
+
+
+def _digest_file(path: Path):
+    digest = _new_digest()
+    if digest is None:
+        return None
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest
+
+
+def _replicated_group(config, group: str, name: str) -> bool:
+    groups = {entry.upper() for entry in config.get("REPLICATE_GROUPS") or ()}
+    return bool(config.get("REPLICATE_PEERS")) and group.upper() in groups
+
+
+@stage("replicate", applies=_replicated_group, concurrency=2)
+def _replicate_stage(job, path, config):
+    jobs = enqueue_replication(config["REPLICATE_FOLDER"], config["REPLICATE_PEERS"], job["group"], path)
+    return {"replication_jobs": jobs}
+
+
+def _oncall_pdf(config, group: str, name: str) -> bool:
+    return group.upper() == ONCALL_GROUP_NAME and name.lower().endswith(".pdf")
+
+
+@stage("validate_pdf", applies=_oncall_pdf)
+def _validate_pdf_stage(job, path, config):
+    # primes the validator cache the /admin/oncall and /admin/health pages use
+    check = check_pdf(path)
+    if not check.ok:
+        logger.warning("ONCALL upload %s failed PDF validation: %s", job["file"], check.reason)
+    return {"validation": {"ok": check.ok, "reason": check.reason}}
+
+
+def _pipeline_job(group: str, name: str, change_seq, replicate: bool):
+    cfg = current_app.config
+    stages = stages_for(cfg, group, name, skip=() if replicate else ("replicate",))
+    return new_job(group, name, stages, change_seq) if stages else None
+
+
+def _enqueue_pipeline(job):
+    try:
+        enqueue_pipeline(current_app.config["PIPELINE_FOLDER"], job)
+    except OSError as exc:
+        current_app.logger.warning("could not queue %s/%s for post-processing: %s", job["group"], job["file"], exc)
+
+
+class _Upload:
+    """One upload being written to its part file (see ``store_upload``).
+
+    ``write`` takes the chunks as they arrive; ``publish`` renames the file
+    into place and records it, ``abort`` gives up. Either one ends the upload.
+    """
+
+    def __init__(self, group, filename, total_bytes=None, resume_offset=None, replicate=True, sizer=None):
+        self.group = group
+        self.safe = safe = secure_filename(filename)
+        self.total_bytes = total_bytes
+        self.resumable = resume_offset is not None
+        self.offset = resume_offset or 0
+        self.replicate = replicate
+        if self.resumable:
+            # the part stays on the volume it started on
+            self.temp_dest = _resume_part(group, safe, total_bytes)
+            self.target_dir = self.temp_dest.parent
+            volume = storage.volume_of(self.temp_dest)
+        else:
+            volume = storage.place(group, safe, total_bytes)
+            self.target_dir = storage.file_dir(volume, group, safe, storage.fanout_wanted(group))
+            self.temp_dest = self.target_dir / storage.part_name(safe)
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+        out = _open_resume_part(self.temp_dest, resume_offset) if self.resumable else open(self.temp_dest, "wb")
+        self._open = ExitStack()
+        self._open.enter_context(out)
+        self._open.enter_context(storage.writing(volume))
+        try:
+            self.heartbeat = UploadHeartbeat(group, safe)
+            self.heartbeat.chunks = sizer
+            self.heartbeat.start(total_bytes=total_bytes, offset=self.offset)
+        except Exception:
+            self._open.close()
+            raise
+        self.writer = _PolicyWriter(out, _write_policy(group))
+        self.telemetry_folder = current_app.config.get("TELEMETRY_FOLDER")
+        note_upload_started(self.telemetry_folder)
+        self.digest = None if self.offset else _new_digest()
+        self.bytes_written = 0
+        self.phases = {}
+        self._mark = time.monotonic()
+        self._ended = False
+
+    def write(self, chunk):
+        if self.resumable and self.total_bytes is not None:
+            if self.offset + self.bytes_written + len(chunk) > self.total_bytes:
+                raise ValueError(f"more than the announced {self.total_bytes} bytes")
+        self.bytes_written += len(chunk)
+        self.writer.write(chunk)
+        if self.digest is not None:
+            self.digest.update(chunk)
+        self.heartbeat.pulse(len(chunk))
+        note_upload_bytes(self.telemetry_folder, len(chunk))
+
+    def publish(self):
+        """Return the published path, or None while a resumable upload is still incomplete."""
+        try:
+            path = self._publish()
+        except Exception as exc:
+            self.abort(exc)
+            raise
+        self._end()
+        return path
+
+    def _publish(self):
+        with self._open:
+            self.writer.finish()
+        group, safe, writer = self.group, self.safe, self.writer
+        self.phases["receive"] = time.monotonic() - self._mark - writer.sync_seconds
+        self.phases["sync"] = writer.sync_seconds
+        size = self.offset + self.bytes_written
+        if self.resumable and self.total_bytes is not None and size < self.total_bytes:
+            self.heartbeat.pause(f"received {size} of {self.total_bytes} bytes")
+            return None
+
+        mark = time.monotonic()
+        digest = _digest_file(self.temp_dest) if self.offset else self.digest
+        dest = self.target_dir / safe
+        replaced = storage.find_file(group, safe) is not None
+        os.replace(self.temp_dest, dest)
+        storage.drop_other_copies(group, safe, keep=dest)
+        if writer.sync_mode != "none":
+            _fsync_dir(self.target_dir)
+        digest_text = _format_digest(digest)
+        change_seq = append_change(
+            _changes_folder(),
+            group,
+            "replaced" if replaced else "added",
+            safe,
+            size=size,
+            digest=digest_text,
+        )
+        notify_changed(group)
+        note_file(group, safe, size, time.time())
+        job = _pipeline_job(group, safe, change_seq, self.replicate)
+        self.phases["publish"] = time.monotonic() - mark
+        self.heartbeat.update(
+            total_bytes=size,  # form uploads only announce the size of the whole request
+            sync_seconds=round(writer.sync_seconds, 3),
+            digest=digest_text,
+            change_seq=change_seq,
+            pipeline=summary(job) if job else None,
+            phases={name: round(value, 3) for name, value in self.phases.items()},
+        )
+        self.heartbeat.complete()
+        if job:
+            _enqueue_pipeline(job)  # after complete(): stages merge into the completed record
+        return str(dest)
+
+    def abort(self, reason):
+        """Give up on the upload; a no-op once it has ended."""
+        if self._ended:
+            return
+        self._open.close()
+        if self.resumable:
+            # keep what arrived; the sender resumes from resumable_offset()
+            self.heartbeat.pause(str(reason))
+        else:
+            self.heartbeat.fail(str(reason))
+            if self.temp_dest.exists():
+                self.temp_dest.unlink()
+        self._end()
+
+    def _end(self):
+        if self._ended:
+            return
+        self._ended = True
+        note_upload_finished(self.telemetry_folder)
+        note_request(
+            upload_file=self.safe,
+            upload_bytes=self.bytes_written,
+            phases_ms={name: round(value * 1000, 1) for name, value in self.phases.items()},
+        )
+
+
+def store_upload(group, filename, fill, total_bytes=None, resume_offset=None, replicate=True):
+    """Write the chunks produced by ``fill(sink)`` to a .part file and publish it.
+
+    Every upload path (multipart form, block delta, resumable PUT) goes
+    through ``_Upload`` so the write policy, digest, heartbeat and change
+    feed behave the same.
+
+    With ``resume_offset`` the chunks are appended to a ``.td-resume.<name>`` part file
+    that is kept when the request fails; it must hold exactly that many bytes
+    already (0 starts over, otherwise UploadConflict) and the file is only
+    published once ``total_bytes`` have arrived. Returns the published path,
+    or None while a resumable upload is still incomplete.
+    """
+    upload = _Upload(group, filename, total_bytes, resume_offset, replicate, getattr(fill, "sizer", None))
+    try:
+        fill(upload.write)
     except Exception as exc:
-        heartbeat.fail(str(exc))
-        if temp_dest.exists():
-            temp_dest.unlink()
+        upload.abort(exc)
         raise
+    return upload.publish()
 
-    return str(dest)
+
+def _status_files(root: Path):
+    """Heartbeat files in ``root``; scandir's d_type avoids a stat per entry."""
+    try:
+        with os.scandir(root) as it:
+            return [Path(entry.path) for entry in it if entry.name.endswith(".json") and entry.is_file()]
+    except OSError:
+        return []
+
+
+def _format_rate(bps: float) -> str:
+    return f"{bps / (1024 * 1024):.1f} MB/s" if bps >= 1024 * 1024 else f"{bps / 1024:.1f} KB/s"
+
+
+def _transfer_metrics(data, now: float):
+    """Rate / ETA / stall fields of one heartbeat file for the status pages and APIs."""
+    live = data.get("status") == "in_progress"
+    # the flusher flags live stalls within TD_HEARTBEAT_STALL seconds; a file
+    # nobody refreshes any more means the worker itself is gone
+    interval = int(current_app.config.get("HEARTBEAT_INTERVAL", 30)) or 30
+    last_seen = max(data.get("flushed_ts") or 0, data.get("updated_ts") or 0)
+    stalled = live and (bool(data.get("stalled")) or now - last_seen > interval * 4)
+    rate = data.get("rate_bps") if live else data.get("rate_avg_bps")
+    eta = data.get("eta_seconds") if live and not stalled else None
+    return {
+        "stalled": stalled,
+        "rate_bps": rate,
+        "rate_min_bps": data.get("rate_min_bps"),
+        "rate_max_bps": data.get("rate_max_bps"),
+        "longest_gap_seconds": data.get("longest_gap_seconds"),
+        "current_gap_seconds": data.get("current_gap_seconds") if live else None,
+        "eta_seconds": eta,
+        "rate_display": _format_rate(rate) if rate is not None else None,
+        "eta_display": _format_ago(eta) if eta is not None else None,
+    }
 
 
 def list_active_uploads(group: str):
@@ -226,7 +829,7 @@ def list_active_uploads(group: str):
     retention = _heartbeat_retention_seconds(group)
     statuses = []
 
-    for path in sorted(root.glob("*.json")):
+    for path in sorted(_status_files(root)):
         try:
             data = json.loads(path.read_text())
         except (json.JSONDecodeError, OSError):
@@ -239,7 +842,6 @@ def list_active_uploads(group: str):
 
         status = data.get("status", "unknown")
         file_name = data.get("file", path.stem)
-        file_path = _upload_root() / group / file_name
 
         if status == "completed" and age > retention:
             try:
@@ -248,7 +850,7 @@ def list_active_uploads(group: str):
                 pass
             continue
 
-        if status != "in_progress" and not file_path.exists() and age > retention:
+        if status != "in_progress" and age > retention and storage.find_file(group, file_name) is None:
             try:
                 path.unlink()
             except OSError:
@@ -263,22 +865,11 @@ def list_active_uploads(group: str):
 
         started_ts = data.get("started_ts")
         completed_ts = data.get("completed_ts")
-        heartbeat_interval = int(current_app.config.get("HEARTBEAT_INTERVAL", 30)) or 1
         duration_display = None
         if started_ts and completed_ts:
-            duration = max(0, completed_ts - started_ts)
-            rounded = max(
-                heartbeat_interval,
-                int(round(duration / heartbeat_interval)) * heartbeat_interval,
-            )
-            duration_display = _format_ago(rounded)
+            duration_display = _format_ago(max(0, completed_ts - started_ts))
         elif started_ts and status == "in_progress":
-            elapsed = max(0, now - started_ts)
-            rounded = max(
-                heartbeat_interval,
-                int(round(elapsed / heartbeat_interval)) * heartbeat_interval,
-            )
-            duration_display = _format_ago(rounded)
+            duration_display = _format_ago(max(0, now - started_ts))
 
         completed_ts = data.get("completed_ts")
         completed_iso = _iso_utc(completed_ts) if completed_ts else None
@@ -299,6 +890,9 @@ def list_active_uploads(group: str):
             "started_iso": _iso_utc(started_ts) if started_ts else None,
             "duration_display": duration_display,
             "error": data.get("error"),
+            "validation": data.get("validation"),
+            "pipeline": data.get("pipeline"),
+            **_transfer_metrics(data, now),
         })
 
     return statuses
@@ -313,11 +907,11 @@ def list_recent_transfers(hours: float = 24.0):
     cutoff = _now_ts() - max(hours, 0) * 3600
     transfers = []
 
-    for group_dir in sorted(status_root.iterdir()):
-        if not group_dir.is_dir():
-            continue
+    with os.scandir(status_root) as it:
+        status_dirs = sorted(entry.path for entry in it if entry.is_dir())
+    for group_dir in map(Path, status_dirs):
         group_name = group_dir.name
-        for path in group_dir.glob("*.json"):
+        for path in _status_files(group_dir):
             try:
                 data = json.loads(path.read_text())
             except (json.JSONDecodeError, OSError):
@@ -357,11 +951,9 @@ def list_recent_transfers(hours: float = 24.0):
                 record["duration_seconds"] = duration
                 record["duration_display"] = _format_ago(duration)
 
-            if status == "in_progress":
-                heartbeat_interval = int(current_app.config.get("HEARTBEAT_INTERVAL", 30)) or 30
-                stale_cutoff = updated_ts + heartbeat_interval * 4
-                if stale_cutoff < _now_ts():
-                    record["status"] = "stalled"
+            record.update(_transfer_metrics(data, _now_ts()))
+            if record["stalled"]:
+                record["status"] = "stalled"
             elif status not in {"completed", "failed"} and completed_ts:
                 record["status"] = "completed"
 
@@ -377,7 +969,7 @@ def clear_completed_statuses(group: str) -> int:
         return 0
 
     cleared = 0
-    for path in root.glob("*.json"):
+    for path in _status_files(root):
         try:
             data = json.loads(path.read_text())
         except (json.JSONDecodeError, OSError):
@@ -0,0 +1,156 @@
+"""Durable job queue shared by replication and the post-publish pipeline.
+
+A queue is a directory of small JSON job files, written atomically by
+``write_json`` so every uWSGI worker can enqueue and the runner picks them
+up after a restart. A newer job for the same key simply replaces the file;
+``created_ts`` tells a job apart from the one that replaced it, so the runner
+only saves or removes the job it is working on (``save_if_current`` /
+``remove_if_current``).
+
+``QueueRunner`` is the dispatcher loop: one process per host holds its
+``LeaderLock`` and calls ``_dispatch`` whenever the job directory changes,
+a worker asks for it with ``_wake``, or the next backed-off job is due.
+Finished jobs are appended to ``done.log`` (rotated at 1 MB), which
+``read_done_tail`` reads back for ``/admin/health``.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from .runtime import LeaderLock, pid_alive
+
+
+_DONE_LOG_LIMIT = 1024 * 1024
+_DONE_TAIL_BYTES = 256 * 1024
+_DISPATCH_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def write_json(path: str, payload):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def read_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def job_paths(directory):
+    """Paths of the queued job files in ``directory`` (none if it does not exist yet)."""
+    try:
+        with os.scandir(directory) as it:
+            return [entry.path for entry in it if entry.name.endswith(".json")]
+    except FileNotFoundError:
+        return []
+
+
+def is_current(path: str, job) -> bool:
+    current = read_json(path)
+    return current is not None and current.get("created_ts") == job.get("created_ts")
+
+
+def save_if_current(path: str, job):
+    if is_current(path, job):  # otherwise re-queued meanwhile; keep the newer job
+        write_json(path, job)
+
+
+def remove_if_current(path: str, job):
+    if is_current(path, job):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def retry_at(attempts: int, backoff: float, backoff_max: float) -> float:
+    """When to try again after ``attempts`` failures: exponential backoff with jitter."""
+    delay = min(backoff * (2 ** (attempts - 1)), backoff_max)
+    return time.time() + delay * random.uniform(0.5, 1.0)
+
+
+def read_done_tail(folder):
+    """Records of the last ``_DONE_TAIL_BYTES`` of ``folder/done.log``, oldest first."""
+    path = os.path.join(folder, "done.log")
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(size - _DONE_TAIL_BYTES, 0))
+            data = f.read()
+    except OSError:
+        return []
+    records = []
+    for line in data.splitlines()[1 if size > _DONE_TAIL_BYTES else 0:]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+def leader_pid(folder, lock_name: str):
+    """Pid of the live process holding the runner's lock, else None."""
+    try:
+        with open(os.path.join(folder, lock_name)) as f:
+            pid = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return None
+    return pid if pid and pid_alive(pid) else None
+
+
+class QueueRunner:
+    """Dispatcher loop over ``jobs_dir``; only the ``lock_name`` holder dispatches."""
+
+    label = "queue"  # for log messages
+
+    def __init__(self, folder, jobs_dir, lock_name: str):
+        self.folder = folder
+        self.jobs_dir = jobs_dir
+        self.lock = LeaderLock(os.path.join(folder, lock_name))
+        self._wake = threading.Event()
+        self._done_lock = threading.Lock()
+
+    def _on_leader(self):
+        """Called on every pass while this process holds the lock, before dispatching."""
+
+    def _dispatch(self) -> float:
+        """Hand due jobs to the workers; returns when the next backed-off job is due."""
+        raise NotImplementedError
+
+    def run(self):
+        dir_mtime = None
+        next_due = 0.0
+        while True:
+            try:
+                if self.lock.try_acquire():
+                    self._on_leader()
+                    mtime = os.stat(self.jobs_dir).st_mtime_ns
+                    if mtime != dir_mtime or self._wake.is_set() or time.time() >= next_due:
+                        self._wake.clear()
+                        dir_mtime = mtime
+                        next_due = self._dispatch()
+            except FileNotFoundError:
+                os.makedirs(self.jobs_dir, exist_ok=True)
+            except Exception:  # keep dispatching even if one pass fails
+                logger.exception("%s dispatch failed", self.label)
+            self._wake.wait(_DISPATCH_INTERVAL)
+
+    def _log_done(self, record):
+        log_path = os.path.join(self.folder, "done.log")
+        with self._done_lock:
+            try:
+                if os.path.getsize(log_path) > _DONE_LOG_LIMIT:
+                    os.replace(log_path, log_path + ".1")
+            except FileNotFoundError:
+                pass
+            with open(log_path, "a") as f:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
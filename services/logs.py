@@ -0,0 +1,221 @@
+"""Non-blocking JSON logging and per-request access records.
+
+Request threads only put records on a bounded in-memory queue
+(``QueueHandler``); one ``QueueListener`` thread per process formats them and
+writes to stderr, so a slow log sink never stalls an upload. When the queue
+is full records are dropped and counted instead of blocking.
+
+``init_request_logging`` adds one access record per request with request id,
+route, group, bytes in/out, duration and any upload phase timings noted via
+``note_request``. High-volume endpoints (status polling, listings) can be
+sampled with ``TD_LOG_SAMPLE``; errors and slow requests are always logged,
+and the slowest recent requests are kept in a per-process ring buffer for
+``/admin/requests``.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import g, has_request_context, request
+
+from .runtime import start_once
+
+
+_QUEUE_SIZE = 10000
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+access_logger = logging.getLogger("transferdepot.access")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra=`` fields become top-level keys."""
+
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, default=str, separators=(",", ":"))
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def prepare(self, record):
+        # format the message here (args may not be thread-safe to keep), but
+        # leave JSON encoding to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+class _LogState:
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+        self.formatter = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+
+_state = _LogState()
+
+
+def _start_listener():
+    with _state.lock:
+        if _state.handler is None or _state.pid == os.getpid():
+            return
+        if _state.listener is not None:
+            # inherited through fork: the listener thread is gone and the
+            # queue may hold the parent's records or a held lock
+            _state.handler.queue = queue.Queue(_QUEUE_SIZE)
+        sink = logging.StreamHandler(sys.stderr)
+        sink.setFormatter(_state.formatter)
+        _state.listener = logging.handlers.QueueListener(_state.handler.queue, sink)
+        _state.listener.start()
+        _state.pid = os.getpid()
+
+
+def _stop_listener():
+    listener = _state.listener
+    if listener is not None and _state.pid == os.getpid():
+        listener.stop()  # flushes what is still queued
+
+
+def setup_logging(settings):
+    """Route the root logger through the queue; safe to call more than once."""
+    root = logging.getLogger()
+    root.setLevel(settings.log_level)
+    if _state.handler is None:
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        _state.handler = _DroppingQueueHandler(queue.Queue(_QUEUE_SIZE))
+        root.addHandler(_state.handler)
+        atexit.register(_stop_listener)
+    if settings.log_format == "json":
+        _state.formatter = JsonFormatter()
+    else:
+        _state.formatter = logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s")
+    if _state.listener is not None:
+        for sink in _state.listener.handlers:
+            sink.setFormatter(_state.formatter)
+    _start_listener()
+    start_once("td-log-listener", _start_listener)
+
+
+def dropped_records() -> int:
+    return _DroppingQueueHandler.dropped
+
+
+# --- per-request access records ---
+class SlowRequests:
+    """Thread-safe ring of the most recent slow requests in this process."""
+
+    def __init__(self, keep: int):
+        self._items = deque(maxlen=max(keep, 1))
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._items.append(record)
+
+    def snapshot(self):
+        with self._lock:
+            return list(reversed(self._items))
+
+
+def note_request(**fields):
+    """Attach fields (bytes, phases, ...) to the current request's access record."""
+    if has_request_context():
+        g.setdefault("log_fields", {}).update(fields)
+
+
+def _request_id():
+    incoming = request.headers.get("X-Request-ID", "")
+    if incoming and len(incoming) <= 64 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+def init_request_logging(app):
+    settings = app.config["SETTINGS"]
+    sample = dict(settings.log_sample)
+    slow_ms = settings.slow_request_ms
+    slow = SlowRequests(settings.slow_request_keep)
+    app.extensions["td_slow_requests"] = slow
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        g.request_id = _request_id()
+
+    @app.after_request
+    def _access_log(response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        response.headers["X-Request-ID"] = g.request_id
+        endpoint = request.endpoint or "-"
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        fields = {
+            "request_id": g.request_id,
+            "method": request.method,
+            "route": rule,
+            "endpoint": endpoint,
+            "group": (request.view_args or {}).get("group"),
+            "status": response.status_code,
+            "bytes_in": request.content_length or 0,
+        }
+        fields.update(g.get("log_fields", {}))
+
+        def finish():
+            # after the body has been streamed, so generated bodies are timed fully
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            fields["duration_ms"] = duration_ms
+            fields.setdefault("bytes_out", response.content_length)
+            is_slow = slow_ms > 0 and duration_ms >= slow_ms
+            if is_slow:
+                slow.add(dict(fields, ts=round(time.time(), 3), pid=os.getpid()))
+            rate = sample.get(endpoint, 1.0)
+            if is_slow or fields["status"] >= 400 or rate >= 1.0 or random.random() < rate:
+                access_logger.info(
+                    "%s %s %s %.1fms", fields["method"], request_path, fields["status"], duration_ms,
+                    extra=fields,
+                )
+
+        request_path = request.full_path.rstrip("?")
+        if response.direct_passthrough:
+            # file bodies go to wsgi.file_wrapper (uWSGI offloads them) and
+            # close callbacks never fire, so time up to handing the file over
+            finish()
+        else:
+            response.call_on_close(finish)
+        return response
@@ -0,0 +1,389 @@
+"""Structural PDF validation without qpdf.
+
+Checks the ``%PDF-`` header, locates the last ``startxref``, parses every
+cross-reference section in the ``/Prev`` chain (classic tables, xref streams
+and hybrid ``/XRefStm`` files), requires a trailer with ``/Root`` and
+``/Size`` and confirms each in-use object offset really points at
+``<num> <gen> obj``. Results are cached per (inode, size, mtime) so repeat
+checks of an unchanged file cost one ``stat``.
+
+Stdlib only, so ``python3 services/pdfcheck.py board.pdf`` works for a manual
+check on hosts without Flask.
+"""
+import mmap
+import os
+import re
+import sys
+import threading
+import zlib
+from typing import NamedTuple, Optional
+
+
+class PdfCheck(NamedTuple):
+    ok: bool
+    reason: str
+    version: Optional[str] = None
+    objects: int = 0
+
+
+_HEADER_RE = re.compile(rb"%PDF-(\d\.\d)")
+_OBJ_RE = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+_WS = b" \t\r\n\f\x00"
+_DELIMS = b"()<>[]{}/%"
+_NUMBER_RE = re.compile(rb"[+-]?(\d+\.?\d*|\.\d+)")
+_REF_RE = re.compile(rb"\s+(\d+)\s+R\b")
+_MAX_SECTIONS = 64
+
+
+class PdfError(ValueError):
+    pass
+
+
+class _Ref(NamedTuple):
+    num: int
+    gen: int
+
+
+# --- minimal object parser (enough for trailers and xref stream dicts) ---
+def _skip_ws(data, pos):
+    size = len(data)
+    while pos < size:
+        ch = data[pos:pos + 1]
+        if ch == b"%":
+            end = data.find(b"\n", pos)
+            pos = size if end < 0 else end + 1
+            continue
+        if ch not in _WS:
+            break
+        pos += 1
+    return pos
+
+
+def _parse_object(data, pos):
+    pos = _skip_ws(data, pos)
+    head = data[pos:pos + 2]
+    if head == b"<<":
+        result = {}
+        pos += 2
+        while True:
+            pos = _skip_ws(data, pos)
+            if data[pos:pos + 2] == b">>":
+                return result, pos + 2
+            key, pos = _parse_object(data, pos)
+            if not isinstance(key, str) or not key.startswith("/"):
+                raise PdfError("malformed dictionary key")
+            value, pos = _parse_object(data, pos)
+            result[key[1:]] = value
+    if head[:1] == b"[":
+        items = []
+        pos += 1
+        while True:
+            pos = _skip_ws(data, pos)
+            if data[pos:pos + 1] == b"]":
+                return items, pos + 1
+            if pos >= len(data):
+                raise PdfError("unterminated array")
+            value, pos = _parse_object(data, pos)
+            items.append(value)
+    if head[:1] == b"/":
+        end = pos + 1
+        while end < len(data) and data[end:end + 1] not in _WS and data[end:end + 1] not in _DELIMS:
+            end += 1
+        return "/" + data[pos + 1:end].decode("latin-1"), end
+    if head[:1] == b"(":
+        depth, end = 0, pos
+        while end < len(data):
+            ch = data[end:end + 1]
+            if ch == b"\\":
+                end += 2
+                continue
+            if ch == b"(":
+                depth += 1
+            elif ch == b")":
+                depth -= 1
+                if depth == 0:
+                    return bytes(data[pos + 1:end]), end + 1
+            end += 1
+        raise PdfError("unterminated string")
+    if head[:1] == b"<":
+        end = data.find(b">", pos)
+        if end < 0:
+            raise PdfError("unterminated hex string")
+        return bytes(data[pos + 1:end]), end + 1
+    match = _NUMBER_RE.match(data, pos)
+    if match:
+        text = match.group(0)
+        if b"." not in text:
+            ref = _REF_RE.match(data, match.end())
+            if ref:
+                return _Ref(int(text), int(ref.group(1))), ref.end()
+            return int(text), match.end()
+        return float(text), match.end()
+    for word, value in ((b"true", True), (b"false", False), (b"null", None)):
+        if data[pos:pos + len(word)] == word:
+            return value, pos + len(word)
+    raise PdfError(f"unexpected token at offset {pos}")
+
+
+# --- xref parsing ---
+def _parse_xref_table(data, pos, entries):
+    pos = _skip_ws(data, pos + 4)
+    size = len(data)
+    while pos < size and data[pos:pos + 7] != b"trailer":
+        line_end = data.find(b"\n", pos)
+        header = bytes(data[pos:line_end if line_end >= 0 else size]).split()
+        if len(header) != 2:
+            raise PdfError("malformed xref subsection header")
+        start, count = int(header[0]), int(header[1])
+        pos = line_end + 1
+        for num in range(start, start + count):
+            row = bytes(data[pos:pos + 20]).split()
+            if len(row) != 3 or row[2] not in (b"n", b"f"):
+                raise PdfError(f"malformed xref entry for object {num}")
+            if num not in entries:
+                in_use = row[2] == b"n"
+                entries[num] = ("offset", int(row[0]), int(row[1])) if in_use else ("free", 0, 0)
+            pos = _skip_ws(data, pos + 18)
+    if data[pos:pos + 7] != b"trailer":
+        raise PdfError("xref table without trailer")
+    trailer, _ = _parse_object(data, pos + 7)
+    if not isinstance(trailer, dict):
+        raise PdfError("trailer is not a dictionary")
+    return trailer
+
+
+def _png_unpredict(raw, columns):
+    row_size = columns + 1
+    if len(raw) % row_size:
+        raise PdfError("xref stream predictor rows do not line up")
+    out = bytearray()
+    prev = bytearray(columns)
+    for start in range(0, len(raw), row_size):
+        kind = raw[start]
+        row = bytearray(raw[start + 1:start + row_size])
+        for i in range(columns):
+            left = row[i - 1] if i else 0
+            up = prev[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + ((left + up) >> 1)) & 0xFF
+            elif kind == 4:
+                upleft = prev[i - 1] if i else 0
+                p = left + up - upleft
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - upleft)
+                pred = left if pa <= pb and pa <= pc else (up if pb <= pc else upleft)
+                row[i] = (row[i] + pred) & 0xFF
+            elif kind != 0:
+                raise PdfError(f"unsupported PNG predictor {kind}")
+        out += row
+        prev = row
+    return bytes(out)
+
+
+def _stream_body(data, pos, info):
+    pos = _skip_ws(data, pos)
+    if data[pos:pos + 6] != b"stream":
+        raise PdfError("xref stream object has no stream")
+    pos += 6
+    if data[pos:pos + 2] == b"\r\n":
+        pos += 2
+    elif data[pos:pos + 1] in (b"\n", b"\r"):
+        pos += 1
+    length = info.get("Length")
+    if isinstance(length, int):
+        body = data[pos:pos + length]
+    else:
+        end = data.find(b"endstream", pos)
+        if end < 0:
+            raise PdfError("unterminated stream")
+        body = data[pos:end].rstrip(b"\r\n")
+    body = bytes(body)
+    filters = info.get("Filter")
+    if isinstance(filters, str):
+        filters = [filters]
+    for name in filters or []:
+        if name != "/FlateDecode":
+            raise PdfError(f"unsupported xref stream filter {name}")
+        body = zlib.decompress(body)
+    parms = info.get("DecodeParms") or {}
+    if isinstance(parms, list):
+        parms = parms[0] if parms else {}
+    predictor = parms.get("Predictor", 1) if isinstance(parms, dict) else 1
+    if predictor >= 10:
+        body = _png_unpredict(body, int(parms.get("Columns", 1)))
+    elif predictor != 1:
+        raise PdfError(f"unsupported predictor {predictor}")
+    return body
+
+
+def _parse_xref_stream(data, pos, entries):
+    match = _OBJ_RE.match(data, pos)
+    if not match:
+        raise PdfError("startxref does not point at xref or an object")
+    info, end = _parse_object(data, match.end())
+    if not isinstance(info, dict) or info.get("Type") != "/XRef":
+        raise PdfError("startxref object is not an xref stream")
+    widths = info.get("W")
+    if not isinstance(widths, list) or len(widths) != 3:
+        raise PdfError("xref stream has invalid /W")
+    body = _stream_body(data, end, info)
+    index = info.get("Index") or [0, info.get("Size", 0)]
+    row_size = sum(widths)
+    if not row_size:
+        raise PdfError("xref stream rows are empty")
+    cursor = 0
+    for start, count in zip(index[0::2], index[1::2]):
+        for num in range(start, start + count):
+            row = body[cursor:cursor + row_size]
+            if len(row) < row_size:
+                raise PdfError("xref stream is truncated")
+            cursor += row_size
+            fields, offset = [], 0
+            for width in widths:
+                fields.append(int.from_bytes(row[offset:offset + width], "big") if width else None)
+                offset += width
+            kind = 1 if fields[0] is None else fields[0]
+            # hybrid files list stream-only objects as free in the table
+            if num in entries and entries[num][0] != "free":
+                continue
+            if kind == 1:
+                entries[num] = ("offset", fields[1], fields[2] or 0)
+            elif kind == 2:
+                entries[num] = ("compressed", fields[1], fields[2] or 0)
+            else:
+                entries[num] = ("free", 0, 0)
+    return info
+
+
+def _find_startxref(data):
+    tail_start = max(len(data) - 2048, 0)
+    tail = data[tail_start:]
+    marker = tail.rfind(b"startxref")
+    if marker < 0:
+        raise PdfError("no startxref near end of file")
+    if tail.rfind(b"%%EOF") < marker:
+        raise PdfError("missing %%EOF after startxref")
+    value, _ = _parse_object(tail, marker + len(b"startxref"))
+    if not isinstance(value, int):
+        raise PdfError("startxref offset is not a number")
+    return value
+
+
+def _validate_bytes(data) -> PdfCheck:
+    header = _HEADER_RE.search(data[:1024])
+    if not header:
+        return PdfCheck(False, "missing %PDF- header")
+    version = header.group(1).decode()
+    # some producers prepend junk before %PDF-; offsets are then relative to it
+    base = header.start()
+
+    entries = {}
+    trailer = None
+    offset = _find_startxref(data)
+    seen = set()
+    pending = [offset]
+    while pending:
+        offset = pending.pop(0)
+        if offset in seen or len(seen) >= _MAX_SECTIONS:
+            raise PdfError("xref /Prev chain loops")
+        seen.add(offset)
+        pos = base + offset
+        if pos >= len(data):
+            raise PdfError(f"xref offset {offset} is past end of file")
+        if data[pos:pos + 4] == b"xref":
+            section = _parse_xref_table(data, pos, entries)
+            if isinstance(section.get("XRefStm"), int):
+                pending.insert(0, section["XRefStm"])
+        else:
+            section = _parse_xref_stream(data, pos, entries)
+        if trailer is None:
+            trailer = section
+        if isinstance(section.get("Prev"), int):
+            pending.append(section["Prev"])
+
+    if not isinstance(trailer.get("Root"), _Ref):
+        return PdfCheck(False, "trailer has no /Root", version)
+    if not isinstance(trailer.get("Size"), int):
+        return PdfCheck(False, "trailer has no /Size", version)
+
+    in_use = 0
+    for num, (kind, first, gen) in entries.items():
+        if kind == "offset":
+            match = _OBJ_RE.match(data, base + first)
+            if not match or int(match.group(1)) != num or int(match.group(2)) != gen:
+                return PdfCheck(False, f"object {num} not found at offset {first}", version)
+            in_use += 1
+        elif kind == "compressed":
+            container = entries.get(first)
+            if not container or container[0] != "offset":
+                return PdfCheck(False, f"object {num} lives in missing object stream {first}", version)
+            in_use += 1
+
+    root = trailer["Root"].num
+    if entries.get(root, ("free",))[0] == "free":
+        return PdfCheck(False, f"/Root object {root} is not in the xref", version)
+    return PdfCheck(True, "ok", version, in_use)
+
+
+def validate_pdf(path) -> PdfCheck:
+    """Parse ``path`` and return a PdfCheck (never raises for bad input)."""
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return PdfCheck(False, "empty file")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _validate_bytes(data)
+    except (PdfError, zlib.error, ValueError, IndexError) as exc:
+        return PdfCheck(False, str(exc) or exc.__class__.__name__)
+    except OSError as exc:
+        return PdfCheck(False, f"cannot read file: {exc}")
+
+
+# --- cache ---
+_cache = {}
+_cache_lock = threading.Lock()
+_CACHE_LIMIT = 256
+
+
+def check_pdf(path) -> PdfCheck:
+    """Cached ``validate_pdf`` keyed by the file's (inode, size, mtime)."""
+    path = str(path)
+    try:
+        st = os.stat(path)
+    except OSError as exc:
+        return PdfCheck(False, f"cannot stat file: {exc}")
+    key = (st.st_ino, st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    result = validate_pdf(path)
+    with _cache_lock:
+        if len(_cache) >= _CACHE_LIMIT and path not in _cache:
+            _cache.pop(next(iter(_cache)))
+        _cache[path] = (key, result)
+    return result
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("usage: python3 services/pdfcheck.py FILE [FILE...]", file=sys.stderr)
+        return 2
+    status = 0
+    for path in argv:
+        result = validate_pdf(path)
+        label = "OK" if result.ok else "INVALID"
+        detail = f"PDF {result.version}, {result.objects} objects" if result.ok else result.reason
+        print(f"{label}: {path} ({detail})")
+        if not result.ok:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
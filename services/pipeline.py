@@ -0,0 +1,381 @@
+"""Post-publish processing of uploaded files on a bounded worker pool.
+
+Work that has to happen once a file is published (replication, validating
+the ONCALL board, anything added later) runs here instead of inside the
+upload request. A module registers a stage with ``@stage(name, applies=...)``;
+``stages_for`` picks the stages that apply to the file and ``enqueue`` writes
+one small JSON job per file under ``PIPELINE_FOLDER/jobs``, so the upload
+returns as soon as the file is renamed into place. A newer upload of the
+same file replaces the pending job. Jobs survive restarts and are shared by
+all uWSGI workers.
+
+One process per host (``LeaderLock``) runs the ``Pipeline``: a dispatcher
+thread and a ``ThreadPoolExecutor`` of ``TD_PIPELINE_WORKERS`` threads. The
+stages of one job run one after another in registration order; each stage
+has its own concurrency limit (``TD_PIPELINE_CONCURRENCY`` overrides the
+registered one), so a slow stage cannot occupy the whole pool. A stage that
+raises is retried with exponential backoff up to ``TD_PIPELINE_RETRIES``
+times and then marked failed; the remaining stages still run.
+
+Stage progress is merged into the upload's heartbeat file (``pipeline`` plus
+whatever fields the stage returns) under the same directory ``flock`` the
+heartbeat writer takes, so the status pages show it next to the upload.
+Jobs live in a ``services.jobqueue`` queue; finished ones are appended to
+its ``done.log`` for ``/admin/health``.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional
+
+from .jobqueue import (
+    QueueRunner, job_paths, leader_pid, read_done_tail, read_json, remove_if_current, retry_at,
+    save_if_current, write_json,
+)
+from .runtime import dir_lock, start_daemon, start_once
+from .storage import find_file, pool_volumes
+
+
+_OPEN = ("pending", "retrying")
+
+logger = logging.getLogger(__name__)
+
+
+class Stage(NamedTuple):
+    name: str
+    run: Callable  # run(job, path, config) -> dict of heartbeat fields or None
+    applies: Optional[Callable]  # applies(config, group, name) -> bool; None means every file
+    concurrency: int
+    retries: Optional[int]  # None: TD_PIPELINE_RETRIES
+
+
+_stages = {}
+
+
+def stage(name: str, applies=None, concurrency: int = 1, retries=None):
+    """Register ``fn(job, path, config)`` as a post-publish stage.
+
+    ``path`` is where the file is now (the rebalancer may have moved it since
+    the upload), ``config`` is the app config. Stages run outside the app
+    context, in registration order. Whatever dict the stage returns is merged
+    into the heartbeat record; raising retries the stage later.
+    """
+    def register(fn):
+        _stages[name] = Stage(name, fn, applies, max(int(concurrency), 1), retries)
+        return fn
+
+    return register
+
+
+def _jobs_dir(folder) -> str:
+    return os.path.join(folder, "jobs")
+
+
+def _job_id(group: str, name: str) -> str:
+    return hashlib.sha1(f"{group}\0{name}".encode()).hexdigest()[:20]
+
+
+def _next_stage(job):
+    for state in job["stages"]:
+        if state["status"] in _OPEN:
+            return state
+    return None
+
+
+def summary(job):
+    """The ``pipeline`` field of the heartbeat record for ``job``."""
+    stages = {
+        state["name"]: {key: state.get(key) for key in ("status", "attempts", "seconds", "error")}
+        for state in job["stages"]
+    }
+    statuses = {state["status"] for state in job["stages"]}
+    if "running" in statuses:
+        overall = "running"
+    elif "retrying" in statuses:
+        overall = "retrying"
+    elif "pending" in statuses:
+        overall = "pending"
+    elif "failed" in statuses:
+        overall = "failed"
+    else:
+        overall = "done"
+    return {"status": overall, "stages": stages}
+
+
+def stages_for(config, group: str, name: str, skip=()):
+    """Names of the registered stages that apply to ``group/name``."""
+    return [
+        entry.name
+        for entry in _stages.values()
+        if entry.name not in skip and (entry.applies is None or entry.applies(config, group, name))
+    ]
+
+
+def new_job(group: str, name: str, stages, change_seq):
+    """Job record running ``stages`` on a freshly published file; ``summary(job)`` is its heartbeat field."""
+    now = time.time()
+    return {
+        "id": _job_id(group, name),
+        "group": group,
+        "file": name,
+        "change_seq": change_seq,
+        "created_ts": now,
+        "stages": [
+            {"name": stage_name, "status": "pending", "attempts": 0, "next_try_ts": now,
+             "seconds": None, "error": None}
+            for stage_name in stages
+        ],
+    }
+
+
+def enqueue(folder, job):
+    """Queue ``job`` (replacing a pending job of the same file).
+
+    Call it once the upload's heartbeat is marked completed: stages only
+    report into a completed record of the same upload.
+    """
+    jobs_dir = _jobs_dir(folder)
+    os.makedirs(jobs_dir, exist_ok=True)
+    write_json(os.path.join(jobs_dir, f"{job['id']}.json"), job)
+
+
+class Pipeline(QueueRunner):
+    label = "pipeline"
+
+    def __init__(self, folder, config, vols, workers: int, retries: int, backoff: float, backoff_max: float,
+                 concurrency):
+        super().__init__(folder, _jobs_dir(folder), "pipeline.lock")
+        self.config = config
+        self.vols = vols
+        self.workers = max(int(workers), 1)
+        self.retries = max(int(retries), 0)
+        self.backoff = max(float(backoff), 0.1)
+        self.backoff_max = max(float(backoff_max), self.backoff)
+        self.concurrency = dict(concurrency or {})
+        self.status_folder = config.get("STATUS_FOLDER")
+        self._pool = None
+        self._running = {}
+        self._claimed = set()
+        self._state_lock = threading.Lock()
+
+    def _limit(self, entry: Stage) -> int:
+        return max(int(self.concurrency.get(entry.name, entry.concurrency)), 1)
+
+    # --- dispatcher ---
+    def _on_leader(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="td-pipeline")
+
+    def _dispatch(self) -> float:
+        """Hand due stages to the pool, oldest job first; returns when the next backed-off one is due."""
+        now = time.time()
+        next_due = now + 60
+        jobs = [(path, job) for path, job in ((path, read_json(path)) for path in job_paths(self.jobs_dir)) if job]
+        jobs.sort(key=lambda item: item[1].get("created_ts", 0))
+        for path, job in jobs:
+            with self._state_lock:
+                if job["id"] in self._claimed:
+                    continue
+            state = _next_stage(job)
+            if state is None:
+                self._finish(path, job, {})
+                continue
+            entry = _stages.get(state["name"])
+            if entry is None:
+                logger.warning("dropping unknown pipeline stage %s for %s/%s", state["name"], job["group"], job["file"])
+                state.update(status="failed", error="stage is not registered")
+                save_if_current(path, job)
+                continue
+            due = state.get("next_try_ts") or 0
+            if due > now:
+                next_due = min(next_due, due)
+                continue
+            with self._state_lock:
+                if self._running.get(entry.name, 0) >= self._limit(entry):
+                    continue
+                self._running[entry.name] = self._running.get(entry.name, 0) + 1
+                self._claimed.add(job["id"])
+            self._pool.submit(self._work, path, job["id"], entry)
+        return next_due
+
+    # --- workers ---
+    def _work(self, path: str, job_id: str, entry: Stage):
+        try:
+            job = read_json(path)
+            if job:
+                self._process(path, job, entry)
+        except Exception:
+            logger.exception("pipeline stage %s of %s crashed", entry.name, path)
+        finally:
+            with self._state_lock:
+                self._running[entry.name] -= 1
+                self._claimed.discard(job_id)
+            self._wake.set()  # its slot is free again
+
+    def _process(self, path: str, job, entry: Stage):
+        state = _next_stage(job)
+        if state is None or state["name"] != entry.name:
+            return  # replaced by a newer upload since it was dispatched
+        found = find_file(job["group"], job["file"], self.vols)
+        if found is None:
+            for other in job["stages"]:
+                if other["status"] in _OPEN:
+                    other.update(status="skipped", error="file is gone")
+            self._finish(path, job, {})
+            return
+
+        state["status"] = "running"
+        self._report(job, {})
+        started = time.monotonic()
+        result = {}
+        try:
+            result = entry.run(job, str(found), self.config) or {}
+        except Exception as exc:
+            state["attempts"] += 1
+            state["error"] = f"{type(exc).__name__}: {exc}"
+            retries = self.retries if entry.retries is None else entry.retries
+            if state["attempts"] > retries:
+                state["status"] = "failed"
+                logger.error(
+                    "pipeline stage %s for %s/%s failed after %d attempts: %s",
+                    entry.name, job["group"], job["file"], state["attempts"], exc,
+                )
+            else:
+                state["status"] = "retrying"
+                state["next_try_ts"] = retry_at(state["attempts"], self.backoff, self.backoff_max)
+                logger.warning(
+                    "pipeline stage %s for %s/%s failed (attempt %d): %s",
+                    entry.name, job["group"], job["file"], state["attempts"], exc,
+                )
+        else:
+            state["attempts"] += 1
+            state.update(status="done", error=None)
+        state["seconds"] = round(time.monotonic() - started, 3)
+
+        if _next_stage(job) is None:
+            self._finish(path, job, result)
+        else:
+            save_if_current(path, job)
+            self._report(job, result)
+
+    def _report(self, job, fields):
+        """Merge the stage state into the upload's heartbeat file, if it is still this upload's."""
+        if not self.status_folder:
+            return
+        status_dir = os.path.join(self.status_folder, job["group"])
+        status_path = os.path.join(status_dir, f"{job['file']}.json")
+        try:
+            # the heartbeat writer takes the same lock, so a new upload of the
+            # file cannot be overwritten with this record
+            with dir_lock(status_dir):
+                data = read_json(status_path)
+                if not data or data.get("change_seq") != job["change_seq"] or data.get("status") != "completed":
+                    return  # expired, cleared or a newer upload is running
+                now = time.time()
+                data.update(fields)
+                data["pipeline"] = summary(job)
+                data["updated_ts"] = now
+                data["updated_iso"] = datetime.utcfromtimestamp(now).strftime("%Y-%m-%dT%H:%M:%SZ")
+                write_json(status_path, data)
+        except FileNotFoundError:
+            pass  # status folder of the group is gone
+
+    def _finish(self, path: str, job, fields):
+        remove_if_current(path, job)
+        self._report(job, fields)
+        now = time.time()
+        self._log_done({
+            "ts": round(now, 3),
+            "group": job["group"],
+            "file": job["file"],
+            "lag": round(now - job["created_ts"], 3),
+            "stages": summary(job)["stages"],
+        })
+
+
+def start_pipeline(config):
+    """Start a pipeline in each worker; only the lock holder runs stages."""
+    folder = config.get("PIPELINE_FOLDER")
+    if not folder:
+        return
+
+    def _start():
+        pipeline = Pipeline(
+            folder,
+            config,
+            pool_volumes(config),
+            config.get("PIPELINE_WORKERS", 2),
+            config.get("PIPELINE_RETRIES", 3),
+            config.get("PIPELINE_BACKOFF", 2),
+            config.get("PIPELINE_BACKOFF_MAX", 300),
+            config.get("PIPELINE_CONCURRENCY"),
+        )
+        start_daemon("td-pipeline", pipeline.run)
+
+    start_once("td-pipeline", _start)
+
+
+def status(folder, window: float = 3600):
+    """Summarise queued and recently finished stages for the health page."""
+    now = time.time()
+    summary_by_stage = {}
+
+    def entry_for(name):
+        entry = summary_by_stage.get(name)
+        if entry is None:
+            entry = summary_by_stage[name] = {
+                "stage": name,
+                "pending": 0,
+                "retrying": 0,
+                "lag_seconds": None,
+                "done": 0,
+                "failed": 0,
+                "seconds": 0.0,
+                "avg_seconds": None,
+            }
+        return entry
+
+    for name in _stages:
+        entry_for(name)
+
+    failing = []
+    for path in job_paths(_jobs_dir(folder)):
+        job = read_json(path)
+        if not job:
+            continue
+        state = _next_stage(job)
+        if state is None:
+            continue
+        entry = entry_for(state["name"])
+        entry["pending"] += 1
+        age = now - job.get("created_ts", now)
+        entry["lag_seconds"] = max(entry["lag_seconds"] or 0, age)
+        if state["status"] == "retrying":
+            entry["retrying"] += 1
+            failing.append({"group": job["group"], "file": job["file"], **state})
+
+    for record in read_done_tail(folder):
+        if now - record.get("ts", 0) > window:
+            continue
+        for name, state in (record.get("stages") or {}).items():
+            entry = entry_for(name)
+            if state.get("status") == "done":
+                entry["done"] += 1
+                entry["seconds"] += state.get("seconds") or 0
+            elif state.get("status") == "failed":
+                entry["failed"] += 1
+                failing.append({"group": record["group"], "file": record["file"], "name": name, **state})
+    for entry in summary_by_stage.values():
+        if entry["done"]:
+            entry["avg_seconds"] = entry["seconds"] / entry["done"]
+
+    return {
+        "stages": list(summary_by_stage.values()),
+        "failing": failing[-20:],
+        "window": window,
+        "leader_pid": leader_pid(folder, "pipeline.lock"),
+    }
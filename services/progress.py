@@ -0,0 +1,191 @@
+"""Live rate, ETA and stall detection for uploads in progress.
+
+``RateTracker`` folds the chunks of one upload into one-second rate samples
+and keeps an EWMA of them (time constant ``_RATE_TAU``), the slowest and
+fastest sample over the last heartbeat interval, the longest gap between
+two chunks and an ETA from the announced size.
+
+A stalled link leaves the request thread blocked in ``read()``, so it cannot
+report anything itself. Every process therefore keeps a registry of its
+active heartbeats and one flusher thread that, every ``TD_HEARTBEAT_FLUSH``
+seconds, lets the rate decay through the gap, flags the upload ``stalled``
+once no chunk arrived for ``TD_HEARTBEAT_STALL`` seconds and rewrites the
+heartbeat file - other workers and the admin pages see it within seconds -
+and publishes the stalled count for the telemetry ring.
+
+``ChunkSizer`` picks the read size of one upload stream: it starts small,
+doubles while full reads come back well within ``_CHUNK_TARGET`` seconds
+(fast LAN pushes: fewer, larger syscalls) and drops to what arrives in that
+time once reads take longer (trickling WAN clients: less memory per thread
+and progress that keeps moving).
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from .runtime import start_daemon
+from .telemetry import note_stalled_uploads
+
+
+_RATE_WINDOW = 1.0  # seconds of chunks folded into one rate sample
+_RATE_TAU = 5.0  # EWMA time constant: a changed rate shows within a few seconds
+_CHUNK_TARGET = 0.25  # seconds one read should take
+_CHUNK_FLOOR = 4096
+_CHUNK_CHANGES_KEPT = 32
+
+
+class RateTracker:
+    def __init__(self, total_bytes=None, offset: int = 0, minmax_seconds: float = 30.0):
+        now = time.monotonic()
+        self.total = total_bytes
+        self.done = offset
+        self.rate = None
+        self.longest_gap = 0.0
+        self.last_chunk = now
+        self._window_start = now
+        self._window_bytes = 0
+        self._samples = deque()  # (monotonic ts, bytes/s) for min/max
+        self._keep = max(minmax_seconds, _RATE_WINDOW)
+        self._lock = threading.Lock()
+
+    def add(self, nbytes: int):
+        now = time.monotonic()
+        with self._lock:
+            self.longest_gap = max(self.longest_gap, now - self.last_chunk)
+            self.last_chunk = now
+            self.done += nbytes
+            self._window_bytes += nbytes
+            self._roll(now)
+
+    def tick(self):
+        """Close the current sample window even if no chunk arrived (decays the rate)."""
+        with self._lock:
+            self._roll(time.monotonic())
+
+    def _roll(self, now: float):
+        elapsed = now - self._window_start
+        if elapsed < _RATE_WINDOW:
+            return
+        sample = self._window_bytes / elapsed
+        if self.rate is None:
+            self.rate = sample
+        else:
+            self.rate += (1 - math.exp(-elapsed / _RATE_TAU)) * (sample - self.rate)
+        self._samples.append((now, sample))
+        while self._samples[0][0] < now - self._keep:
+            self._samples.popleft()
+        self._window_start = now
+        self._window_bytes = 0
+
+    def gap(self) -> float:
+        return time.monotonic() - self.last_chunk
+
+    def snapshot(self):
+        gap = self.gap()
+        with self._lock:
+            samples = [rate for _, rate in self._samples]
+            rate = self.rate
+            eta = None
+            if self.total is not None and rate:
+                eta = max(self.total - self.done, 0) / rate
+            return {
+                "rate_bps": round(rate, 1) if rate is not None else None,
+                "rate_min_bps": round(min(samples), 1) if samples else None,
+                "rate_max_bps": round(max(samples), 1) if samples else None,
+                "longest_gap_seconds": round(max(self.longest_gap, gap), 3),
+                "current_gap_seconds": round(gap, 3),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+            }
+
+
+class ChunkSizer:
+    def __init__(self, minimum: int, maximum: int, adaptive: bool = True):
+        self.minimum = max(int(minimum), _CHUNK_FLOOR)
+        self.maximum = max(int(maximum), self.minimum)
+        self.adaptive = adaptive and self.maximum > self.minimum
+        self.size = self.minimum if self.adaptive else self.maximum
+        self.reads = 0
+        self.bytes = 0
+        self.read_seconds = 0.0
+        self.smallest = self.largest = self.size
+        self.changes = []  # (bytes read so far, new size), first _CHUNK_CHANGES_KEPT only
+
+    def observe(self, nbytes: int, seconds: float):
+        """Account one ``read(self.size)`` that returned ``nbytes`` after ``seconds``."""
+        self.reads += 1
+        self.bytes += nbytes
+        self.read_seconds += seconds
+        if not self.adaptive:
+            return
+        size = self.size
+        if nbytes >= size and seconds < _CHUNK_TARGET / 2:
+            size *= 2
+        elif seconds > _CHUNK_TARGET:
+            # what the client delivers per target interval, rounded down to a power of two
+            wanted = nbytes * _CHUNK_TARGET / seconds
+            while size > wanted and size > self.minimum:
+                size //= 2
+        size = min(max(size, self.minimum), self.maximum)
+        if size != self.size:
+            self.size = size
+            self.smallest = min(self.smallest, size)
+            self.largest = max(self.largest, size)
+            if len(self.changes) < _CHUNK_CHANGES_KEPT:
+                self.changes.append((self.bytes, size))
+
+    def snapshot(self):
+        return {
+            "mode": "adaptive" if self.adaptive else "static",
+            "size": self.size,
+            "smallest": self.smallest,
+            "largest": self.largest,
+            "reads": self.reads,
+            "avg_read_bytes": round(self.bytes / self.reads) if self.reads else None,
+            "avg_read_ms": round(self.read_seconds * 1000 / self.reads, 3) if self.reads else None,
+            "changes": [list(change) for change in self.changes],
+        }
+
+
+class _ActiveUploads:
+    """Heartbeats of the uploads running in this process, plus their flusher thread."""
+
+    def __init__(self):
+        self._items = set()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._telemetry_folder = None
+
+    def add(self, heartbeat, flush_interval: float, telemetry_folder):
+        with self._lock:
+            if self._pid != os.getpid():
+                # first upload in this (possibly forked) process
+                self._items = set()
+                self._pid = os.getpid()
+                if flush_interval > 0:
+                    start_daemon("td-heartbeat", lambda: self._run(flush_interval))
+            self._telemetry_folder = telemetry_folder
+            self._items.add(heartbeat)
+
+    def discard(self, heartbeat):
+        with self._lock:
+            self._items.discard(heartbeat)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._items)
+
+    def _run(self, interval: float):
+        while True:
+            time.sleep(interval)
+            stalled = 0
+            for heartbeat in self.snapshot():
+                try:
+                    stalled += heartbeat.flush()
+                except Exception:  # one broken status file must not stop the others
+                    pass
+            note_stalled_uploads(self._telemetry_folder, stalled)
+
+
+active_uploads = _ActiveUploads()
@@ -0,0 +1,339 @@
+"""Asynchronous replication of published files to peer TransferDepot instances.
+
+``enqueue`` writes one small JSON job per (peer, file) under
+``REPLICATE_FOLDER/queue``; a newer upload of the same file simply replaces
+the pending job. Jobs survive restarts and are shared by all uWSGI workers.
+
+One process per host (``LeaderLock``) runs the ``Replicator``: a dispatcher
+thread that notices due jobs and a bounded pool of sender threads. Each
+sender keeps one HTTP/1.1 keep-alive connection per peer and streams the
+file with the peer's resumable ``PUT /api/v1/upload/<group>/<file>``. Before
+retrying a version it already started, it asks the peer (``HEAD``) how many
+bytes it holds and resumes from there. Failures back off exponentially with
+jitter and are retried until they succeed or the file is gone.
+
+The queue is a ``services.jobqueue`` directory; finished jobs are appended
+to its ``done.log``, which ``status`` reads for the lag/throughput numbers
+on ``/admin/health``.
+"""
+import hashlib
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+from .delta import version_token
+from .jobqueue import (
+    QueueRunner, job_paths, leader_pid, read_done_tail, read_json, remove_if_current, retry_at,
+    save_if_current, write_json,
+)
+from .runtime import start_daemon, start_once
+from .storage import find_file, pool_volumes
+
+
+_SEND_BLOCK = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def _queue_dir(folder) -> str:
+    return os.path.join(folder, "queue")
+
+
+def _job_id(peer: str, group: str, name: str) -> str:
+    return hashlib.sha1(f"{peer}\0{group}\0{name}".encode()).hexdigest()[:20]
+
+
+def enqueue(folder, peers, group: str, path) -> int:
+    """Queue ``path`` for every peer; returns the number of jobs written."""
+    st = os.stat(path)
+    name = os.path.basename(str(path))
+    qdir = _queue_dir(folder)
+    os.makedirs(qdir, exist_ok=True)
+    now = time.time()
+    for peer in peers:
+        job_id = _job_id(peer, group, name)
+        write_json(os.path.join(qdir, f"{job_id}.json"), {
+            "id": job_id,
+            "peer": peer,
+            "group": group,
+            "file": name,
+            "size": st.st_size,
+            "version": version_token(st),
+            "created_ts": now,
+            "attempts": 0,
+            "next_try_ts": now,
+            "last_error": None,
+        })
+    return len(peers)
+
+
+class _PeerError(Exception):
+    pass
+
+
+class Replicator(QueueRunner):
+    label = "replication"
+
+    def __init__(self, folder, vols, peers, workers: int, backoff: float, backoff_max: float, timeout: float):
+        super().__init__(folder, _queue_dir(folder), "replicator.lock")
+        self.peers = set(peers)
+        self.vols = vols
+        self.workers = max(int(workers), 1)
+        self.backoff = max(float(backoff), 0.1)
+        self.backoff_max = max(float(backoff_max), self.backoff)
+        self.timeout = timeout
+        self.host = socket.gethostname()
+        self._jobs = queue.Queue()
+        self._claimed = set()
+        self._claimed_lock = threading.Lock()
+        self._local = threading.local()
+        self._started_pool = False
+
+    # --- dispatcher ---
+    def _on_leader(self):
+        if not self._started_pool:
+            for index in range(self.workers):
+                start_daemon(f"td-replicate-{index}", self._work)
+            self._started_pool = True
+
+    def _dispatch(self) -> float:
+        """Hand due jobs to the pool; returns when the next backed-off job is due."""
+        now = time.time()
+        next_due = now + 60
+        for path in job_paths(self.jobs_dir):
+            job = read_json(path)
+            if not job:
+                continue
+            if job.get("peer") not in self.peers:
+                logger.warning("dropping replication job for unconfigured peer %s", job.get("peer"))
+                os.unlink(path)
+                continue
+            due = job.get("next_try_ts") or 0
+            if due > now:
+                next_due = min(next_due, due)
+                continue
+            with self._claimed_lock:
+                if job["id"] in self._claimed:
+                    continue
+                self._claimed.add(job["id"])
+            self._jobs.put((path, job["id"]))
+        return next_due
+
+    # --- senders ---
+    def _work(self):
+        while True:
+            path, job_id = self._jobs.get()
+            try:
+                job = read_json(path)
+                if job:
+                    self._process(path, job)
+            except Exception:
+                logger.exception("replication job %s crashed", path)
+            finally:
+                with self._claimed_lock:
+                    self._claimed.discard(job_id)
+
+    def _connection(self, peer: str):
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(peer)
+        if conn is None:
+            parts = urlsplit(peer)
+            cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = conns[peer] = cls(parts.netloc, timeout=self.timeout)
+        return conn
+
+    def _drop_connection(self, peer: str):
+        conn = getattr(self._local, "conns", {}).pop(peer, None)
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _target(job) -> str:
+        base = urlsplit(job["peer"]).path.rstrip("/")
+        return f"{base}/api/v1/upload/{quote(job['group'], safe='')}/{quote(job['file'], safe='')}"
+
+    def _remote_offset(self, conn, job) -> int:
+        conn.request("HEAD", self._target(job))
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise _PeerError(f"HEAD returned {response.status}")
+        return int(response.getheader("Upload-Offset") or 0)
+
+    def _send(self, conn, job, source, offset: int, size: int):
+        conn.putrequest("PUT", self._target(job), skip_accept_encoding=True)
+        conn.putheader("Content-Type", "application/octet-stream")
+        conn.putheader("Content-Length", str(size - offset))
+        conn.putheader("Upload-Offset", str(offset))
+        conn.putheader("Upload-Length", str(size))
+        conn.putheader("X-Replicated-From", self.host)
+        conn.endheaders()
+        with open(source, "rb") as f:
+            f.seek(offset)
+            remaining = size - offset
+            while remaining:
+                chunk = f.read(min(_SEND_BLOCK, remaining))
+                if not chunk:
+                    raise _PeerError("local file shrank while sending")
+                conn.send(chunk)
+                remaining -= len(chunk)
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise _PeerError(f"PUT returned {response.status}: {body[:200].decode(errors='replace')}")
+        try:
+            result = json.loads(body)
+        except ValueError:
+            raise _PeerError("PUT returned a non-JSON answer") from None
+        if not result.get("complete"):
+            raise _PeerError(f"peer holds {result.get('offset')} of {size} bytes")
+
+    def _process(self, path: str, job):
+        found = find_file(job["group"], job["file"], self.vols)
+        try:
+            if found is None:
+                raise FileNotFoundError(job["file"])
+            source = str(found)
+            st = os.stat(source)
+        except FileNotFoundError:
+            logger.info("replication of %s/%s skipped: file is gone", job["group"], job["file"])
+            self._finish(path, job, None)
+            return
+        token = version_token(st)
+        if token != job["version"]:
+            # replaced since it was queued: send what is there now, as the
+            # newer job for it (if already written) would
+            current = read_json(path)
+            if current is not None and current.get("version") == token:
+                job = current
+            else:
+                job.update(version=token, size=st.st_size, sent_version=None)
+
+        started = time.monotonic()
+        offset = 0
+        try:
+            conn = self._connection(job["peer"])
+            if job.get("sent_version") == token:
+                offset = min(self._remote_offset(conn, job), st.st_size)
+            else:
+                job["sent_version"] = token
+                save_if_current(path, job)
+            self._send(conn, job, source, offset, st.st_size)
+        except (OSError, http.client.HTTPException, _PeerError, ValueError) as exc:
+            self._drop_connection(job["peer"])
+            job["attempts"] = job.get("attempts", 0) + 1
+            job["next_try_ts"] = retry_at(job["attempts"], self.backoff, self.backoff_max)
+            job["last_error"] = f"{type(exc).__name__}: {exc}"
+            save_if_current(path, job)
+            logger.warning(
+                "replication of %s/%s to %s failed (attempt %d): %s",
+                job["group"], job["file"], job["peer"], job["attempts"], exc,
+            )
+            return
+        self._finish(path, job, {
+            "bytes": st.st_size - offset,
+            "size": st.st_size,
+            "resumed_from": offset,
+            "seconds": round(time.monotonic() - started, 3),
+        })
+
+    def _finish(self, path: str, job, result):
+        remove_if_current(path, job)
+        if result is None:
+            return
+        now = time.time()
+        self._log_done(dict(
+            result,
+            ts=round(now, 3),
+            peer=job["peer"],
+            group=job["group"],
+            file=job["file"],
+            attempts=job.get("attempts", 0) + 1,
+            lag=round(now - job["created_ts"], 3),
+        ))
+
+
+def start_replicator(config):
+    """Start a replicator in each worker; only the lock holder sends."""
+    peers = config.get("REPLICATE_PEERS") or ()
+    folder = config.get("REPLICATE_FOLDER")
+    if not peers or not folder:
+        return
+
+    def _start():
+        replicator = Replicator(
+            folder,
+            pool_volumes(config),
+            peers,
+            config.get("REPLICATE_WORKERS", 2),
+            config.get("REPLICATE_BACKOFF", 2),
+            config.get("REPLICATE_BACKOFF_MAX", 300),
+            config.get("REPLICATE_TIMEOUT", 60),
+        )
+        start_daemon("td-replicate", replicator.run)
+
+    start_once("td-replicate", _start)
+
+
+def status(folder, peers, window: float = 3600):
+    """Summarise the queue and recent completions per peer for the health page."""
+    now = time.time()
+    summary = {
+        peer: {
+            "peer": peer,
+            "pending": 0,
+            "retrying": 0,
+            "lag_seconds": None,
+            "done": 0,
+            "bytes": 0,
+            "rate_bps": None,
+            "last_done_ts": None,
+            "last_lag": None,
+        }
+        for peer in peers
+    }
+    failing = []
+    for path in job_paths(_queue_dir(folder)):
+        job = read_json(path)
+        if not job:
+            continue
+        entry = summary.get(job["peer"])
+        if entry is None:
+            continue
+        entry["pending"] += 1
+        age = now - job.get("created_ts", now)
+        entry["lag_seconds"] = max(entry["lag_seconds"] or 0, age)
+        if job.get("last_error"):
+            entry["retrying"] += 1
+            failing.append(job)
+
+    seconds = {}
+    for record in read_done_tail(folder):
+        entry = summary.get(record.get("peer"))
+        if entry is None:
+            continue
+        entry["last_done_ts"] = record.get("ts")
+        entry["last_lag"] = record.get("lag")
+        if now - record.get("ts", 0) <= window:
+            entry["done"] += 1
+            entry["bytes"] += record.get("bytes", 0)
+            seconds[record["peer"]] = seconds.get(record["peer"], 0) + record.get("seconds", 0)
+    for peer, total in seconds.items():
+        if total > 0:
+            summary[peer]["rate_bps"] = summary[peer]["bytes"] / total
+
+    failing.sort(key=lambda job: job.get("created_ts", 0))
+    return {
+        "peers": list(summary.values()),
+        "failing": failing[:20],
+        "window": window,
+        "leader_pid": leader_pid(folder, "replicator.lock"),
+    }
@@ -0,0 +1,145 @@
+"""Process lifecycle helpers for background threads.
+
+uWSGI loads the app in the master and then forks workers; threads started
+before the fork do not survive it, so background work is registered with
+``after_fork`` and started once per worker (or immediately when running under
+the Flask dev server / tests). Services started by ``create_app`` go through
+``start_once`` so building a second app in the same process (tests, the
+benchmarks) does not start them again. Work that must only run once per host (for
+example the telemetry sampler) uses ``LeaderLock`` so one process does it and
+the others take over if it dies.
+
+Caches that every worker would otherwise fill on its first request register
+a hook with ``@warmup``; ``create_app`` runs them before the app is returned,
+so with uWSGI's default (non lazy-apps) loading the primed state is inherited
+by every forked worker.
+"""
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def after_fork(fn):
+    """Run ``fn`` in every worker process once it exists."""
+    try:
+        import uwsgi  # type: ignore
+        import uwsgidecorators  # type: ignore
+    except ImportError:  # pragma: no cover - not running under uWSGI
+        fn()
+        return
+
+    if uwsgi.worker_id() > 0:
+        # lazy-apps: we are already inside a worker
+        fn()
+    else:
+        uwsgidecorators.postfork(fn)
+
+
+_started = set()
+
+
+def start_once(name: str, fn):
+    """``after_fork(fn)`` unless something registered as ``name`` already.
+
+    Background services belong to the process, not to an app: they keep the
+    config of the first ``create_app`` that started them.
+    """
+    if name in _started:
+        return False
+    _started.add(name)
+    after_fork(fn)
+    return True
+
+
+def request_threads() -> int:
+    """Request threads of this worker (uWSGI ``threads``; 1 outside uWSGI)."""
+    try:
+        import uwsgi  # type: ignore
+    except ImportError:  # pragma: no cover - not running under uWSGI
+        return 1
+    return max(int(uwsgi.opt.get("threads", 1) or 1), 1)
+
+
+def start_daemon(name: str, target, *args):
+    thread = threading.Thread(target=target, args=args, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class LeaderLock:
+    """Non-blocking flock held for the lifetime of the process."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+
+@contextmanager
+def dir_lock(path):
+    """Exclusive ``flock`` on the directory ``path`` while the block runs.
+
+    For read-modify-write of files that are replaced by rename (heartbeat
+    records), where a lock on the file itself would not survive the rename.
+    """
+    fd = os.open(str(path), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases the flock
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_warmups = []
+
+
+def warmup(fn):
+    """Register ``fn`` to prime a cache before the worker accepts traffic."""
+    _warmups.append(fn)
+    return fn
+
+
+def run_warmups(app):
+    """Run registered warm-up hooks inside an app context; returns {name: seconds}."""
+    timings = {}
+    with app.app_context():
+        for fn in _warmups:
+            started = time.monotonic()
+            try:
+                fn()
+            except Exception as exc:  # a cold cache is not a reason to refuse to start
+                app.logger.warning("warm-up %s failed: %s", fn.__name__, exc)
+            timings[fn.__name__] = round(time.monotonic() - started, 4)
+    app.config["WARMUP_TIMINGS"] = timings
+    return timings
@@ -0,0 +1,332 @@
+"""In-memory filename index behind ``GET /api/v1/search``.
+
+``FileIndex`` holds one entry per (group, file) with size and mtime, plus
+
+* the lower-cased names in sorted order, for prefix queries and globs that
+  start with a literal (``bisect``);
+* a trigram map, trigram -> ``array('I')`` of entry ids (names are padded
+  with NUL so one- and two-letter names have trigrams too), for substring
+  queries and globs with a literal run. The shortest posting lists of the
+  query are intersected and the candidates verified against the pattern;
+  when the literal matches so many names that walking the sorted names until
+  ``limit`` hits is cheaper, the sorted names are walked instead.
+
+Removed entries leave tombstones in the posting lists; the index compacts
+itself once they outnumber a quarter of the live entries.
+
+The index is built with ``scandir`` by a warm-up hook (forked workers
+inherit it) and kept current by ``store_upload`` and retention cleanup in
+the worker that made the change. Before each query the other workers' changes
+are replayed from the per-group change feeds (only logs whose size changed
+are read), and every ``TD_SEARCH_RESCAN`` seconds a background rebuild picks
+up files that reached the volumes some other way.
+"""
+import bisect
+import fnmatch
+import os
+import re
+import threading
+import time
+from array import array
+from typing import NamedTuple
+
+from flask import current_app
+
+from .changes import last_seq, read_changes
+from .runtime import start_daemon, warmup
+from .storage import group_names, pool_volumes, scan_group
+
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+_BRACKET_RE = re.compile(r"\[[^\]]*\]")
+_CATCH_UP_BATCH = 10000
+_INTERSECT_ENOUGH = 256  # stop intersecting posting lists below this many candidates
+
+
+class _Entry(NamedTuple):
+    group: str
+    name: str
+    lname: str
+    size: int
+    mtime: float
+
+
+def _trigrams(text: str):
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+
+def _name_trigrams(lname: str):
+    return _trigrams(f"\0{lname}\0")
+
+
+def _glob_literals(pattern: str):
+    """(literal prefix, longest literal run) of a lower-cased glob pattern."""
+    match = _GLOB_CHARS.search(pattern)
+    prefix = pattern if match is None else pattern[:match.start()]
+    runs = re.split(r"[*?]", _BRACKET_RE.sub("?", pattern))
+    return prefix, max(runs, key=len)
+
+
+class FileIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []  # id -> _Entry, None once removed
+        self._ids = {}  # (group, name) -> id
+        self._order_names = []  # lower-cased names, sorted
+        self._order_ids = []  # entry id at the same position
+        self._postings = {}  # trigram -> array('I') of ids
+        self._dead = 0
+        self._loaded = 0  # ids below this were assigned in name order by _load
+        self._seen = {}  # group -> (change log size, last applied seq)
+        self._feed_lock = threading.Lock()  # one catch_up per group at a time; guards _seen
+        self.built_ts = None
+        self.build_seconds = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    # --- maintenance ---
+    def build(self, vols, changes_folder):
+        started = time.monotonic()
+        entries = []
+        for group in group_names(vols):
+            # note the feed position first: events during the scan get replayed
+            self._seen[group] = (self._log_size(changes_folder, group), last_seq(changes_folder, group))
+            entries.extend(
+                _Entry(group, item.name, item.name.lower(), item.size, item.mtime)
+                for item in scan_group(group, vols)
+            )
+        self._load(entries)
+        self.built_ts = time.time()
+        self.build_seconds = time.monotonic() - started
+        return self
+
+    def _load(self, entries):
+        """Replace the contents with ``entries`` in one pass (ids follow name order)."""
+        entries.sort(key=lambda entry: entry.lname)
+        self._entries = entries
+        self._ids = {(entry.group, entry.name): entry_id for entry_id, entry in enumerate(entries)}
+        self._order_names = [entry.lname for entry in entries]
+        self._order_ids = list(range(len(entries)))
+        self._loaded = len(entries)
+        self._postings, self._dead = {}, 0
+        for entry_id, entry in enumerate(entries):
+            for trigram in _name_trigrams(entry.lname):
+                postings = self._postings.get(trigram)
+                if postings is None:
+                    postings = self._postings[trigram] = array("I")
+                postings.append(entry_id)
+
+    @staticmethod
+    def _log_size(folder, group: str):
+        try:
+            return os.stat(os.path.join(folder, f"{group}.log")).st_size if folder else None
+        except OSError:
+            return None
+
+    def add(self, group: str, name: str, size: int, mtime: float):
+        with self._lock:
+            self._insert(group, name, size, mtime)
+
+    def remove(self, group: str, name: str):
+        with self._lock:
+            self._delete(group, name)
+
+    def _insert(self, group, name, size, mtime):
+        entry_id = self._ids.get((group, name))
+        lname = name.lower()
+        if entry_id is not None:
+            self._entries[entry_id] = _Entry(group, name, lname, size, mtime)
+            return
+        entry_id = len(self._entries)
+        self._entries.append(_Entry(group, name, lname, size, mtime))
+        self._ids[(group, name)] = entry_id
+        position = bisect.bisect_right(self._order_names, lname)
+        self._order_names.insert(position, lname)
+        self._order_ids.insert(position, entry_id)
+        for trigram in _name_trigrams(lname):
+            postings = self._postings.get(trigram)
+            if postings is None:
+                postings = self._postings[trigram] = array("I")
+            postings.append(entry_id)
+
+    def _delete(self, group, name):
+        entry_id = self._ids.pop((group, name), None)
+        if entry_id is None:
+            return
+        lname = self._entries[entry_id].lname
+        self._entries[entry_id] = None
+        position = bisect.bisect_left(self._order_names, lname)
+        while self._order_ids[position] != entry_id:
+            position += 1
+        del self._order_names[position]
+        del self._order_ids[position]
+        self._dead += 1
+        if self._dead > max(1000, len(self._ids) // 4):
+            self._compact()
+
+    def _compact(self):
+        self._load([entry for entry in self._entries if entry is not None])
+
+    def catch_up(self, changes_folder):
+        """Apply change-feed events written since the last look (by any worker)."""
+        if not changes_folder:
+            return
+        try:
+            with os.scandir(changes_folder) as it:
+                logs = [(entry.name[:-4], entry.stat().st_size) for entry in it if entry.name.endswith(".log")]
+        except OSError:
+            return
+        for group, size in logs:
+            # read, replay and store the position as one step, or two request
+            # threads replay the same batch and the slower one rolls _seen back
+            with self._feed_lock:
+                self._catch_up_group(changes_folder, group, size)
+
+    def _catch_up_group(self, changes_folder, group: str, size: int):
+        seen_size, after = self._seen.get(group, (None, 0))
+        if seen_size == size:
+            return
+        while True:
+            changes, last = read_changes(changes_folder, group, after=after, limit=_CATCH_UP_BATCH)
+            with self._lock:
+                for change in changes:
+                    if change.get("event") == "expired":
+                        self._delete(group, change["file"])
+                    else:
+                        self._insert(group, change["file"], change.get("size") or 0, change.get("ts") or 0)
+            if changes:
+                after = changes[-1]["seq"]
+            if len(changes) < _CATCH_UP_BATCH:
+                break
+        self._seen[group] = (size, max(after, last))
+
+    # --- queries ---
+    def _ordered(self, prefix: str = ""):
+        start = bisect.bisect_left(self._order_names, prefix)
+        for position in range(start, len(self._order_names)):
+            if not self._order_names[position].startswith(prefix):
+                break
+            yield self._order_ids[position]
+
+    def _candidates(self, prefix: str, literal: str, limit: int):
+        """(ids in name order, ids added since the last load) worth checking against the query."""
+        if prefix or not literal:
+            return self._ordered(prefix), ()
+        if len(literal) < 3:
+            # every name under a trigram that contains the literal matches
+            lists = [postings for trigram, postings in self._postings.items() if literal in trigram]
+            if sum(map(len, lists)) > len(self._order_ids) // 4:
+                return self._ordered(), ()  # common: the first names walked already match
+            ids = sorted(set().union(*lists))
+        else:
+            lists = sorted((self._postings.get(trigram, array("I")) for trigram in _trigrams(literal)), key=len)
+            ids = lists[0]  # posting lists are appended in id order
+            # matches if the trigrams were independent; plenty means the walk below stops early
+            estimate = len(ids)
+            for other in lists[1:]:
+                estimate *= len(other) / max(len(self._entries), 1)
+            if len(lists) > 1 and len(ids) > _INTERSECT_ENOUGH and estimate < 8 * limit:
+                candidates = set(ids)
+                for other in lists[1:]:
+                    if len(candidates) <= _INTERSECT_ENOUGH or len(other) > 8 * len(candidates):
+                        break
+                    candidates.intersection_update(other)
+                ids = sorted(candidates)
+        # ids below _loaded follow name order; later inserts come after them
+        split = bisect.bisect_left(ids, self._loaded)
+        return ids[:split], ids[split:]
+
+    def search(self, query: str, mode: str = "substring", groups=None, min_size=None, max_size=None,
+               since=None, until=None, limit: int = 100):
+        """Return (entries, truncated); entries are sorted by name, then group."""
+        lquery = query.lower()
+        if mode == "prefix":
+            prefix, literal, match = lquery, "", None
+        elif mode == "glob":
+            prefix, literal = _glob_literals(lquery)
+            match = re.compile(fnmatch.translate(lquery)).match
+        else:
+            prefix, literal, match = "", lquery, None
+            if lquery:
+                def match(lname):
+                    return lquery in lname
+
+        def keep(entry):
+            return not (
+                entry is None
+                or (groups and entry.group not in groups)
+                or (match is not None and not match(entry.lname))
+                or (min_size is not None and entry.size < min_size)
+                or (max_size is not None and entry.size > max_size)
+                or (since is not None and entry.mtime < since)
+                or (until is not None and entry.mtime > until)
+            )
+
+        results = []
+        with self._lock:
+            in_order, recent = self._candidates(prefix, literal, limit)
+            for entry_id in in_order:
+                entry = self._entries[entry_id]
+                if keep(entry):
+                    results.append(entry)
+                    if len(results) > limit:
+                        break
+            results.extend(entry for entry in map(self._entries.__getitem__, recent) if keep(entry))
+        results.sort(key=lambda entry: (entry.lname, entry.group))
+        return results[:limit], len(results) > limit
+
+
+# --- per-process index ---
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def _build(config):
+    return FileIndex().build(pool_volumes(config), config.get("CHANGES_FOLDER"))
+
+
+def _rebuild(config):
+    global _index, _rebuilding
+    try:
+        fresh = _build(config)
+        fresh.catch_up(config.get("CHANGES_FOLDER"))
+        _index = fresh
+    finally:
+        _rebuilding = False
+
+
+def get_index() -> FileIndex:
+    """The index of this worker, caught up with the change feeds."""
+    global _index, _rebuilding
+    config = current_app.config
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _build(config)
+    index = _index
+    rescan = float(config.get("SEARCH_RESCAN", 0) or 0)
+    if rescan > 0 and time.time() - index.built_ts > rescan:
+        with _index_lock:
+            if not _rebuilding:
+                _rebuilding = True
+                # keep answering from the current index meanwhile
+                start_daemon("td-search-rebuild", _rebuild, config)
+    index.catch_up(config.get("CHANGES_FOLDER"))
+    return index
+
+
+def note_file(group: str, name: str, size: int, mtime: float):
+    if _index is not None:
+        _index.add(group, name, size, mtime)
+
+
+def note_removed(group: str, name: str):
+    if _index is not None:
+        _index.remove(group, name)
+
+
+@warmup
+def warm_search_index():
+    get_index()
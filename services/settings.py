@@ -0,0 +1,360 @@
+"""Typed, frozen settings parsed once from the TD_* environment.
+
+``load_settings`` turns the environment (plus optional overrides) into a
+``Settings`` tuple; ``Settings.as_config`` produces the UPPERCASE keys the
+services read from ``current_app.config``. ``SettingsConfig`` keeps those
+keys read-only, so the tuple stays the one source of truth: different values
+mean a different app (``create_app({...})``).
+"""
+import os
+import re
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+from flask import Config
+
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RUN_DIR = os.path.join(_BASE_DIR, "run")
+
+DEFAULT_GROUPS_FILE = "/home/tux/sh1re/transferdepot-001/groups.json"
+DEFAULT_UPLOAD_FOLDER = "/home/tux/sh1re/transferdepot-001/files"
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # read size when TD_CHUNK_ADAPTIVE=0
+DEFAULT_CHUNK_MIN = 64 * 1024  # adaptive reads start here ...
+DEFAULT_CHUNK_MAX = 8 * 1024 * 1024  # ... and never grow past this
+DEFAULT_STATUS_FOLDER = os.path.join(_RUN_DIR, "status")
+DEFAULT_HEARTBEAT_INTERVAL = 30  # seconds
+DEFAULT_HEARTBEAT_RETENTION = 180  # seconds
+DEFAULT_HEARTBEAT_FLUSH = 2  # seconds between live rate/stall updates of active uploads; 0 disables
+DEFAULT_HEARTBEAT_STALL = 10  # seconds without data before an upload is flagged stalled
+DEFAULT_RETENTION_DEFAULT_DAYS = 28
+DEFAULT_RETENTION_INTERVAL = 600  # seconds between background expiry sweeps; 0 disables
+DEFAULT_ONCALL_DIR = "/home/tux/transferdepot-001/artifacts/ONCALL"
+DEFAULT_ONCALL_FILE = "oncall_board.pdf"
+DEFAULT_WRITE_POLICY = "none"
+DEFAULT_TELEMETRY_FOLDER = os.path.join(_RUN_DIR, "telemetry")
+DEFAULT_TELEMETRY_INTERVAL = 5  # seconds; 0 disables the sampler
+DEFAULT_TELEMETRY_SLOTS = 17280  # 24h of history at the default interval
+DEFAULT_CHANGES_FOLDER = os.path.join(_RUN_DIR, "changes")
+DEFAULT_CHANGES_DIGEST = "sha256"  # "none" skips hashing uploads
+DEFAULT_SIGNATURES_FOLDER = os.path.join(_RUN_DIR, "signatures")
+DEFAULT_WAIT_MAX_TIMEOUT = 60  # seconds a /files/<group>/wait call may block
+DEFAULT_WAIT_MAX_WAITERS = 0  # parked wait requests per worker process; 0 = half its uWSGI threads
+DEFAULT_WAIT_POLL_INTERVAL = 1  # seconds; only used where inotify is unavailable
+DEFAULT_WAIT_SOCKET = os.path.join(_RUN_DIR, "transferdepot-wait.sock")  # or host:port
+DEFAULT_SYSSTATS_INTERVAL = 5  # seconds; 0 samples on demand instead
+DEFAULT_SYSSTATS_HISTORY = 120  # samples kept for miniops sparklines
+DEFAULT_REPLICATE_GROUPS = "SHIRE_GATEWAY"
+DEFAULT_REPLICATE_FOLDER = os.path.join(_RUN_DIR, "replication")
+DEFAULT_REPLICATE_WORKERS = 2  # sender threads in the replicating process
+DEFAULT_REPLICATE_BACKOFF = 2  # seconds before the first retry, doubled per attempt
+DEFAULT_REPLICATE_BACKOFF_MAX = 300
+DEFAULT_REPLICATE_TIMEOUT = 60  # socket timeout towards peers
+DEFAULT_PIPELINE_FOLDER = os.path.join(_RUN_DIR, "pipeline")
+DEFAULT_PIPELINE_WORKERS = 2  # threads running post-publish stages in one process per host
+DEFAULT_PIPELINE_RETRIES = 3  # retries of a failing stage before it is marked failed
+DEFAULT_PIPELINE_BACKOFF = 2  # seconds before the first retry, doubled per attempt
+DEFAULT_PIPELINE_BACKOFF_MAX = 300
+DEFAULT_STORAGE_PLACEMENT = "file"  # or "group": keep each group on one volume
+DEFAULT_STORAGE_MIN_FREE_PERCENT = 5  # volumes below this only take uploads if all are
+DEFAULT_STORAGE_FOLDER = os.path.join(_RUN_DIR, "storage")
+DEFAULT_STORAGE_REBALANCE_INTERVAL = 3600  # seconds between passes; 0 disables
+DEFAULT_STORAGE_COLD_DAYS = 7  # only files untouched this long are moved
+DEFAULT_STORAGE_REBALANCE_SPREAD = 10  # free-space gap (percentage points) that triggers moves
+DEFAULT_STORAGE_FANOUT_GROUPS = ""  # groups stored in hashed subdirectories; "*" for all
+DEFAULT_CACHE_ENTRIES = 256  # per cache and worker
+DEFAULT_CACHE_BODY_BYTES = 32 * 1024 * 1024  # small file bodies kept in memory per worker; 0 disables
+DEFAULT_CACHE_BODY_FILE_MAX = 4 * 1024 * 1024  # larger files are always streamed from disk
+DEFAULT_CACHE_PAGE_BYTES = 8 * 1024 * 1024  # rendered / and /<group>/ pages; 0 disables
+DEFAULT_SEARCH_RESCAN = 3600  # seconds between full rebuilds of the search index; 0 never
+DEFAULT_LOG_LEVEL = "INFO"
+DEFAULT_LOG_FORMAT = "json"  # or "text"
+DEFAULT_LOG_SAMPLE = "ui.group_status:0.1,api_v1.list_files:0.1"  # endpoint:fraction logged
+DEFAULT_SLOW_REQUEST_MS = 1000  # 0 disables the slow-request ring
+DEFAULT_SLOW_REQUEST_KEEP = 100
+
+
+_WRITE_EVERY_RE = re.compile(r"^fsync-every-(\d+)-?mb$")
+
+
+def parse_write_policy(raw: str):
+    """Parse ``none`` / ``fsync-on-complete`` / ``fsync-every-N-MB`` with an
+    optional ``+dontneed`` suffix into (sync_mode, every_bytes, dontneed).
+
+    Raises ValueError for anything else, so a typo cannot quietly mean ``none``.
+    """
+    sync_mode, every_bytes, dontneed = "none", 0, False
+    for token in (raw or "").lower().split("+"):
+        token = token.strip()
+        if not token or token == "none":
+            continue
+        if token == "dontneed":
+            dontneed = True
+        elif token == "fsync-on-complete":
+            sync_mode = "complete"
+        else:
+            match = _WRITE_EVERY_RE.match(token)
+            if not match or int(match.group(1)) <= 0:
+                raise ValueError(
+                    f"unknown write policy {token!r} in {raw!r}; expected none, fsync-on-complete "
+                    "or fsync-every-N-MB, optionally with +dontneed"
+                )
+            sync_mode = "every"
+            every_bytes = int(match.group(1)) * 1024 * 1024
+    return sync_mode, every_bytes, dontneed
+
+
+def _parse_group_overrides(raw: str, convert=int):
+    overrides = {}
+    if not raw:
+        return overrides
+    for part in raw.split(","):
+        piece = part.strip()
+        if not piece:
+            continue
+        if ":" not in piece:
+            continue
+        key, value = piece.split(":", 1)
+        key = key.strip()
+        try:
+            overrides[key] = convert(value.strip())
+        except ValueError:
+            continue
+    return overrides
+
+
+def _parse_retention_overrides(raw: str):
+    return _parse_group_overrides(raw, int)
+
+
+def _parse_list(raw: str) -> Tuple[str, ...]:
+    return tuple(item.strip() for item in (raw or "").split(",") if item.strip())
+
+
+def _parse_bool(raw: str) -> bool:
+    return str(raw).strip().lower() not in ("0", "false", "no", "off", "")
+
+
+class Settings(NamedTuple):
+    groups_file: str
+    upload_folder: str
+    upload_chunk_size: int
+    upload_chunk_adaptive: bool
+    upload_chunk_min: int
+    upload_chunk_max: int
+    status_folder: str
+    heartbeat_interval: int
+    heartbeat_retention: int
+    heartbeat_flush: float
+    heartbeat_stall: float
+    retention_default_days: int
+    retention_overrides: Mapping[str, int]
+    retention_interval: float
+    oncall_dir: str
+    oncall_file: str
+    write_policy: str
+    write_policy_overrides: Mapping[str, str]
+    telemetry_folder: str
+    telemetry_interval: float
+    telemetry_slots: int
+    telemetry_interfaces: Tuple[str, ...]
+    changes_folder: str
+    changes_digest: str
+    signatures_folder: str
+    wait_max_timeout: float
+    wait_max_waiters: int
+    wait_poll_interval: float
+    wait_socket: str
+    sysstats_interval: float
+    sysstats_history: int
+    storage_volumes: Tuple[str, ...]
+    storage_placement: str
+    storage_min_free_percent: float
+    storage_folder: str
+    storage_rebalance_interval: float
+    storage_cold_days: float
+    storage_rebalance_spread: float
+    storage_fanout_groups: Tuple[str, ...]
+    replicate_groups: Tuple[str, ...]
+    replicate_peers: Tuple[str, ...]
+    replicate_folder: str
+    replicate_workers: int
+    replicate_backoff: float
+    replicate_backoff_max: float
+    replicate_timeout: float
+    pipeline_folder: str
+    pipeline_workers: int
+    pipeline_retries: int
+    pipeline_backoff: float
+    pipeline_backoff_max: float
+    pipeline_concurrency: Mapping[str, int]
+    cache_entries: int
+    cache_body_bytes: int
+    cache_body_file_max: int
+    cache_page_bytes: int
+    search_rescan: float
+    log_level: str
+    log_format: str
+    log_sample: Mapping[str, float]
+    slow_request_ms: float
+    slow_request_keep: int
+    warmup: bool
+
+    def as_config(self):
+        return {field.upper(): getattr(self, field) for field in self._fields}
+
+    def folders(self):
+        """Directories the app expects to exist at startup."""
+        return (
+            self.upload_folder,
+            *self.storage_volumes,
+            self.status_folder,
+            self.telemetry_folder,
+            self.changes_folder,
+            self.replicate_folder,
+            self.pipeline_folder,
+            self.storage_folder,
+        )
+
+
+class SettingsConfig(Config):
+    """``app.config`` whose ``Settings`` keys (and ``SETTINGS``) cannot be changed.
+
+    Other keys (TESTING, WARMUP_TIMINGS, ...) behave as in any Flask config.
+    """
+
+    def __init__(self, settings: Settings, root_path, defaults=None):
+        super().__init__(root_path, defaults)
+        dict.update(self, settings.as_config())
+        dict.__setitem__(self, "SETTINGS", settings)
+
+    @staticmethod
+    def _check(key):
+        if key == "SETTINGS" or (isinstance(key, str) and key.lower() in Settings._fields):
+            raise TypeError(f"app.config[{key!r}] comes from Settings; pass it to create_app() instead")
+
+    def __setitem__(self, key, value):
+        self._check(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._check(key)
+        super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        self._check(key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        raise TypeError("app.config holds the settings; it cannot be emptied")
+
+    def clear(self):
+        raise TypeError("app.config holds the settings; it cannot be emptied")
+
+
+def load_settings(environ: Optional[Mapping[str, str]] = None, overrides: Optional[Mapping] = None):
+    """Parse TD_* variables once; ``overrides`` use the app.config key names."""
+    env = os.environ if environ is None else environ
+    settings = Settings(
+        groups_file=env.get("TD_GROUPS_FILE", DEFAULT_GROUPS_FILE),
+        upload_folder=env.get("TD_UPLOAD_FOLDER", DEFAULT_UPLOAD_FOLDER),
+        upload_chunk_size=int(env.get("TD_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)),
+        upload_chunk_adaptive=_parse_bool(env.get("TD_CHUNK_ADAPTIVE", "1")),
+        upload_chunk_min=int(env.get("TD_CHUNK_MIN", DEFAULT_CHUNK_MIN)),
+        upload_chunk_max=int(env.get("TD_CHUNK_MAX", DEFAULT_CHUNK_MAX)),
+        status_folder=env.get("TD_STATUS_FOLDER", DEFAULT_STATUS_FOLDER),
+        heartbeat_interval=int(env.get("TD_HEARTBEAT_INTERVAL", DEFAULT_HEARTBEAT_INTERVAL)),
+        heartbeat_retention=int(env.get("TD_HEARTBEAT_RETENTION", DEFAULT_HEARTBEAT_RETENTION)),
+        heartbeat_flush=float(env.get("TD_HEARTBEAT_FLUSH", DEFAULT_HEARTBEAT_FLUSH)),
+        heartbeat_stall=float(env.get("TD_HEARTBEAT_STALL", DEFAULT_HEARTBEAT_STALL)),
+        retention_default_days=int(env.get("TD_RETENTION_DEFAULT_DAYS", DEFAULT_RETENTION_DEFAULT_DAYS)),
+        retention_overrides=MappingProxyType(
+            _parse_retention_overrides(env.get("TD_RETENTION_OVERRIDES", ""))
+        ),
+        retention_interval=float(env.get("TD_RETENTION_INTERVAL", DEFAULT_RETENTION_INTERVAL)),
+        oncall_dir=env.get("TD_ONCALL_DIR", DEFAULT_ONCALL_DIR),
+        oncall_file=env.get("TD_ONCALL_FILE", DEFAULT_ONCALL_FILE),
+        write_policy=env.get("TD_WRITE_POLICY", DEFAULT_WRITE_POLICY),
+        write_policy_overrides=MappingProxyType(
+            _parse_group_overrides(env.get("TD_WRITE_POLICY_OVERRIDES", ""), str)
+        ),
+        telemetry_folder=env.get("TD_TELEMETRY_FOLDER", DEFAULT_TELEMETRY_FOLDER),
+        telemetry_interval=float(env.get("TD_TELEMETRY_INTERVAL", DEFAULT_TELEMETRY_INTERVAL)),
+        telemetry_slots=int(env.get("TD_TELEMETRY_SLOTS", DEFAULT_TELEMETRY_SLOTS)),
+        telemetry_interfaces=_parse_list(env.get("TD_TELEMETRY_INTERFACES", "")),
+        changes_folder=env.get("TD_CHANGES_FOLDER", DEFAULT_CHANGES_FOLDER),
+        changes_digest=env.get("TD_CHANGES_DIGEST", DEFAULT_CHANGES_DIGEST),
+        signatures_folder=env.get("TD_SIGNATURES_FOLDER", DEFAULT_SIGNATURES_FOLDER),
+        wait_max_timeout=float(env.get("TD_WAIT_MAX_TIMEOUT", DEFAULT_WAIT_MAX_TIMEOUT)),
+        wait_max_waiters=int(env.get("TD_WAIT_MAX_WAITERS", DEFAULT_WAIT_MAX_WAITERS)),
+        wait_poll_interval=float(env.get("TD_WAIT_POLL_INTERVAL", DEFAULT_WAIT_POLL_INTERVAL)),
+        wait_socket=env.get("TD_WAIT_SOCKET", DEFAULT_WAIT_SOCKET),
+        sysstats_interval=float(env.get("TD_SYSSTATS_INTERVAL", DEFAULT_SYSSTATS_INTERVAL)),
+        sysstats_history=int(env.get("TD_SYSSTATS_HISTORY", DEFAULT_SYSSTATS_HISTORY)),
+        storage_volumes=_parse_list(env.get("TD_STORAGE_VOLUMES", "")),
+        storage_placement=env.get("TD_STORAGE_PLACEMENT", DEFAULT_STORAGE_PLACEMENT).lower(),
+        storage_min_free_percent=float(env.get("TD_STORAGE_MIN_FREE_PERCENT", DEFAULT_STORAGE_MIN_FREE_PERCENT)),
+        storage_folder=env.get("TD_STORAGE_FOLDER", DEFAULT_STORAGE_FOLDER),
+        storage_rebalance_interval=float(
+            env.get("TD_STORAGE_REBALANCE_INTERVAL", DEFAULT_STORAGE_REBALANCE_INTERVAL)
+        ),
+        storage_cold_days=float(env.get("TD_STORAGE_COLD_DAYS", DEFAULT_STORAGE_COLD_DAYS)),
+        storage_rebalance_spread=float(env.get("TD_STORAGE_REBALANCE_SPREAD", DEFAULT_STORAGE_REBALANCE_SPREAD)),
+        storage_fanout_groups=_parse_list(env.get("TD_STORAGE_FANOUT_GROUPS", DEFAULT_STORAGE_FANOUT_GROUPS)),
+        replicate_groups=_parse_list(env.get("TD_REPLICATE_GROUPS", DEFAULT_REPLICATE_GROUPS)),
+        replicate_peers=tuple(
+            peer.rstrip("/") for peer in _parse_list(env.get("TD_REPLICATE_PEERS", ""))
+        ),
+        replicate_folder=env.get("TD_REPLICATE_FOLDER", DEFAULT_REPLICATE_FOLDER),
+        replicate_workers=int(env.get("TD_REPLICATE_WORKERS", DEFAULT_REPLICATE_WORKERS)),
+        replicate_backoff=float(env.get("TD_REPLICATE_BACKOFF", DEFAULT_REPLICATE_BACKOFF)),
+        replicate_backoff_max=float(env.get("TD_REPLICATE_BACKOFF_MAX", DEFAULT_REPLICATE_BACKOFF_MAX)),
+        replicate_timeout=float(env.get("TD_REPLICATE_TIMEOUT", DEFAULT_REPLICATE_TIMEOUT)),
+        pipeline_folder=env.get("TD_PIPELINE_FOLDER", DEFAULT_PIPELINE_FOLDER),
+        pipeline_workers=int(env.get("TD_PIPELINE_WORKERS", DEFAULT_PIPELINE_WORKERS)),
+        pipeline_retries=int(env.get("TD_PIPELINE_RETRIES", DEFAULT_PIPELINE_RETRIES)),
+        pipeline_backoff=float(env.get("TD_PIPELINE_BACKOFF", DEFAULT_PIPELINE_BACKOFF)),
+        pipeline_backoff_max=float(env.get("TD_PIPELINE_BACKOFF_MAX", DEFAULT_PIPELINE_BACKOFF_MAX)),
+        pipeline_concurrency=MappingProxyType(
+            _parse_group_overrides(env.get("TD_PIPELINE_CONCURRENCY", ""), int)
+        ),
+        cache_entries=int(env.get("TD_CACHE_ENTRIES", DEFAULT_CACHE_ENTRIES)),
+        cache_body_bytes=int(env.get("TD_CACHE_BODY_BYTES", DEFAULT_CACHE_BODY_BYTES)),
+        cache_body_file_max=int(env.get("TD_CACHE_BODY_FILE_MAX", DEFAULT_CACHE_BODY_FILE_MAX)),
+        cache_page_bytes=int(env.get("TD_CACHE_PAGE_BYTES", DEFAULT_CACHE_PAGE_BYTES)),
+        search_rescan=float(env.get("TD_SEARCH_RESCAN", DEFAULT_SEARCH_RESCAN)),
+        log_level=env.get("TD_LOG_LEVEL", DEFAULT_LOG_LEVEL).upper(),
+        log_format=env.get("TD_LOG_FORMAT", DEFAULT_LOG_FORMAT).lower(),
+        log_sample=MappingProxyType(
+            _parse_group_overrides(env.get("TD_LOG_SAMPLE", DEFAULT_LOG_SAMPLE), float)
+        ),
+        slow_request_ms=float(env.get("TD_SLOW_REQUEST_MS", DEFAULT_SLOW_REQUEST_MS)),
+        slow_request_keep=int(env.get("TD_SLOW_REQUEST_KEEP", DEFAULT_SLOW_REQUEST_KEEP)),
+        warmup=_parse_bool(env.get("TD_WARMUP", "1")),
+    )
+    if overrides:
+        known = {
+            key.lower(): value
+            for key, value in overrides.items()
+            if key.lower() in Settings._fields
+        }
+        settings = settings._replace(**known)
+    policies = [("TD_WRITE_POLICY", settings.write_policy)]
+    policies.extend(
+        (f"TD_WRITE_POLICY_OVERRIDES ({group})", raw) for group, raw in settings.write_policy_overrides.items()
+    )
+    for name, raw in policies:
+        try:
+            parse_write_policy(raw)
+        except ValueError as exc:
+            raise ValueError(f"{name}: {exc}") from None
+    return settings
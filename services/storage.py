@@ -0,0 +1,529 @@
+"""Storage pool: one logical upload area spread over several volumes.
+
+Every volume has the same ``<volume>/<group>/<file>`` layout. The first
+volume is ``UPLOAD_FOLDER``; ``TD_STORAGE_VOLUMES`` adds more mount points.
+All code that turns a group/file into a path goes through this module:
+
+* ``find_file`` / ``scan_group`` / ``group_names`` give the merged view (a
+  name found on several volumes resolves to the first one in pool order).
+* ``place`` picks the volume for a new upload: the file's current volume if
+  it has room (so replacing stays an atomic rename), otherwise - per file or,
+  with ``TD_STORAGE_PLACEMENT=group``, per group - the volume with the most
+  free space relative to its current write load (uploads in progress in this
+  process plus writes in flight on the block device).
+* ``Rebalancer`` moves cold files from the fullest volume to the emptiest one
+  in the background; mtimes are kept and URLs never name a volume, so moved
+  files look the same to clients.
+
+A group directory can also be fanned out into 256 hashed subdirectories
+(``<group>/_3f/<file>``) so huge groups do not live in one directory. The
+layout is per group directory: a ``_fanout`` marker says new files go into
+shards, readers always look in both places, and ``migrate_group`` moves
+existing files over in place. Upload names never start with ``_`` or ``.``
+(see ``secure_filename``), so shard, marker and part file names cannot clash
+with files.
+Groups in ``TD_STORAGE_FANOUT_GROUPS`` are fanned out on their next write.
+"""
+import os
+import shutil
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from flask import current_app
+
+from .delta import version_token
+from .runtime import LeaderLock, start_daemon, start_once
+
+
+_FANOUT_MARKER = "_fanout"
+_SHARD_PREFIX = "_"
+_SHARD_COUNT = 256
+# uploads, resumes and moves still being written: ".td-<kind>.<name>"
+_PARTIAL_PREFIX = ".td-"
+_REBALANCE_BATCH_BYTES = 10 * 1024 * 1024 * 1024  # per pass, so one pass cannot hog the disks
+
+_active_writes = {}
+_active_lock = threading.Lock()
+
+
+class StoredFile(NamedTuple):
+    name: str
+    path: str
+    size: int
+    mtime: float
+    volume: str
+    version: str  # delta.version_token; the file's ETag
+
+
+class VolumeStats(NamedTuple):
+    path: str
+    total: int
+    free: int
+    free_percent: float
+    active_writes: int
+    inflight_writes: int
+
+
+def pool_volumes(config):
+    paths = [config["UPLOAD_FOLDER"]]
+    for extra in config.get("STORAGE_VOLUMES") or ():
+        if os.path.abspath(extra) not in map(os.path.abspath, paths):
+            paths.append(extra)
+    return tuple(Path(p) for p in paths)
+
+
+def volumes():
+    return pool_volumes(current_app.config)
+
+
+def primary() -> Path:
+    return volumes()[0]
+
+
+def volume_of(path, vols=None) -> Optional[Path]:
+    path = Path(path)
+    for vol in vols or volumes():
+        if vol in path.parents:
+            return vol
+    return None
+
+
+def part_name(name: str, kind: str = "part") -> str:
+    """Name of the in-flight ``kind`` file (part, resume, rebalance) that publishes as ``name``."""
+    return f"{_PARTIAL_PREFIX}{kind}.{name}"
+
+
+def is_partial(name: str) -> bool:
+    return name.startswith(_PARTIAL_PREFIX)
+
+
+# --- hashed fan-out ---
+def shard_of(name: str) -> str:
+    # a part file shards with its final name so the publishing rename stays in one directory
+    base = name.split(".", 2)[2] if is_partial(name) else name
+    return f"{_SHARD_PREFIX}{zlib.crc32(base.encode()) & (_SHARD_COUNT - 1):02x}"
+
+
+def is_fanned_out(directory) -> bool:
+    return os.path.exists(os.path.join(directory, _FANOUT_MARKER))
+
+
+def fanout_wanted(group: str) -> bool:
+    wanted = current_app.config.get("STORAGE_FANOUT_GROUPS") or ()
+    return "*" in wanted or group.upper() in {name.upper() for name in wanted}
+
+
+def fan_out(directory: Path):
+    """Create every shard, then the marker, so a marked directory is always complete."""
+    for index in range(_SHARD_COUNT):
+        (directory / f"{_SHARD_PREFIX}{index:02x}").mkdir(exist_ok=True)
+    (directory / _FANOUT_MARKER).touch()
+
+
+def file_dir(vol: Path, group: str, name: str, fanout: bool = False) -> Path:
+    """Directory a new ``name`` is written to on ``vol`` (created if needed)."""
+    directory = vol / group
+    directory.mkdir(parents=True, exist_ok=True)
+    if fanout and not is_fanned_out(directory):
+        fan_out(directory)
+    if is_fanned_out(directory):
+        return directory / shard_of(name)
+    return directory
+
+
+def _candidates(directory: Path, name: str):
+    # flat first: that is where every file lives unless its group was fanned out
+    return directory / name, directory / shard_of(name) / name
+
+
+def _is_shard(entry) -> bool:
+    try:
+        return entry.name.startswith(_SHARD_PREFIX) and entry.is_dir()
+    except OSError:
+        return False
+
+
+def _scan_dir(path, seen: dict, volume: str, partial: bool = False):
+    """Add regular files under ``path`` (and its shards) to ``seen``; one stat per file.
+
+    Part files are skipped, or with ``partial`` the only ones added.
+    """
+    shards = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if _is_shard(entry):
+                    shards.append(entry.path)
+                    continue
+                if (
+                    entry.name in seen
+                    or entry.name == _FANOUT_MARKER
+                    or is_partial(entry.name) != partial
+                ):
+                    continue
+                try:
+                    # d_type answers is_file() without a syscall; stat() is cached on the entry
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                seen[entry.name] = StoredFile(
+                    entry.name, entry.path, st.st_size, st.st_mtime, volume, version_token(st)
+                )
+    except OSError:
+        return
+    for shard in shards:
+        _scan_dir(shard, seen, volume, partial)
+
+
+# --- merged view ---
+def group_dirs(group: str, vols=None):
+    return [vol / group for vol in (vols or volumes()) if (vol / group).is_dir()]
+
+
+def leaf_dirs(group: str, vols=None):
+    """Every directory that can hold files of ``group`` (group dirs plus their shards)."""
+    leaves = []
+    for directory in group_dirs(group, vols):
+        leaves.append(directory)
+        if is_fanned_out(directory):
+            leaves.extend(directory / f"{_SHARD_PREFIX}{index:02x}" for index in range(_SHARD_COUNT))
+    return leaves
+
+
+def group_exists(group: str) -> bool:
+    return bool(group_dirs(group))
+
+
+def _locate(group: str, name: str, vols=None):
+    for vol in vols or volumes():
+        for path in _candidates(vol / group, name):
+            if path.is_file():
+                return vol, path
+    return None, None
+
+
+def find_file(group: str, name: str, vols=None) -> Optional[Path]:
+    return _locate(group, name, vols)[1]
+
+
+def scan_group(group: str, vols=None, partial: bool = False):
+    """Regular files of ``group`` across the pool, first volume wins on name clashes.
+
+    ``partial`` lists the part files of transfers in progress (or abandoned) instead.
+    """
+    seen = {}
+    for directory in group_dirs(group, vols):
+        _scan_dir(directory, seen, str(directory.parent), partial)
+    return list(seen.values())
+
+
+def group_names(vols=None):
+    names = set()
+    for vol in vols or volumes():
+        try:
+            with os.scandir(vol) as it:
+                names.update(entry.name for entry in it if entry.is_dir())
+        except OSError:
+            continue
+    return sorted(names)
+
+
+def pool_signature(vols=None):
+    """Changes whenever a group directory is added/removed on any volume."""
+    signature = []
+    for vol in vols or volumes():
+        try:
+            signature.append(os.stat(vol).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+# --- placement ---
+def _inflight_writes(path) -> int:
+    """Write requests in flight on the block device holding ``path`` (0 if unknown)."""
+    try:
+        dev = os.stat(path).st_dev
+        with open(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}/inflight") as f:
+            return int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def volume_stats(vol) -> Optional[VolumeStats]:
+    try:
+        st = os.statvfs(vol)
+    except OSError:
+        return None
+    total = st.f_blocks * st.f_frsize
+    free = st.f_bavail * st.f_frsize
+    with _active_lock:
+        active = _active_writes.get(str(vol), 0)
+    return VolumeStats(
+        str(vol),
+        total,
+        free,
+        round(100.0 * free / total, 1) if total else 0.0,
+        active,
+        _inflight_writes(vol),
+    )
+
+
+def _eligible(stats: VolumeStats, size: int, min_free_percent: float) -> bool:
+    if stats.total == 0:
+        return False
+    return 100.0 * (stats.free - size) / stats.total >= min_free_percent
+
+
+def _best(candidates):
+    return max(candidates, key=lambda s: s.free / (1 + s.active_writes + s.inflight_writes))
+
+
+def place(group: str, name: str, size: Optional[int] = None) -> Path:
+    """Return the volume a new upload of ``group/name`` should be written to."""
+    cfg = current_app.config
+    vols = volumes()
+    if len(vols) == 1:
+        return vols[0]
+    size = size or 0
+    min_free = float(cfg.get("STORAGE_MIN_FREE_PERCENT", 5))
+    stats = {str(vol): volume_stats(vol) for vol in vols}
+    ok = {path: s for path, s in stats.items() if s is not None and _eligible(s, size, min_free)}
+
+    existing, _ = _locate(group, name, vols)
+    if existing is not None and str(existing) in ok:
+        return existing
+    if cfg.get("STORAGE_PLACEMENT", "file") == "group":
+        for directory in group_dirs(group, vols):
+            if str(directory.parent) in ok and _has_entries(directory):
+                return directory.parent
+    if ok:
+        return Path(_best(ok.values()).path)
+    # every volume is below the reserve: still take the one with most room
+    usable = [s for s in stats.values() if s is not None]
+    return Path(max(usable, key=lambda s: s.free).path) if usable else vols[0]
+
+
+def _has_entries(directory) -> bool:
+    try:
+        with os.scandir(directory) as it:
+            return next(it, None) is not None
+    except OSError:
+        return False
+
+
+@contextmanager
+def writing(volume):
+    """Count an upload in progress on ``volume`` for placement decisions."""
+    key = str(volume)
+    with _active_lock:
+        _active_writes[key] = _active_writes.get(key, 0) + 1
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active_writes[key] -= 1
+
+
+def drop_other_copies(group: str, name: str, keep: Path):
+    """After publishing ``keep``, remove older copies of the same name elsewhere in the pool."""
+    for vol in volumes():
+        for path in _candidates(vol / group, name):
+            if path != keep and path.is_file():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+
+def _move_keep_newer(src, dest) -> bool:
+    """Move ``src`` to ``dest`` unless a newer upload already landed there."""
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        pass  # written after the layout switched, so it wins
+    except FileNotFoundError:
+        return False  # deleted or replaced meanwhile
+    try:
+        os.unlink(src)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _movable(entry) -> bool:
+    # in-progress uploads publish by renaming their part file, so leave those be
+    if entry.name == _FANOUT_MARKER or is_partial(entry.name):
+        return False
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
+
+
+def migrate_group(group: str, vols, flat: bool = False):
+    """Convert ``group`` to the fanned-out layout (or back with ``flat``) in place.
+
+    Files are hard-linked into place and then unlinked inside their volume,
+    so every file stays reachable throughout and keeps its inode and mtime.
+    Returns ``(moved, seconds)``; running it again picks up stragglers.
+    """
+    started = time.monotonic()
+    moved = 0
+    for directory in group_dirs(group, vols):
+        if not flat:
+            fan_out(directory)  # new uploads go to shards from here on
+            with os.scandir(directory) as it:
+                names = [entry.name for entry in it if not _is_shard(entry) and _movable(entry)]
+            for name in names:
+                moved += _move_keep_newer(directory / name, directory / shard_of(name) / name)
+            continue
+        try:
+            (directory / _FANOUT_MARKER).unlink()  # new uploads go flat from here on
+        except FileNotFoundError:
+            pass
+        with os.scandir(directory) as it:
+            shards = [entry.path for entry in it if _is_shard(entry)]
+        for shard in shards:
+            with os.scandir(shard) as it:
+                names = [entry.name for entry in it if _movable(entry)]
+            for name in names:
+                moved += _move_keep_newer(os.path.join(shard, name), directory / name)
+            try:
+                os.rmdir(shard)
+            except OSError:
+                pass  # still holds an upload in progress; the next run moves it
+    return moved, time.monotonic() - started
+
+
+# --- rebalancing ---
+class Rebalancer:
+    """Move cold files off the fullest volume while it is much fuller than the emptiest."""
+
+    def __init__(self, vols, folder, interval: float, cold_days: float, spread_percent: float):
+        self.vols = vols
+        self.interval = interval
+        self.cold_seconds = cold_days * 24 * 60 * 60
+        self.spread = spread_percent
+        self.lock = LeaderLock(os.path.join(folder, "rebalance.lock"))
+        self.moved_files = 0
+        self.moved_bytes = 0
+
+    def _stats(self):
+        stats = [volume_stats(vol) for vol in self.vols]
+        return [s for s in stats if s is not None and s.total]
+
+    def _cold_files(self, vol: Path, cutoff: float):
+        files = []
+        for name in group_names([vol]):
+            for item in scan_group(name, [vol]):
+                if item.mtime < cutoff:
+                    files.append((item.mtime, name, item))
+        files.sort()  # oldest first
+        return files
+
+    def move(self, group: str, item: StoredFile, target: Path) -> bool:
+        """Copy to ``target``, publish there, then drop the source if it did not change.
+
+        The source is renamed aside before it is compared, so a re-upload that
+        lands under its name meanwhile is a different inode and is never deleted.
+        """
+        src = Path(item.path)
+        # keep the layout the group has on its source volume
+        dest_dir = file_dir(target, group, item.name, is_fanned_out(Path(item.volume) / group))
+        dest = dest_dir / item.name
+        tmp = dest_dir / part_name(item.name, "rebalance")
+        aside = src.parent / part_name(item.name, "moving")
+        before = os.stat(src)
+        try:
+            with open(src, "rb") as fin, open(tmp, "wb") as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+                fout.flush()
+                os.fsync(fout.fileno())
+            shutil.copystat(src, tmp)
+            copied = os.stat(tmp).st_ino
+            os.replace(tmp, dest)
+        except OSError:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            return False
+        try:
+            os.rename(src, aside)
+            after = os.stat(aside)
+        except FileNotFoundError:
+            after = None
+        if after is not None and (after.st_ino, after.st_size, after.st_mtime_ns) == (
+            before.st_ino, before.st_size, before.st_mtime_ns
+        ):
+            aside.unlink()
+            return True
+        # replaced or deleted while we copied; the copy is stale
+        if after is not None:
+            _move_keep_newer(aside, src)  # put the newer upload back unless an even newer one landed
+        try:
+            if os.stat(dest).st_ino == copied:
+                dest.unlink()
+        except FileNotFoundError:
+            pass
+        return False
+
+    def run_once(self):
+        stats = self._stats()
+        if len(stats) < 2:
+            return
+        fullest = min(stats, key=lambda s: s.free_percent)
+        emptiest = max(stats, key=lambda s: s.free_percent)
+        if emptiest.free_percent - fullest.free_percent < self.spread:
+            return
+        # move until the gap is halved (or the batch limit), then re-evaluate next pass
+        budget = min(
+            _REBALANCE_BATCH_BYTES,
+            int((emptiest.free_percent - fullest.free_percent) / 200.0 * fullest.total),
+        )
+        cutoff = time.time() - self.cold_seconds
+        for _, group, item in self._cold_files(Path(fullest.path), cutoff):
+            if budget <= 0:
+                break
+            if item.size >= emptiest.free:
+                continue
+            if self.move(group, item, Path(emptiest.path)):
+                budget -= item.size
+                self.moved_files += 1
+                self.moved_bytes += item.size
+
+    def run(self):
+        while True:
+            try:
+                if self.lock.try_acquire():
+                    self.run_once()
+            except Exception:  # keep the thread alive for the next pass
+                pass
+            time.sleep(self.interval)
+
+
+def start_rebalancer(config):
+    """Start the rebalancer thread in each worker; only the lock holder moves files."""
+    vols = pool_volumes(config)
+    interval = float(config.get("STORAGE_REBALANCE_INTERVAL", 0) or 0)
+    if len(vols) < 2 or interval <= 0:
+        return
+
+    def _start():
+        rebalancer = Rebalancer(
+            vols,
+            config["STORAGE_FOLDER"],
+            interval,
+            float(config.get("STORAGE_COLD_DAYS", 7)),
+            float(config.get("STORAGE_REBALANCE_SPREAD", 10)),
+        )
+        start_daemon("td-rebalance", rebalancer.run)
+
+    start_once("td-rebalance", _start)
@@ -0,0 +1,245 @@
+"""Background system stats collector for /admin/miniops.
+
+Each worker keeps a small rolling history sampled every ``SYSSTATS_INTERVAL``
+seconds so the page never blocks a request thread (``psutil.cpu_percent``
+with an interval sleeps the caller). psutil is used when present; otherwise
+the numbers come from ``/proc`` and ``os.statvfs``.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from .runtime import start_daemon, start_once
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _load_psutil():
+    try:
+        import psutil  # type: ignore
+    except Exception:  # pragma: no cover - optional dependency
+        return None
+    return psutil
+
+
+def _uwsgi_master_pid():
+    try:
+        import uwsgi  # type: ignore
+    except ImportError:
+        return None
+    try:
+        return uwsgi.masterpid()
+    except Exception:
+        return None
+
+
+# --- /proc fallbacks ---
+def _read_cpu_times():
+    with open("/proc/stat") as f:
+        parts = f.readline().split()[1:]
+    values = [int(v) for v in parts]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values), idle
+
+
+def _read_memory_percent():
+    info = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            info[key] = int(rest.split()[0])
+    total = info.get("MemTotal")
+    available = info.get("MemAvailable", info.get("MemFree"))
+    if not total or available is None:
+        return None
+    return round(100.0 * (total - available) / total, 1)
+
+
+def _disk_percent(path):
+    st = os.statvfs(path)
+    total = st.f_blocks * st.f_frsize
+    if not total:
+        return None
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    # match df/psutil: percentage of space available to unprivileged users
+    usable = used + st.f_bavail * st.f_frsize
+    return round(100.0 * used / usable, 1) if usable else None
+
+
+def _boot_time():
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("btime"):
+                return float(line.split()[1])
+    return None
+
+
+def _read_proc_stat(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        raw = f.read()
+    # comm may contain spaces; fields resume after the closing paren
+    rest = raw[raw.rindex(")") + 2:].split()
+    ppid = int(rest[1])
+    cpu_ticks = int(rest[11]) + int(rest[12])
+    rss_pages = int(rest[21])
+    return ppid, cpu_ticks, rss_pages
+
+
+def _worker_pids(master_pid):
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            if _read_proc_stat(int(name))[0] == master_pid:
+                pids.append(int(name))
+        except (OSError, ValueError, IndexError):
+            continue
+    return sorted(pids)
+
+
+class SystemStatsCollector:
+    def __init__(self, disk_path="/", interval: float = 5.0, history: int = 120):
+        self.disk_path = disk_path
+        self.interval = interval
+        self.history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._psutil = _load_psutil()
+        self._prev_cpu = None
+        self._prev_proc = {}
+
+    # --- sampling ---
+    def _cpu_percent(self):
+        if self._psutil:
+            return self._psutil.cpu_percent(interval=None)
+        total, idle = _read_cpu_times()
+        percent = None
+        if self._prev_cpu:
+            d_total = total - self._prev_cpu[0]
+            d_idle = idle - self._prev_cpu[1]
+            if d_total > 0:
+                percent = round(100.0 * (d_total - d_idle) / d_total, 1)
+        self._prev_cpu = (total, idle)
+        return percent
+
+    def _workers(self, now):
+        master = _uwsgi_master_pid()
+        pids = _worker_pids(master) if master else [os.getpid()]
+        workers = []
+        seen = {}
+        for pid in pids:
+            try:
+                _, cpu_ticks, rss_pages = _read_proc_stat(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            cpu_seconds = cpu_ticks / float(_CLOCK_TICKS)
+            cpu_percent = None
+            prev = self._prev_proc.get(pid)
+            if prev and now > prev[0]:
+                cpu_percent = round(100.0 * (cpu_seconds - prev[1]) / (now - prev[0]), 1)
+            seen[pid] = (now, cpu_seconds)
+            workers.append({
+                "pid": pid,
+                "rss_mb": round(rss_pages * _PAGE_SIZE / (1024.0 * 1024.0), 1),
+                "cpu_percent": cpu_percent,
+            })
+        self._prev_proc = seen
+        return workers
+
+    def sample_once(self):
+        now = time.time()
+        stats = {
+            "ts": now,
+            "cpu_percent": None,
+            "memory_percent": None,
+            "disk_percent": None,
+            "load_avg": None,
+            "boot_time": None,
+            "workers": [],
+        }
+        try:
+            stats["cpu_percent"] = self._cpu_percent()
+        except Exception:
+            pass
+        try:
+            if self._psutil:
+                stats["memory_percent"] = self._psutil.virtual_memory().percent
+                stats["boot_time"] = self._psutil.boot_time()
+            else:
+                stats["memory_percent"] = _read_memory_percent()
+                stats["boot_time"] = _boot_time()
+        except Exception:
+            pass
+        try:
+            stats["disk_percent"] = _disk_percent(self.disk_path)
+        except Exception:
+            pass
+        try:
+            stats["load_avg"] = os.getloadavg()[0]
+        except Exception:
+            pass
+        try:
+            stats["workers"] = self._workers(now)
+        except Exception:
+            pass
+        with self._lock:
+            self.history.append(stats)
+        return stats
+
+    def run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.sample_once()
+            except Exception:
+                pass
+            time.sleep(max(self.interval - (time.monotonic() - started), 0.1))
+
+    # --- readers ---
+    def latest(self):
+        with self._lock:
+            return dict(self.history[-1]) if self.history else None
+
+    def series(self, key):
+        with self._lock:
+            return [entry.get(key) for entry in self.history]
+
+
+_collector = None
+
+
+def start_collector(config):
+    """Start one collector thread per worker process."""
+    interval = float(config.get("SYSSTATS_INTERVAL", 0) or 0)
+    if interval <= 0:
+        return
+    disk_path = config.get("UPLOAD_FOLDER") or "/"
+    history = int(config.get("SYSSTATS_HISTORY", 120))
+
+    def _start():
+        global _collector
+        _collector = SystemStatsCollector(disk_path, interval, history)
+        _collector.sample_once()  # prime CPU deltas
+        start_daemon("td-sysstats", _collector.run)
+
+    start_once("td-sysstats", _start)
+
+
+def get_collector():
+    return _collector
+
+
+def sparkline_points(values, width=160, height=32):
+    """Return an SVG polyline ``points`` string for the numeric values."""
+    values = [v for v in values if v is not None]
+    if len(values) < 2:
+        return ""
+    low, high = min(values), max(values)
+    span = (high - low) or 1.0
+    step = width / float(len(values) - 1)
+    return " ".join(
+        f"{i * step:.1f},{height - (v - low) / span * height:.1f}" for i, v in enumerate(values)
+    )
@@ -0,0 +1,391 @@
+"""Built-in bandwidth sampler backing /api/v1/admin/telemetry.
+
+One elected process samples ``/proc/net/dev``, ``/proc/diskstats`` and the
+upload byte counters every ``TELEMETRY_INTERVAL`` seconds into a fixed-size
+ring buffer file (``TELEMETRY_FOLDER/ring.bin``) that every worker can mmap
+and query. Each worker publishes its own cumulative upload counters in a tiny
+mmap'd ``proc-<pid>.bin`` file so the sampler can see uploads handled by the
+other processes without any IPC.
+"""
+import glob
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .runtime import LeaderLock, pid_alive, start_daemon, start_once
+
+
+FIELDS = (
+    "net_rx_bytes",
+    "net_tx_bytes",
+    "disk_read_bytes",
+    "disk_write_bytes",
+    "upload_bytes",
+    "active_uploads",
+    "stalled_uploads",
+)
+# cumulative counters become rates when downsampled; the rest are gauges
+_GAUGES = {"active_uploads", "stalled_uploads"}
+
+
+def _series_name(field: str) -> str:
+    """Column of ``field`` in downsampled series (``net_rx_bytes`` -> ``net_rx_bps``)."""
+    return field if field in _GAUGES else field.replace("_bytes", "_bps")
+
+
+# field or series column name -> field
+_FIELD_NAMES = {name: field for field in FIELDS for name in (field, _series_name(field))}
+
+_MAGIC = b"TDRB"
+_HEADER = struct.Struct("<4sIIdQ")  # magic, slots, field count, interval, head
+_RECORD = struct.Struct("<d" + "d" * len(FIELDS))  # ts + fields
+_COUNTERS = struct.Struct("<Qqq")  # upload bytes, active uploads, stalled uploads
+
+
+# --- per-process upload counters ---
+class _ProcessCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._map = None
+        self._pid = None
+
+    def _ensure(self, folder):
+        pid = os.getpid()
+        if self._map is not None and self._pid == pid:
+            return self._map
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"proc-{pid}.bin")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, _COUNTERS.size)
+            self._map = mmap.mmap(fd, _COUNTERS.size)
+        finally:
+            os.close(fd)
+        self._pid = pid
+        return self._map
+
+    def add(self, folder, nbytes=0, active=0, stalled=None):
+        if not folder:
+            return
+        with self._lock:
+            try:
+                buf = self._ensure(folder)
+            except OSError:
+                return
+            total, current, stalled_now = _COUNTERS.unpack_from(buf)
+            _COUNTERS.pack_into(
+                buf, 0, total + nbytes, current + active, stalled_now if stalled is None else stalled
+            )
+
+
+_counters = _ProcessCounters()
+
+
+def note_upload_started(folder):
+    _counters.add(folder, active=1)
+
+
+def note_upload_bytes(folder, nbytes: int):
+    _counters.add(folder, nbytes=nbytes)
+
+
+def note_upload_finished(folder):
+    _counters.add(folder, active=-1)
+
+
+def note_stalled_uploads(folder, count: int):
+    _counters.add(folder, stalled=count)
+
+
+# --- /proc readers ---
+def read_net_dev(path="/proc/net/dev", interfaces=None):
+    rx = tx = 0
+    with open(path) as f:
+        for line in f.readlines()[2:]:
+            name, _, rest = line.partition(":")
+            name = name.strip()
+            if name == "lo" or (interfaces and name not in interfaces):
+                continue
+            parts = rest.split()
+            if len(parts) < 9:
+                continue
+            rx += int(parts[0])
+            tx += int(parts[8])
+    return rx, tx
+
+
+def _physical_disks():
+    disks = set()
+    try:
+        for name in os.listdir("/sys/block"):
+            # dm-*, md*, loop* have no backing "device" link; skipping them
+            # avoids counting LVM/RAID traffic twice.
+            if os.path.exists(os.path.join("/sys/block", name, "device")):
+                disks.add(name)
+    except OSError:
+        pass
+    return disks
+
+
+def read_diskstats(path="/proc/diskstats", disks=None):
+    read_bytes = write_bytes = 0
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 10 or (disks is not None and parts[2] not in disks):
+                continue
+            read_bytes += int(parts[5]) * 512
+            write_bytes += int(parts[9]) * 512
+    return read_bytes, write_bytes
+
+
+# --- ring buffer ---
+class TelemetryRing:
+    """Fixed-size ring of samples stored in a shared file."""
+
+    def __init__(self, path, slots: int, interval: float, writable=False):
+        self.path = str(path)
+        self.slots = slots
+        self.interval = interval
+        self.writable = writable
+        self._map = None
+
+    def _open(self):
+        if self._map is not None:
+            return self._map
+        size = _HEADER.size + self.slots * _RECORD.size
+        if self.writable:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            magic, slots, nfields, _, head = _HEADER.unpack_from(self._map)
+            if magic != _MAGIC or slots != self.slots or nfields != len(FIELDS):
+                head = 0
+            _HEADER.pack_into(self._map, 0, _MAGIC, self.slots, len(FIELDS), self.interval, head)
+        else:
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+            magic, slots, nfields, interval, _ = _HEADER.unpack_from(self._map)
+            if magic != _MAGIC or nfields != len(FIELDS):
+                self._map.close()
+                self._map = None
+                raise ValueError(f"telemetry ring {self.path} has an unexpected layout")
+            self.slots, self.interval = slots, interval
+        return self._map
+
+    def append(self, ts: float, values):
+        buf = self._open()
+        head = _HEADER.unpack_from(buf)[4]
+        offset = _HEADER.size + (head % self.slots) * _RECORD.size
+        _RECORD.pack_into(buf, offset, ts, *values)
+        # bump head last so readers never see a half-written slot as newest
+        _HEADER.pack_into(buf, 0, _MAGIC, self.slots, len(FIELDS), self.interval, head + 1)
+
+    def records(self, since=None, until=None):
+        """Return samples (oldest first) as tuples of (ts, *FIELDS)."""
+        buf = self._open()
+        head = _HEADER.unpack_from(buf)[4]
+        count = min(head, self.slots)
+        out = []
+        last_ts = None
+        for seq in range(head - count, head):
+            record = _RECORD.unpack_from(buf, _HEADER.size + (seq % self.slots) * _RECORD.size)
+            ts = record[0]
+            if last_ts is not None and ts <= last_ts:
+                continue  # slot overwritten while we were reading
+            last_ts = ts
+            if since is not None and ts < since:
+                continue
+            if until is not None and ts > until:
+                continue
+            out.append(record)
+        return out
+
+
+def downsample(records, start: float, step: float):
+    """Bucket raw samples into ``step`` seconds, turning counters into rates."""
+    buckets = []
+    current = None
+    prev = None
+    for record in records:
+        if prev is None:
+            prev = record
+            continue
+        dt = record[0] - prev[0]
+        if dt <= 0:
+            prev = record
+            continue
+        index = int((record[0] - start) // step) if step > 0 else len(buckets)
+        if current is None or current["_index"] != index:
+            current = {"_index": index, "_dt": 0.0, "_sums": [0.0] * len(FIELDS), "_max": {}}
+            buckets.append(current)
+        current["_dt"] += dt
+        for pos, field in enumerate(FIELDS, start=1):
+            if field in _GAUGES:
+                current["_max"][field] = max(current["_max"].get(field, 0), record[pos])
+            else:
+                # counter resets (reboot, ring recreated) show up as negatives
+                current["_sums"][pos - 1] += max(record[pos] - prev[pos], 0)
+        prev = record
+
+    points = []
+    for bucket in buckets:
+        ts = start + bucket["_index"] * step if step > 0 else None
+        point = {"ts": ts}
+        for pos, field in enumerate(FIELDS):
+            if field in _GAUGES:
+                point[field] = bucket["_max"].get(field, 0)
+            else:
+                point[_series_name(field)] = round(bucket["_sums"][pos] / bucket["_dt"], 1)
+        points.append(point)
+    return points
+
+
+# --- sampler ---
+class TelemetrySampler:
+    def __init__(self, folder, interval: float, slots: int, interfaces=None):
+        self.folder = folder
+        self.interval = interval
+        self.ring = TelemetryRing(os.path.join(folder, "ring.bin"), slots, interval, writable=True)
+        self.lock = LeaderLock(os.path.join(folder, "sampler.lock"))
+        self.interfaces = set(interfaces) if interfaces else None
+        self.disks = _physical_disks() or None
+        self._seen = {}
+        self._upload_total = 0
+
+    def _collect_uploads(self):
+        active = stalled = 0
+        seen = {}
+        for path in glob.glob(os.path.join(self.folder, "proc-*.bin")):
+            try:
+                pid = int(os.path.basename(path)[5:-4])
+                with open(path, "rb") as f:
+                    total, current, stalled_now = _COUNTERS.unpack(f.read(_COUNTERS.size))
+            except (ValueError, OSError, struct.error):
+                continue
+            if not pid_alive(pid):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                current = stalled_now = 0
+            self._upload_total += max(total - self._seen.get(pid, 0), 0)
+            seen[pid] = total
+            active += max(current, 0)
+            stalled += max(stalled_now, 0)
+        self._seen = seen
+        return self._upload_total, active, stalled
+
+    def sample_once(self):
+        values = {}
+        try:
+            values["net_rx_bytes"], values["net_tx_bytes"] = read_net_dev(interfaces=self.interfaces)
+        except OSError:
+            values["net_rx_bytes"] = values["net_tx_bytes"] = 0
+        try:
+            values["disk_read_bytes"], values["disk_write_bytes"] = read_diskstats(disks=self.disks)
+        except OSError:
+            values["disk_read_bytes"] = values["disk_write_bytes"] = 0
+        values["upload_bytes"], values["active_uploads"], values["stalled_uploads"] = self._collect_uploads()
+        self.ring.append(time.time(), [values[field] for field in FIELDS])
+
+    def _prime(self):
+        """Continue the previous leader's upload total instead of restarting it."""
+        records = self.ring.records()
+        if records:
+            self._upload_total = int(records[-1][1 + FIELDS.index("upload_bytes")])
+        self._collect_uploads()
+
+    def run(self):
+        leading = False
+        while True:
+            started = time.monotonic()
+            try:
+                if self.lock.try_acquire():
+                    if not leading:
+                        self._prime()
+                        leading = True
+                    self.sample_once()
+            except Exception:  # keep sampling even if one pass fails
+                pass
+            time.sleep(max(self.interval - (time.monotonic() - started), 0.1))
+
+
+def start_sampler(config):
+    """Start the sampler thread in each worker; only the lock holder samples."""
+    interval = float(config.get("TELEMETRY_INTERVAL", 0) or 0)
+    folder = config.get("TELEMETRY_FOLDER")
+    if interval <= 0 or not folder:
+        return
+    slots = int(config.get("TELEMETRY_SLOTS", 17280))
+    interfaces = config.get("TELEMETRY_INTERFACES") or None
+
+    def _start():
+        sampler = TelemetrySampler(folder, interval, slots, interfaces)
+        start_daemon("td-telemetry", sampler.run)
+
+    start_once("td-telemetry", _start)
+
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value):
+    """Parse ``90``, ``10s``, ``15m``, ``1h`` or ``2d`` into seconds (None if invalid)."""
+    if not value:
+        return None
+    value = value.strip().lower()
+    unit = 1
+    if value and value[-1] in _DURATION_UNITS:
+        unit = _DURATION_UNITS[value[-1]]
+        value = value[:-1]
+    try:
+        seconds = float(value) * unit
+    except ValueError:
+        return None
+    return seconds if seconds > 0 else None
+
+
+def query(folder, since=None, until=None, step=None, fields=None):
+    """Latest sample plus a downsampled series of the ring in ``folder``.
+
+    ``fields`` limits both to those fields; each may be named by its sample
+    column (``net_rx_bytes``) or its series column (``net_rx_bps``).
+    """
+    ring = TelemetryRing(os.path.join(folder, "ring.bin"), 0, 0)
+    try:
+        records = ring.records(since=since, until=until)
+    except FileNotFoundError:
+        records = []
+    start = since if since is not None else (records[0][0] if records else 0)
+    step = step if step else ring.interval
+    latest = None
+    if records:
+        latest = {"ts": records[-1][0]}
+        latest.update(zip(FIELDS, records[-1][1:]))
+    series = downsample(records, start, step)
+    if fields is not None:
+        wanted = {_FIELD_NAMES[name] for name in fields if name in _FIELD_NAMES}
+        keep = {"ts"} | wanted | {_series_name(field) for field in wanted}
+        if latest:
+            latest = {key: value for key, value in latest.items() if key in keep}
+        series = [{key: value for key, value in point.items() if key in keep} for point in series]
+    return {
+        "interval": ring.interval,
+        "slots": ring.slots,
+        "step": step,
+        "samples": len(records),
+        "latest": latest,
+        "series": series,
+    }
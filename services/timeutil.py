@@ -0,0 +1,31 @@
+"""Time helpers shared by the API and admin views."""
+import datetime
+
+
+def parse_time_arg(value):
+    """Return a UNIX timestamp for the provided query arg or None if invalid."""
+    if not value:
+        return None
+
+    value = value.strip()
+    if not value:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    cleaned = value
+    if cleaned.endswith("Z"):
+        cleaned = cleaned[:-1] + "+00:00"
+
+    try:
+        dt = datetime.datetime.fromisoformat(cleaned)
+    except ValueError:
+        return None
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+
+    return dt.timestamp()
@@ -1,12 +1,61 @@
+import hashlib
+import os
 from flask import Blueprint, render_template, request, redirect, url_for, current_app
 from pathlib import Path
-from services.files import save_file, list_active_uploads, clear_completed_statuses
+from services import storage
+from services.cache import pages
+from services.changes import last_seq
+from services.files import form_upload, save_file, list_active_uploads, list_group_dirs, clear_completed_statuses
 
 
 GATEWAY_GROUP_NAME = "SHIRE_GATEWAY"
 
 ui_bp = Blueprint("ui", __name__)
 
+# template name -> mtime_ns of its source, so a deploy changes every ETag
+_template_stamps = {}
+
+
+def _template_stamp(name: str):
+    stamp = _template_stamps.get(name)
+    if stamp is None:
+        filename = current_app.jinja_env.get_template(name).filename
+        stamp = _template_stamps[name] = os.stat(filename).st_mtime_ns if filename else 0
+    return stamp
+
+
+def _dir_mtimes(directories):
+    mtimes = []
+    for directory in directories:
+        try:
+            mtimes.append(os.stat(directory).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def _cached_page(template: str, key: tuple, context):
+    """Render ``template`` with ``context()`` at most once per ``key``; the key also yields the ETag.
+
+    ``key`` must change whenever the page would: directory mtimes catch
+    uploads, deletes and new groups, the change-feed sequence catches a file
+    replaced in place.
+    """
+    key = (template, _template_stamp(template)) + key
+    etag = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        body = pages.get(key)
+        if body is None:
+            # cache the encoded page so the byte budget counts bytes, not characters
+            body = render_template(template, **context()).encode("utf-8")
+            pages.put(key, body, len(body))
+        response = current_app.response_class(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 
 @ui_bp.route("/favicon.ico")
 def favicon():
@@ -17,49 +66,55 @@ def favicon():
 @ui_bp.route("/")
 def index():
     """Landing page listing all available groups."""
-    upload_root = Path(current_app.config["UPLOAD_FOLDER"])
-    groups = [d.name for d in upload_root.iterdir() if d.is_dir()]
+    groups = list_group_dirs()
     control_groups = [name for name in groups if name.upper() != GATEWAY_GROUP_NAME]
     gateway_present = GATEWAY_GROUP_NAME in (name.upper() for name in groups)
-    return render_template(
-        "index.html",
+    return _cached_page("index.html", (storage.pool_signature(),), lambda: dict(
         groups=control_groups,
         gateway_present=gateway_present,
-    )
+    ))
 
 @ui_bp.route("/<group>/", methods=["GET", "POST"])
 def upload_page(group):
-    upload_root = Path(current_app.config["UPLOAD_FOLDER"])
-    folder = upload_root / group
-    folder.mkdir(parents=True, exist_ok=True)
+    if not storage.group_exists(group):
+        (storage.primary() / group).mkdir(parents=True, exist_ok=True)
 
     is_gateway = group.upper() == GATEWAY_GROUP_NAME
 
-    groups = [d.name for d in upload_root.iterdir() if d.is_dir()]
+    groups = list_group_dirs()
     control_groups = [name for name in groups if name.upper() != GATEWAY_GROUP_NAME]
     gateway_present = GATEWAY_GROUP_NAME in (name.upper() for name in groups)
 
     if request.method == "POST":
-        f = request.files.get("file")
+        f = form_upload(group)
         if f and f.filename:
             save_file(group, f)
             return redirect(url_for("ui.upload_page", group=group))
         
-    files = [f.name for f in folder.iterdir() if f.is_file()]
-    return render_template(
-        "upload.html",
+    vols = storage.volumes()
+    key = (
+        group,
+        storage.pool_signature(vols),
+        _dir_mtimes(storage.leaf_dirs(group, vols)),
+        last_seq(current_app.config.get("CHANGES_FOLDER"), group),
+    )
+    return _cached_page("upload.html", key, lambda: dict(
         group=group,
-        files=files,
+        files=[item.name for item in storage.scan_group(group, vols)],
         is_gateway=is_gateway,
         control_groups=control_groups,
         gateway_present=gateway_present,
-    )
+    ))
 
 
 @ui_bp.route("/<group>/status")
 def group_status(group):
     statuses = list_active_uploads(group)
     interval = int(current_app.config.get("HEARTBEAT_INTERVAL", 30))
+    flush = float(current_app.config.get("HEARTBEAT_FLUSH", 0) or 0)
+    if flush > 0:
+        # live rates are refreshed every few seconds; follow them
+        interval = min(interval, max(int(flush * 3), 1))
     has_active = any(s.get("status") == "in_progress" for s in statuses)
     refresh_seconds = interval if has_active else None
     cleared = request.args.get("cleared")
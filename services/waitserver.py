@@ -0,0 +1,228 @@
+"""Long-poll server for ``GET /api/v1/files/<group>/wait`` that holds no request threads.
+
+The Flask route answers the same URL, but it parks one uWSGI request thread
+per waiter, so only a few can wait at once. In production nginx sends that
+location here instead (see ``deploy/nginx-transferdepot.conf``): one asyncio
+loop keeps every waiting connection, and the process's ``FileWatcher`` (one
+inotify watch on ``CHANGES_FOLDER``) wakes the waiters of a group when its
+change feed grows. Hundreds of waiters cost a socket each, not a thread.
+
+Answers carry the same JSON as the Flask route. Cursor lookups that read the
+change feed from disk run on the default executor so the loop never blocks
+on them. uWSGI starts it next to the workers (``attach-daemon`` in
+``uwsgi.ini``); by hand::
+
+    python3 -m services.waitserver [--socket run/transferdepot-wait.sock | --socket 127.0.0.1:8082]
+
+It reads the same ``TD_*`` environment as the app; ``TD_WAIT_SOCKET`` is the
+default socket.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .logs import setup_logging
+from .settings import load_settings
+from .storage import group_dirs, pool_volumes
+from .watch import get_watcher, wait_cursor, wait_reply
+
+
+_WAIT_PATH = re.compile(r"^/api/v1/files/([^/]+)/wait$")
+_MAX_HEADER_BYTES = 64 * 1024
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+logger = logging.getLogger(__name__)
+
+
+class _BadRequest(Exception):
+    pass
+
+
+class WaitServer:
+    def __init__(self, settings):
+        self.vols = pool_volumes(settings.as_config())
+        self.max_timeout = float(settings.wait_max_timeout)
+        self.watcher = get_watcher(settings.changes_folder, float(settings.wait_poll_interval))
+        self.watcher.listeners.append(self._published)
+        self.loop = None
+        self._waiters = {}  # group -> set of futures resolved on its next publish
+
+    # --- wake-ups (watcher thread -> loop) ---
+    def _published(self, group: str):
+        self.loop.call_soon_threadsafe(self._wake, group)
+
+    def _wake(self, group: str):
+        for future in self._waiters.pop(group, ()):
+            if not future.done():
+                future.set_result(None)
+
+    # --- one request ---
+    def _prepare(self, group: str, query):
+        """Blocking part of a wait, run on the executor: returns (error, state, after_seq)."""
+        if not group or "/" in group or group.startswith(".") or not group_dirs(group, self.vols):
+            return (400, {"error": f"invalid group '{group}'"}), None, None
+        state = self.watcher.state(group)
+        after_seq = wait_cursor(state, query.get("after"), query.get("after_seq"))
+        if after_seq is None:
+            return (400, {"error": "after_seq must be an integer"}), None, None
+        return None, state, after_seq
+
+    def _newer(self, state, after_seq: int):
+        with state.cond:  # the watcher thread extends ``recent`` under it
+            return state.newer_than(after_seq)
+
+    async def wait(self, group: str, query, gone):
+        """Return (status, body), or None if the client hung up while waiting."""
+        try:
+            timeout = float(query.get("timeout", 30))
+        except ValueError:
+            timeout = 30.0
+        timeout = min(max(timeout, 0), self.max_timeout)
+        error, state, after_seq = await self.loop.run_in_executor(None, self._prepare, group, query)
+        if error is not None:
+            return error
+
+        started = self.loop.time()
+        deadline = started + timeout
+        found = self._newer(state, after_seq)
+        while not found:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            future = self.loop.create_future()
+            waiters = self._waiters.setdefault(group, set())
+            waiters.add(future)
+            try:
+                found = self._newer(state, after_seq)  # published while we registered
+                if found:
+                    break
+                done, _ = await asyncio.wait({future, gone}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiters.discard(future)
+                if not waiters and self._waiters.get(group) is waiters:
+                    del self._waiters[group]
+            if gone in done:
+                return None
+            found = self._newer(state, after_seq)
+        body = wait_reply(group, query.get("after"), after_seq, found)
+        body.update(
+            timed_out=not found,
+            busy=False,
+            retry_after=None,
+            waited=round(self.loop.time() - started, 3),
+            watcher=self.watcher.mode,
+        )
+        return 200, body
+
+    # --- HTTP/1.1 ---
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return  # client closed the keep-alive connection
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 400, {"error": "request header too large"}, False)
+                    return
+                try:
+                    method, target, keep_alive = self._parse(head)
+                except _BadRequest as exc:
+                    await self._respond(writer, 400, {"error": str(exc)}, False)
+                    return
+                parts = urlsplit(target)
+                match = _WAIT_PATH.match(parts.path)
+                if match is None:
+                    result = 404, {"error": "not found"}
+                elif method not in ("GET", "HEAD"):
+                    result = 405, {"error": "only GET is supported"}
+                else:
+                    query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+                    # GET has no body and nginx does not pipeline, so a read that
+                    # finishes before the answer means the client hung up
+                    gone = asyncio.ensure_future(reader.read(1))
+                    try:
+                        result = await self.wait(unquote(match.group(1)), query, gone)
+                    finally:
+                        gone.cancel()
+                        try:
+                            await gone  # the next readuntil needs the reader to itself
+                        except asyncio.CancelledError:
+                            pass
+                    if result is None:
+                        return
+                await self._respond(writer, *result, keep_alive, head_only=method == "HEAD")
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            logger.exception("wait request failed")
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse(head: bytes):
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise _BadRequest("malformed request line") from None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip().lower()
+        if "content-length" in headers and headers["content-length"] != "0" or "transfer-encoding" in headers:
+            raise _BadRequest("wait requests have no body")
+        connection = headers.get("connection", "")
+        keep_alive = "close" not in connection if version == "HTTP/1.1" else "keep-alive" in connection
+        return method, target, keep_alive
+
+    @staticmethod
+    async def _respond(writer, status: int, body, keep_alive: bool, head_only: bool = False):
+        payload = json.dumps(body, separators=(",", ":")).encode() + b"\n"
+        head = (
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Cache-Control: no-store\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode()
+        writer.write(head if head_only else head + payload)
+        await writer.drain()
+
+    async def serve(self, address: str):
+        self.loop = asyncio.get_running_loop()
+        if ":" in address and not address.startswith(("/", ".")):
+            host, port = address.rsplit(":", 1)
+            server = await asyncio.start_server(self.handle, host, int(port), limit=_MAX_HEADER_BYTES)
+        else:
+            if os.path.exists(address):
+                os.unlink(address)  # left over from a previous run
+            server = await asyncio.start_unix_server(self.handle, address, limit=_MAX_HEADER_BYTES)
+            os.chmod(address, 0o660)
+        logger.info("wait server on %s (watcher %s)", address, self.watcher.mode)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", help="unix socket path or host:port (default TD_WAIT_SOCKET)")
+    args = parser.parse_args(argv)
+
+    settings = load_settings()
+    setup_logging(settings)
+    if not settings.changes_folder:
+        raise SystemExit("the wait server needs the change feed (TD_CHANGES_FOLDER)")
+    server = WaitServer(settings)
+    asyncio.run(server.serve(args.socket or settings.wait_socket))
+
+
+if __name__ == "__main__":
+    main()
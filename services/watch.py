@@ -0,0 +1,320 @@
+"""Shared "new file published" watcher for the long-poll wait endpoint.
+
+Every publish appends an ``added``/``replaced`` event to the group's change
+feed (``services.changes``), so the watcher follows the feed rather than the
+group directories: waiters keep a feed ``seq`` as their cursor, which holds
+for files published with an old mtime just as for new ones.
+
+One thread per worker process owns a single inotify descriptor with one watch
+on ``CHANGES_FOLDER`` (ctypes, no extra packages); an append to
+``<group>.log`` makes the group's state read the new events. Where inotify is
+unavailable the same thread checks the size of each watched log instead.
+
+Every group keeps its newest published events in memory (primed from the
+feed when the group is first watched), so waiters are answered from that
+state and woken through a Condition - they never list a directory. The
+Flask route parks a request thread per waiter (``wait_for_files``); the
+wait server (``services.waitserver``) instead registers a ``listeners``
+callback and holds every waiter on one event loop.
+"""
+import datetime
+import os
+import select
+import struct
+import threading
+import time
+from collections import deque
+
+from .changes import last_seq, read_changes, seq_at, seq_of
+from .runtime import start_daemon
+from .timeutil import parse_time_arg
+
+
+IN_MODIFY = 0x00000002
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+_WATCH_MASK = IN_MODIFY
+_EVENT = struct.Struct("iIII")
+_PUBLISH_EVENTS = ("added", "replaced")
+_RECENT_LIMIT = 256
+
+
+def _load_inotify():
+    import ctypes  # only needed once a wait request arrives
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        init = libc.inotify_init1
+        add = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    return fd, add
+
+
+class _GroupState:
+    def __init__(self, group: str, folder: str, on_publish=None):
+        self.group = group
+        self.folder = folder  # CHANGES_FOLDER
+        self.log_path = os.path.join(folder, f"{group}.log")
+        self.log_size = None
+        self.seq = 0  # feed position applied to ``recent``
+        self.recent = deque(maxlen=_RECENT_LIMIT)  # (seq, ts, name, size), oldest first
+        self.cond = threading.Condition()
+        self._read_lock = threading.Lock()
+        self._on_publish = on_publish
+
+    def prime(self):
+        with self._read_lock:
+            self.seq = max(last_seq(self.folder, self.group) - _RECENT_LIMIT, 0)
+            with self.cond:
+                self.recent.clear()
+        self.catch_up()
+
+    def catch_up(self):
+        """Apply feed events appended since the last look; wake waiters if any were publishes."""
+        with self._read_lock:
+            try:
+                self.log_size = os.stat(self.log_path).st_size
+            except OSError:
+                self.log_size = None
+            published = []
+            while True:
+                changes, _ = read_changes(self.folder, self.group, after=self.seq, limit=_RECENT_LIMIT)
+                for change in changes:
+                    if change.get("event") in _PUBLISH_EVENTS:
+                        published.append((change["seq"], change.get("ts") or 0.0, change["file"], change.get("size")))
+                if changes:
+                    self.seq = changes[-1]["seq"]
+                if len(changes) < _RECENT_LIMIT:
+                    break
+            if published:
+                with self.cond:
+                    self.recent.extend(published)
+                    self.cond.notify_all()
+                if self._on_publish is not None:
+                    self._on_publish(self.group)
+
+    def newer_than(self, after_seq: int):
+        return [item for item in self.recent if item[0] > after_seq]
+
+    def seq_of(self, name: str):
+        """Seq of the newest publish of ``name`` still in memory, else None."""
+        for item in reversed(self.recent):
+            if item[2] == name:
+                return item[0]
+        return None
+
+    def seq_at(self, ts: float):
+        """Seq of the last publish at or before ``ts`` if memory covers that time, else None."""
+        if not self.recent or self.recent[0][1] > ts:
+            return None
+        seq = self.recent[0][0]
+        for item in self.recent:
+            if item[1] > ts:
+                break
+            seq = item[0]
+        return seq
+
+
+class FileWatcher:
+    def __init__(self, folder: str, poll_interval: float = 1.0):
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self._groups = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        loaded = _load_inotify()
+        self._fd = None
+        if loaded:
+            fd, add = loaded
+            if add(fd, folder.encode(), _WATCH_MASK) >= 0:
+                self._fd = fd
+            else:
+                # e.g. fs.inotify.max_user_watches exhausted; poll instead
+                os.close(fd)
+        self.mode = "inotify" if self._fd is not None else "polling"
+        self.waiters = 0
+        self._deadlines = []  # monotonic deadlines of the parked waiters
+        self.listeners = []  # fn(group) after new publishes, called on the watcher thread
+        self._pid = os.getpid()
+        start_daemon("td-watch", self._run)
+
+    def state(self, group: str) -> _GroupState:
+        with self._lock:
+            state = self._groups.get(group)
+            if state is not None:
+                return state
+            state = self._groups[group] = _GroupState(group, self.folder, self._published)
+        state.prime()
+        return state
+
+    def _published(self, group: str):
+        for listener in list(self.listeners):
+            listener(group)
+
+    def retry_after(self) -> float:
+        """Seconds until the first parked waiter gives its slot back at the latest."""
+        with self._lock:
+            if not self._deadlines:
+                return 0.0
+            return max(min(self._deadlines) - time.monotonic(), 0.0)
+
+    # --- background thread ---
+    def _run(self):
+        if self._fd is not None:
+            poller = select.poll()
+            poller.register(self._fd, select.POLLIN)
+        while True:
+            try:
+                if self._fd is not None:
+                    if poller.poll(self.poll_interval * 1000):
+                        self._drain()
+                else:
+                    self._poll()
+                    time.sleep(self.poll_interval)
+            except Exception:  # keep the watcher alive for the other waiters
+                time.sleep(self.poll_interval)
+
+    def _drain(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        changed = set()
+        while offset + _EVENT.size <= len(buf):
+            wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+            name = buf[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                if mask & IN_IGNORED:
+                    # the changes folder was removed; fall back to polling
+                    os.close(self._fd)
+                    self._fd = None
+                    self.mode = "polling"
+                changed.update(self._groups)
+                continue
+            name = os.fsdecode(name)
+            if name.endswith(".log"):
+                changed.add(name[:-4])
+        for group in changed:
+            state = self._groups.get(group)
+            if state is not None:
+                state.catch_up()
+
+    def _poll(self):
+        for state in list(self._groups.values()):
+            try:
+                size = os.stat(state.log_path).st_size
+            except OSError:
+                size = None
+            if size != state.log_size:
+                state.catch_up()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher(folder: str, poll_interval: float = 1.0) -> FileWatcher:
+    """Return this process's watcher, starting it on first use (post-fork)."""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None or _watcher._pid != os.getpid():
+            _watcher = FileWatcher(folder, poll_interval)
+        return _watcher
+
+
+def notify_changed(group: str):
+    """Fast path for events appended by this process (inotify also reports them)."""
+    watcher = _watcher
+    if watcher is None or watcher._pid != os.getpid():
+        return
+    state = watcher._groups.get(group)
+    if state is not None:
+        state.catch_up()
+
+
+def wait_cursor(state: _GroupState, after_raw, after_seq_raw):
+    """Change-feed seq to wait beyond: after_seq=, else after=<name-or-time>, else now.
+
+    None if ``after_seq_raw`` is not an integer.
+    """
+    if after_seq_raw is not None:
+        try:
+            return max(int(after_seq_raw), 0)
+        except ValueError:
+            return None
+    if after_raw:
+        name = os.path.basename(after_raw)
+        seq = state.seq_of(name) or seq_of(state.folder, state.group, name)
+        if seq:
+            return seq
+        after_ts = parse_time_arg(after_raw)
+        if after_ts is not None:
+            seq = state.seq_at(after_ts)
+            return seq_at(state.folder, state.group, after_ts) if seq is None else seq
+    return state.seq
+
+
+def wait_reply(group: str, after_raw, after_seq: int, found):
+    """Body fields of a wait answer for the (seq, ts, name, size) entries in ``found``."""
+    files = [
+        {
+            "name": name,
+            "size": size,
+            "seq": seq,
+            "published": datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat(),
+            "url": f"/api/v1/files/{group}/{name}",
+        }
+        for seq, ts, name, size in sorted(found, reverse=True)
+    ]
+    return {
+        "group": group,
+        "after": after_raw,
+        "after_seq": after_seq,
+        "seq": max([after_seq] + [item["seq"] for item in files]),  # pass as after_seq next time
+        "files": files,
+        "count": len(files),
+    }
+
+
+def wait_for_files(watcher: FileWatcher, state: _GroupState, after_seq: int, timeout: float, max_waiters: int):
+    """Block until files are published after feed position ``after_seq`` or ``timeout`` passes.
+
+    Returns (files, waited, busy) where files is a list of (seq, ts, name, size).
+    Once ``max_waiters`` request threads in this process are parked, further
+    calls answer immediately from memory (``busy`` True) so uploads always
+    keep a free thread.
+    """
+    started = time.monotonic()
+    deadline = started + max(timeout, 0)
+    with state.cond:
+        found = state.newer_than(after_seq)
+    if found or timeout <= 0:
+        return found, 0.0, False
+
+    with watcher._lock:
+        if watcher.waiters >= max_waiters:
+            return found, 0.0, True
+        watcher.waiters += 1
+        watcher._deadlines.append(deadline)
+    try:
+        with state.cond:
+            found = state.newer_than(after_seq)
+            while not found:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                state.cond.wait(remaining)
+                found = state.newer_than(after_seq)
+    finally:
+        with watcher._lock:
+            watcher.waiters -= 1
+            watcher._deadlines.remove(deadline)
+    return found, time.monotonic() - started, False
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# app.py builds an app at import time, so every folder must point at scratch
+# space before anything imports it
+_WORKDIR = tempfile.mkdtemp(prefix="td-tests-")
+for _name in ("UPLOAD", "STATUS", "CHANGES", "TELEMETRY", "PIPELINE", "REPLICATE", "STORAGE", "SIGNATURES"):
+    os.environ[f"TD_{_name}_FOLDER"] = os.path.join(_WORKDIR, _name.lower())
+os.environ["TD_GROUPS_FILE"] = os.path.join(_WORKDIR, "groups.json")
+os.environ["TD_TELEMETRY_INTERVAL"] = "0"
+os.environ["TD_SYSSTATS_INTERVAL"] = "0"
+os.environ["TD_LOG_LEVEL"] = "WARNING"
+
+
+@pytest.fixture
+def client():
+    from app import app
+
+    app.config["TESTING"] = True
+    return app.test_client()
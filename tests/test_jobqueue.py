@@ -0,0 +1,26 @@
+import os
+
+from services import jobqueue
+
+
+def test_save_and_remove_only_touch_the_job_they_read(tmp_path):
+    path = str(tmp_path / "job.json")
+    job = {"id": "a", "created_ts": 1.0, "attempts": 0}
+    jobqueue.write_json(path, job)
+    jobqueue.write_json(path, dict(job, created_ts=2.0))  # re-queued by a newer upload
+    jobqueue.save_if_current(path, dict(job, attempts=1))
+    jobqueue.remove_if_current(path, job)
+    assert jobqueue.read_json(path) == {"id": "a", "created_ts": 2.0, "attempts": 0}
+    assert jobqueue.job_paths(str(tmp_path)) == [path]
+    assert jobqueue.job_paths(str(tmp_path / "missing")) == []
+
+
+def test_done_log_rotates_and_tail_reads_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobqueue, "_DONE_LOG_LIMIT", 20)
+    runner = jobqueue.QueueRunner(str(tmp_path), str(tmp_path / "jobs"), "runner.lock")
+    for index in range(10):
+        runner._log_done({"n": index})
+    assert os.path.exists(tmp_path / "done.log.1")
+    records = jobqueue.read_done_tail(str(tmp_path))
+    assert records and records[-1] == {"n": 9}
+    assert jobqueue.leader_pid(str(tmp_path), "runner.lock") is None
@@ -0,0 +1,84 @@
+import io
+import os
+
+from services import storage
+
+
+def _upload(client, group, name, data=b"payload"):
+    return client.post(f"/api/v1/upload/{group}", data={"file": (io.BytesIO(data), name)})
+
+
+def _listed(client, group):
+    return {entry["name"] for entry in client.get(f"/api/v1/files/{group}").get_json()["files"]}
+
+
+def test_upload_named_like_a_temp_file_is_listed(client):
+    for name in ("x.tmp", "video.part", "notes.resume.part"):
+        assert _upload(client, "PARTS", name).status_code == 200
+    assert {"x.tmp", "video.part", "notes.resume.part"} <= _listed(client, "PARTS")
+
+
+def test_in_flight_part_files_are_hidden(client):
+    assert _upload(client, "HIDDEN", "a.bin").status_code == 200
+    with client.application.app_context():
+        directory = storage.primary() / "HIDDEN"
+        part = directory / storage.part_name("b.bin")
+        part.write_bytes(b"half")
+        assert _listed(client, "HIDDEN") == {"a.bin"}
+        partial = storage.scan_group("HIDDEN", partial=True)
+        assert [item.name for item in partial] == [part.name]
+    os.unlink(part)
+
+
+def test_part_file_shards_with_its_final_name():
+    for kind in ("part", "resume", "rebalance"):
+        assert storage.shard_of(storage.part_name("some.file.bin", kind)) == storage.shard_of("some.file.bin")
+
+
+def _pool(tmp_path):
+    from app import create_app
+
+    vols = [tmp_path / "vol0", tmp_path / "vol1"]
+    for vol in vols:
+        (vol / "G").mkdir(parents=True)
+    app = create_app({"UPLOAD_FOLDER": str(vols[0]), "STORAGE_VOLUMES": (str(vols[1]),)})
+    return app, vols
+
+
+def test_expiring_a_shadowed_copy_keeps_the_served_file(tmp_path):
+    from services.changes import read_changes
+    from services.files import cleanup_expired_files
+
+    app, vols = _pool(tmp_path)
+    served, shadow = vols[0] / "G" / "a.bin", vols[1] / "G" / "a.bin"
+    served.write_bytes(b"new")
+    shadow.write_bytes(b"old")
+    old = os.stat(shadow).st_mtime - 90 * 24 * 60 * 60
+    os.utime(shadow, (old, old))
+    with app.app_context():
+        cleanup_expired_files("G")
+        assert not shadow.exists()
+        assert storage.find_file("G", "a.bin") == served
+        changes, _ = read_changes(app.config["CHANGES_FOLDER"], "G")
+        assert not [change for change in changes if change["event"] == "expired"]
+
+
+def test_rebalance_keeps_a_reupload_that_lands_mid_move(tmp_path, monkeypatch):
+    _, vols = _pool(tmp_path)
+    src = vols[0] / "G" / "a.bin"
+    src.write_bytes(b"old")
+    item = storage.scan_group("G", [vols[0]])[0]
+    copystat = storage.shutil.copystat
+
+    def reupload(source, dest):
+        copystat(source, dest)
+        fresh = vols[0] / "G" / storage.part_name("a.bin")
+        fresh.write_bytes(b"new")
+        os.replace(fresh, src)
+
+    monkeypatch.setattr(storage.shutil, "copystat", reupload)
+    rebalancer = storage.Rebalancer(vols, str(tmp_path), 1, 0, 0)
+    assert not rebalancer.move("G", item, vols[1])
+    assert src.read_bytes() == b"new"
+    assert not (vols[1] / "G" / "a.bin").exists()
+    assert sorted(os.listdir(vols[0] / "G")) == ["a.bin"]